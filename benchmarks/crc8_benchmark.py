@@ -0,0 +1,38 @@
+"""
+micro-benchmark comparing the bitwise crc8.AddToCRC loop with the table-driven crc8.crc8_update
+
+usage: python benchmarks/crc8_benchmark.py [repeat]
+"""
+import sys
+import timeit
+
+from pjon_python.utils import crc8
+
+FRAME = bytearray([1, 21, 2, 45, 49, 97, 50, 115, 51, 100, 52, 102, 53, 103, 54, 104, 55, 106, 56, 107] * 2)
+NUMBER = 10000
+
+
+def bitwise_crc(buffer):
+    crc = 0
+    for b in buffer:
+        crc = crc8.AddToCRC(b, crc)
+    return crc
+
+
+def table_crc(buffer):
+    return crc8.crc8_update(buffer)
+
+
+def run(repeat=5):
+    assert bitwise_crc(FRAME) == table_crc(FRAME)
+    results = []
+    for name, func in [('bitwise AddToCRC', bitwise_crc), ('table crc8_update', table_crc)]:
+        best = min(timeit.repeat(lambda: func(FRAME), number=NUMBER, repeat=repeat))
+        per_frame_us = best / NUMBER * 1000000
+        results.append((name, per_frame_us))
+        print("%-20s %8.2f us per %s byte frame" % (name, per_frame_us, len(FRAME)))
+    print("speedup: %.1fx" % (results[0][1] / results[1][1]))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,143 @@
+""" asyncio client; requires python 3.6+
+
+serial port is registered with the event loop (add_reader) and packets are sent from loop timers scheduled
+at the next send deadline, so the client needs no threads. The loop is never blocked waiting for an ACK:
+the response is taken when the port becomes readable and a timer set to the ACK timeout gives it up.
+"""
+import asyncio
+import logging
+import time
+
+from pjon_python.protocol import pjon_protocol, pjon_protocol_constants
+from pjon_python.strategies import pjon_hwserial_strategy
+from pjon_python.utils import io_wait
+
+log = logging.getLogger("async-cli")
+
+
+class AsyncPjonClient(object):
+    """
+    usage:
+
+        async with AsyncPjonClient(1, serial.Serial('/dev/ttyUSB0', 115200, timeout=0.005)) as client:
+            result = await client.send(35, 'C123')   # ACK, FAIL or TIMEOUT
+            async for packet in client.packets():
+                print(packet.packet_info.sender_id, packet.payload_as_string)
+    """
+    POLL_INTERVAL = 0.001  # used for serial ports without selectable file descriptor (e.g. fakeserial)
+
+    def __init__(self, bus_addr, serial_port, received_packets_queue_size=256):
+        self._serial = serial_port
+        self._protocol = pjon_protocol.PjonProtocol(bus_addr,
+                                                    strategy=pjon_hwserial_strategy.PJONserialStrategy(serial_port))
+        self._protocol.set_receiver(self._on_packet_received)
+        self._received_packets = asyncio.Queue(maxsize=received_packets_queue_size)
+        self._dropped_packets_count = 0
+        self._loop = None
+        self._fileno = None
+        self._send_timer = None
+        self._poll_timer = None
+
+    @property
+    def protocol(self):
+        return self._protocol
+
+    @property
+    def dropped_packets_count(self):
+        """ received packets dropped because nobody consumed packets() fast enough """
+        return self._dropped_packets_count
+
+    def start(self, loop=None):
+        if self._loop is not None:
+            log.info('client already started')
+            return
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._protocol.attach_io_thread()
+        self._protocol.set_inline_response_wait(False)
+        self._protocol.set_wakeup(self._wake_up_threadsafe)
+        self._fileno = io_wait.get_selectable_fileno(self._serial)
+        if self._fileno is not None:
+            self._loop.add_reader(self._fileno, self._on_readable)
+        else:
+            self._poll_timer = self._loop.call_later(self.POLL_INTERVAL, self._poll)
+        self._service()
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._fileno is not None:
+            self._loop.remove_reader(self._fileno)
+        for timer in (self._send_timer, self._poll_timer):
+            if timer is not None:
+                timer.cancel()
+        self._send_timer = self._poll_timer = None
+        self._protocol.set_wakeup(None)
+        self._protocol.set_inline_response_wait(True)
+        self._protocol.detach_io_thread()
+        self._loop = None
+
+    async def __aenter__(self):
+        self.start(asyncio.get_event_loop())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def send(self, device_id, payload, **kwargs):
+        """ resolves with ACK, FAIL or TIMEOUT; accepts PjonProtocol.dispatch() keyword arguments and
+        delivery_timeout. block is not supported: queue space is freed by the loop this coroutine runs on """
+        if kwargs.get('block'):
+            raise ValueError("block=True would dead-lock the event loop; check for FAIL or use watermarks")
+        delivery = self._protocol.send_tracked(device_id, payload, **kwargs)
+        self._service()
+        return await asyncio.wrap_future(delivery)
+
+    def send_without_ack(self, device_id, payload):
+        header = self._protocol.get_overridden_header(request_ack=False)
+        handle = self._protocol.dispatch(device_id, payload, header=header)
+        self._service()
+        return handle
+
+    async def packets(self):
+        """ async iterator over received packets (ReceivedPacket instances) """
+        while True:
+            yield await self._received_packets.get()
+
+    def _on_packet_received(self, payload, packet_length, packet_info):
+        packet = pjon_protocol.ReceivedPacket(payload, packet_length, packet_info, receive_ts=time.time())
+        if self._received_packets.full():
+            self._received_packets.get_nowait()
+            self._dropped_packets_count += 1
+        self._received_packets.put_nowait(packet)
+
+    def _on_readable(self):
+        self._protocol.receive()
+        self._service()
+
+    def _poll(self):
+        if self._serial.inWaiting():
+            self._on_readable()
+        if self._loop is not None:
+            self._poll_timer = self._loop.call_later(self.POLL_INTERVAL, self._poll)
+
+    def _wake_up_threadsafe(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._service)
+
+    def _service(self):
+        """ sends due packets, gives up incomplete frames after the inter-byte timeout and re-arms the timer
+        for the nearest of send deadline, ACK timeout and receive timeout """
+        if self._loop is None:
+            return
+        if self._send_timer is not None:
+            self._send_timer.cancel()
+            self._send_timer = None
+        self._protocol.flush_received()
+        self._protocol.update()
+        timeout = self._protocol.time_until_next_send()
+        receive_timeout = self._protocol.time_until_receive_timeout()
+        if receive_timeout is not None and (timeout is None or receive_timeout < timeout):
+            timeout = receive_timeout
+        if timeout is not None:
+            self._send_timer = self._loop.call_later(timeout, self._service)
@@ -6,8 +6,8 @@ import fakeredis
 from threading import Thread
 from pjon_python.utils import fakeserial
 
-from pjon_python.protocol import pjon_protocol
-from pjon_python.utils import serial_utils, crc8
+from pjon_python.protocol import pjon_delivery, pjon_protocol, pjon_protocol_constants
+from pjon_python.utils import io_wait, serial_utils, crc8
 from pjon_python.strategies import pjon_hwserial_strategy
 
 bridge_id_response = [hex(ord(item)) for item in 'i_am_serial2pjon']
@@ -17,18 +17,53 @@ log = logging.getLogger("base-cli")
 
 
 class PjonIoUpdateThread(Thread):
-    def __init__(self, pjon_protocol):
+    """ sends due packets and receives incoming ones; between iterations it sleeps until serial port
+    has data, next packet is due, a packet is dispatched from another thread or an incomplete frame
+    has to be given up """
+    MAX_IDLE_SECONDS = 0.5
+
+    def __init__(self, pjon_protocol, serial_port=None):
         super(PjonIoUpdateThread, self).__init__()
         self._pjon_protocol = pjon_protocol
+        strategy = pjon_protocol.strategy
+        if getattr(strategy, 'reader_running', False):
+            # port is read by the strategy's reader thread which signals new data
+            self._io_waiter = io_wait.IoWaiter(None)
+            strategy.set_data_callback(self._io_waiter.wake)
+        else:
+            if serial_port is None:
+                serial_port = strategy._ser
+            self._io_waiter = io_wait.IoWaiter(serial_port)
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+        self._io_waiter.wake()
 
     def run(self):
-        iter_cnt = 0
-        while True:
-            #if iter_cnt % 1 == 0:
-            self._pjon_protocol.update()
-            self._pjon_protocol.receive()
-            #time.sleep(0.0008)
-            iter_cnt += 1
+        self._pjon_protocol.set_wakeup(self._io_waiter.wake)
+        self._pjon_protocol.attach_io_thread()
+        readable = True
+        try:
+            while not self._stopped:
+                self._pjon_protocol.update()
+                if readable:
+                    self._pjon_protocol.receive()
+                else:
+                    self._pjon_protocol.flush_received()
+                timeout = self._pjon_protocol.time_until_next_send()
+                if timeout is None or timeout > self.MAX_IDLE_SECONDS:
+                    timeout = self.MAX_IDLE_SECONDS
+                receive_timeout = self._pjon_protocol.time_until_receive_timeout()
+                if receive_timeout is not None and receive_timeout < timeout:
+                    timeout = receive_timeout
+                readable = self._io_waiter.wait(timeout)
+        finally:
+            self._pjon_protocol.set_wakeup(None)
+            if getattr(self._pjon_protocol.strategy, 'reader_running', False):
+                self._pjon_protocol.strategy.set_data_callback(None)
+            self._pjon_protocol.detach_io_thread()
+            self._io_waiter.close()
 
 fake_redis_cli = fakeredis.FakeStrictRedis()
 
@@ -40,7 +75,8 @@ class PjonBaseSerialClient(object):
     If com port is not specified it's assumed serial2pjon proxy is used and all available
     COM ports are scanned trying to discover the proxy.
     """
-    def __init__(self, bus_addr=1, com_port=None, baud=115200, write_timeout=0.005, timeout=0.005, transport=None):
+    def __init__(self, bus_addr=1, com_port=None, baud=115200, write_timeout=0.005, timeout=0.005, transport=None,
+                 received_packets_buffer_length=32, reader_thread=False, timing=None):
         if com_port is None:
             raise NotImplementedError("COM port not defined and serial2proxy not supported yet")
             #self._com_port = self.discover_proxy()
@@ -66,8 +102,10 @@ class PjonBaseSerialClient(object):
                 self._serial = fakeserial.Serial(com_port, baud, write_timeout=write_timeout, timeout=timeout,
                                                  transport=transport)
 
-        serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(self._serial)
-        self._protocol = pjon_protocol.PjonProtocol(bus_addr, strategy=serial_hw_strategy)
+        serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(self._serial, timing=timing)
+        self._reader_thread = reader_thread
+        self._protocol = pjon_protocol.PjonProtocol(bus_addr, strategy=serial_hw_strategy,
+                                                    received_packets_buffer_length=received_packets_buffer_length)
 
         self._started = False
 
@@ -77,24 +115,73 @@ class PjonBaseSerialClient(object):
     def set_error(self, error_function):
         self._protocol.set_error(error_function)
 
-    def send(self, device_id, payload):
-        return self._protocol.send(device_id, payload)
+    def iter_received(self, since_ts=None, sender=None):
+        return self._protocol.iter_received(since_ts=since_ts, sender=sender)
+
+    def get_last_received_packet(self, sender=None):
+        return self._protocol.get_last_received_packet(sender=sender)
+
+    def send(self, device_id, payload, priority=pjon_protocol_constants.PRIORITY_NORMAL, block=False, timeout=None,
+             delivery_timeout=None):
+        """ returns DeliveryFuture resolved with ACK, FAIL or TIMEOUT; its handle works with cancel() and status() """
+        return self._protocol.send_tracked(device_id, payload, priority=priority, block=block, timeout=timeout,
+                                           delivery_timeout=delivery_timeout)
+
+    def send_many(self, packets):
+        """ packets: iterable of (device_id, payload) or (device_id, payload, options dict);
+        returns list of DeliveryFutures """
+        return self._protocol.send_many(packets, track_delivery=True)
+
+    @staticmethod
+    def wait(deliveries, timeout=None, return_when=pjon_delivery.ALL_COMPLETED):
+        """ waits on many futures returned by send(); returns (done, not_done) sets """
+        return pjon_delivery.wait_deliveries(deliveries, timeout=timeout, return_when=return_when)
+
+    def set_watermarks(self, high, low, on_high=None, on_low=None):
+        self._protocol.set_watermarks(high, low, on_high=on_high, on_low=on_low)
+
+    def set_backoff_policy(self, policy, device_id=None):
+        self._protocol.set_backoff_policy(policy, device_id=device_id)
+
+    def get_rtt_stats(self, device_id=None):
+        return self._protocol.strategy.get_rtt_stats(device_id)
+
+    def get_priority_stats(self):
+        return self._protocol.get_priority_stats()
 
     def send_without_ack(self, device_id, payload):
-        log.debug("send_without_ack: crafting header >")
+        """ returns DeliveryFuture like send(); resolved with ACK once the frame was written """
         header = self._protocol.get_overridden_header(request_ack=False)
-        log.debug("send_without_ack: crafting header <")
-        return self._protocol.dispatch(device_id, payload, header=header)
+        return self._protocol.send_tracked(device_id, payload, header=header)
 
     def send_with_forced_sender_id(self, device_id, sender_id, payload):
+        """ returns DeliveryFuture like send() """
         header = self._protocol.get_overridden_header(include_sender_info=True)
-        return self._protocol.dispatch(device_id, payload, header=header, forced_sender_id=sender_id)
+        return self._protocol.send_tracked(device_id, payload, header=header, forced_sender_id=sender_id)
+
+    def cancel(self, handle):
+        return self._protocol.cancel(getattr(handle, 'handle', handle))
+
+    def status(self, handle):
+        return self._protocol.status(getattr(handle, 'handle', handle))
+
+    def enable_tracing(self, capacity=None):
+        """ starts recording IO events (frames rx/tx, byte timing, retries) to the in-memory ring """
+        self._protocol.tracer.enable(capacity=capacity)
+
+    def disable_tracing(self):
+        self._protocol.tracer.disable()
+
+    def dump_trace(self, clear=False):
+        return self._protocol.tracer.dump(clear=clear)
 
     def start_client(self):
         if self._started:
             log.info('client already started')
             return
-        io_thd = PjonIoUpdateThread(self._protocol)
+        if self._reader_thread:
+            self._protocol.strategy.start_reader()
+        io_thd = PjonIoUpdateThread(self._protocol, self._serial)
 
         io_thd.setDaemon(True)
 
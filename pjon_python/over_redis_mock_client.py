@@ -124,11 +124,10 @@ class OverRedisClient(object):
 
     @staticmethod
     def get_packet_info_obj_for_packet_message(packet_message):
-        packet_info = PacketInfo()
-        PacketInfo.receiver_id = packet_message['receiver_id']
-        PacketInfo.receiver_bus_id = packet_message['receiver_bus_id']
-        PacketInfo.sender_id = packet_message['sender_id']
-        PacketInfo.sender_bus_id = packet_message['sender_bus_id']
+        packet_info = PacketInfo(receiver_id=packet_message['receiver_id'],
+                                 receiver_bus_id=packet_message['receiver_bus_id'],
+                                 sender_id=packet_message['sender_id'],
+                                 sender_bus_id=packet_message['sender_bus_id'])
         payload = packet_message['payload']
         length = packet_message['payload_length']
 
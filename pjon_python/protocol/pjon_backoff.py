@@ -0,0 +1,76 @@
+""" retry delay policies for outgoing packets
+
+a policy maps attempt number (1 for the first retry) to delay in ms, added on top of packet timing.
+Any callable taking attempts and returning ms can be used in place of a policy object.
+"""
+import random
+
+from pjon_python.protocol import pjon_protocol_constants
+
+
+class BackoffPolicy(object):
+    def delay(self, attempts):
+        raise NotImplementedError()
+
+    def __call__(self, attempts):
+        return self.delay(attempts)
+
+
+class CubicBackoff(BackoffPolicy):
+    """ attempts^3 ms; retry schedule of the original PJON implementation """
+    def delay(self, attempts):
+        return attempts ** 3
+
+
+class ExponentialBackoff(BackoffPolicy):
+    """ initial * multiplier^(attempts - 1) ms limited by cap; jitter (0..1) is the fraction of
+    the delay that is randomized, 1 being 'full jitter' """
+    def __init__(self, initial=1, multiplier=2, cap=5000, jitter=0.0, rand=random.random):
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter should be in 0..1 range")
+        self._initial = initial
+        self._multiplier = multiplier
+        self._cap = cap
+        self._jitter = jitter
+        self._rand = rand
+
+    def delay(self, attempts):
+        if attempts <= 0:
+            return 0
+        # exponent is bounded so delay of a long-failing packet does not grow into a huge int
+        exponent = min(attempts - 1, 64)
+        delay = min(self._cap, self._initial * self._multiplier ** exponent)
+        if self._jitter:
+            delay -= delay * self._jitter * self._rand()
+        return delay
+
+
+class LinearBackoff(BackoffPolicy):
+    def __init__(self, step=10, cap=None):
+        self._step = step
+        self._cap = cap
+
+    def delay(self, attempts):
+        delay = self._step * attempts
+        if self._cap is not None:
+            delay = min(self._cap, delay)
+        return delay
+
+
+class FixedBackoff(BackoffPolicy):
+    def __init__(self, delay):
+        self._delay = delay
+
+    def delay(self, attempts):
+        return self._delay
+
+
+class RandomBackoff(BackoffPolicy):
+    """ uniformly random delay in 0..max_delay ms regardless of attempts; used after collisions so
+    colliding devices do not retry in lockstep """
+    def __init__(self, max_delay=pjon_protocol_constants.COLLISION_MAX_DELAY, rand=random.uniform):
+        self._max_delay = max_delay
+        self._rand = rand
+
+    def delay(self, attempts):
+        return self._rand(0, self._max_delay)
@@ -0,0 +1,56 @@
+""" futures reporting final outcome of sent packets """
+from concurrent import futures
+
+from pjon_python.protocol import pjon_protocol_constants
+
+ALL_COMPLETED = futures.ALL_COMPLETED
+FIRST_COMPLETED = futures.FIRST_COMPLETED
+
+
+class DeliveryFuture(futures.Future):
+    """ resolves with ACK, FAIL (connection lost, circuit open or queue full) or TIMEOUT (not delivered
+    within delivery timeout); cancelled if the packet is cancelled
+
+    attempts - number of transmissions made, time_to_ack - seconds from dispatch to ACK
+    """
+    def __init__(self, dispatch_ts=None):
+        super(DeliveryFuture, self).__init__()
+        self.handle = None
+        self.dispatch_ts = dispatch_ts
+        self.attempts = 0
+        self.time_to_ack = None
+
+    def resolve(self, result, attempts=0, time_to_ack=None):
+        if self.done():
+            return
+        self.attempts = attempts
+        self.time_to_ack = time_to_ack
+        self.set_result(result)
+
+    def follow(self, other):
+        """ resolves this future with the outcome of other (used when packets are coalesced) """
+        def copy_outcome(source):
+            if source.cancelled():
+                self.cancel()
+            else:
+                self.resolve(source.result(), source.attempts, source.time_to_ack)
+        other.add_done_callback(copy_outcome)
+
+    @property
+    def delivered(self):
+        return self.done() and not self.cancelled() and self.result() == pjon_protocol_constants.ACK
+
+    def __repr__(self):
+        return "<DeliveryFuture handle: %s, done: %s, attempts: %s, time_to_ack: %s>" % (
+            self.handle, self.done(), self.attempts, self.time_to_ack)
+
+
+def failed_delivery(result=pjon_protocol_constants.FAIL):
+    future = DeliveryFuture()
+    future.resolve(result)
+    return future
+
+
+def wait_deliveries(deliveries, timeout=None, return_when=ALL_COMPLETED):
+    """ waits on many delivery futures at once; returns (done, not_done) sets """
+    return futures.wait(deliveries, timeout=timeout, return_when=return_when)
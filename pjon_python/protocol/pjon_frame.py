@@ -0,0 +1,242 @@
+from pjon_python.protocol import pjon_protocol_constants
+from pjon_python.utils import crc8
+
+try:
+    unicode
+except NameError:
+    unicode = str
+
+
+def to_byte_array(payload):
+    """ converts payload passed as str, bytes or a sequence of chars / ints to bytearray """
+    if isinstance(payload, bytearray):
+        return payload
+    if isinstance(payload, unicode):
+        return bytearray(payload, 'latin-1')
+    if isinstance(payload, (bytes, memoryview)):
+        return bytearray(payload)
+    return bytearray(ord(item) if isinstance(item, (str, unicode)) else item for item in payload)
+
+
+def pack_bus_id(bus_id):
+    """ packs 4 bytes bus id (e.g. [205, 205, 205, 205]) to a 32-bit int; ints are returned unchanged """
+    if isinstance(bus_id, int):
+        return bus_id
+    bus_id = bytearray(bus_id)
+    return (bus_id[0] << 24) | (bus_id[1] << 16) | (bus_id[2] << 8) | bus_id[3]
+
+
+def unpack_bus_id(bus_id):
+    """ reverse of pack_bus_id; returns list of 4 bytes """
+    return [(bus_id >> 24) & 0xFF, (bus_id >> 16) & 0xFF, (bus_id >> 8) & 0xFF, bus_id & 0xFF]
+
+
+def get_frame_meta_length(header):
+    """ number of frame bytes other than payload: id, length, header, [sender id,] crc """
+    if header & pjon_protocol_constants.SENDER_INFO_BIT:
+        return 5
+    return 4
+
+
+def encode_frame(recipient_id, payload, header, sender_id=None, payload_length=None):
+    """ builds the whole local bus frame including CRC in a single preallocated bytearray
+
+    | ID | LENGTH | HEADER | [SENDER ID] | CONTENT | CRC |
+    """
+    payload = to_byte_array(payload)
+    if payload_length is None:
+        payload_length = len(payload)
+
+    payload_offset = get_frame_meta_length(header) - 1
+    frame_length = payload_length + payload_offset + 1
+
+    frame = bytearray(frame_length)
+    frame[0] = recipient_id
+    frame[1] = frame_length
+    frame[2] = header
+    if payload_offset == 4:
+        frame[3] = sender_id
+    frame[payload_offset:-1] = payload[:payload_length]
+    frame[-1] = crc8.crc8_update(memoryview(frame)[:-1])
+
+    return frame
+
+
+def get_payload_offset(header):
+    payload_offset = 3
+    if header & pjon_protocol_constants.MODE_BIT:
+        if header & pjon_protocol_constants.SENDER_INFO_BIT:
+            payload_offset += 9
+        else:
+            payload_offset += 4
+    elif header & pjon_protocol_constants.SENDER_INFO_BIT:
+        payload_offset += 1
+    return payload_offset
+
+
+class Frame(object):
+    """ validated frame yielded by FrameDecoder; data holds the whole frame including CRC """
+    __slots__ = ('receiver_id', 'receiver_bus_id', 'length', 'header', 'sender_id', 'data', 'payload_offset')
+
+    def __init__(self, data):
+        frame = data if isinstance(data, bytearray) else bytearray(data)
+        self.data = bytes(frame)
+        self.receiver_id = frame[pjon_protocol_constants.RECEIVER_ID_BYTE_ORDER]
+        self.length = frame[1]
+        self.header = frame[pjon_protocol_constants.RECEIVER_HEADER_BYTE_ORDER]
+        self.payload_offset = get_payload_offset(self.header)
+        self.receiver_bus_id = 0
+        if self.header & pjon_protocol_constants.MODE_BIT:
+            bus_id_offset = pjon_protocol_constants.RECEIVER_BUS_ID_WITH_NET_INFO_BYTE_ORDER
+            self.receiver_bus_id = pack_bus_id(frame[bus_id_offset:bus_id_offset + 4])
+        self.sender_id = 0
+        if self.header & pjon_protocol_constants.SENDER_INFO_BIT:
+            if self.header & pjon_protocol_constants.MODE_BIT:
+                self.sender_id = frame[pjon_protocol_constants.SENDER_ID_WITH_NET_INFO_BYTE_ORDER]
+            else:
+                self.sender_id = frame[pjon_protocol_constants.SENDER_ID_WITHOUT_NET_INFO_BYTE_ORDER]
+
+    @property
+    def shared(self):
+        return self.header & pjon_protocol_constants.MODE_BIT != 0
+
+    @property
+    def includes_sender_info(self):
+        return self.header & pjon_protocol_constants.SENDER_INFO_BIT != 0
+
+    @property
+    def acknowledge_requested(self):
+        return self.header & pjon_protocol_constants.ACK_REQUEST_BIT != 0
+
+    @property
+    def payload(self):
+        return self.data[self.payload_offset:-1]
+
+    def __str__(self):
+        return "%s -> %s [%s]" % (self.sender_id, self.receiver_id, self.payload)
+
+
+class FrameDecoder(object):
+    """ incremental frame decoder; feed() accepts chunks of any size (whatever the serial port
+    returned), keeps incomplete frames buffered between calls and yields validated frames
+
+    the decoder is resumable: its state is the buffered bytes. A frame start is accepted only
+    if length and header are consistent and, once all its bytes arrived, the CRC matches.
+    Otherwise the window slides by a single byte, so after garbage or a mid-frame start the
+    next real frame already sitting in the buffer is found without losing it. Frames for other
+    devices are skipped by their length byte in one buffer cut.
+
+    bytes of a plausible but incomplete frame are never searched for other frames (a payload
+    may well contain a CRC consistent sub-sequence); the start is given up only when its CRC
+    fails or flush() reports a gap in reception.
+    """
+    HEADER_BITS = pjon_protocol_constants.MODE_BIT | pjon_protocol_constants.SENDER_INFO_BIT | \
+        pjon_protocol_constants.ACK_REQUEST_BIT
+
+    def __init__(self, device_id, router=False, shared=False):
+        self.device_id = device_id
+        self.router = router
+        self.shared = shared
+        self._buffer = bytearray()
+        self._in_sync = True
+        self.frames_received = 0
+        self.crc_errors = 0
+        self.discarded_bytes = 0
+        self.resync_events = 0
+        self.foreign_frames_skipped = 0
+        self.truncated_frames = 0
+
+    def configure(self, device_id, router, shared):
+        self.device_id = device_id
+        self.router = router
+        self.shared = shared
+
+    @property
+    def buffered_bytes_count(self):
+        return len(self._buffer)
+
+    def get_stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'crc_errors': self.crc_errors,
+            'discarded_bytes': self.discarded_bytes,
+            'resync_events': self.resync_events,
+            'foreign_frames_skipped': self.foreign_frames_skipped,
+            'truncated_frames': self.truncated_frames,
+        }
+
+    def reset(self):
+        del self._buffer[:]
+        self._in_sync = True
+
+    def feed(self, chunk):
+        """ returns iterator of frames completed by the chunk (and the bytes buffered before it) """
+        if chunk:
+            self._buffer.extend(chunk)
+        return self._decode()
+
+    def flush(self):
+        """ to be called after a gap in reception: frames still incomplete will never finish so
+        their starts are given up and the rest of the buffer is rescanned; returns iterator of frames """
+        return self._decode(final=True)
+
+    def is_for_this_device(self, receiver_id):
+        return receiver_id == self.device_id or receiver_id == pjon_protocol_constants.BROADCAST or self.router
+
+    def get_plausible_frame_length(self, receiver_id, length, header):
+        """ returns frame length if the 3 bytes can start a frame on this bus, None otherwise """
+        if header & ~self.HEADER_BITS:
+            return None
+
+        if length >= pjon_protocol_constants.PACKET_MAX_LENGTH or length <= get_payload_offset(header):
+            return None
+
+        # Keep private and shared buses apart
+        if bool(header & pjon_protocol_constants.MODE_BIT) != bool(self.shared) and not self.router:
+            return None
+
+        return length
+
+    def _slide(self, count=1):
+        """ drops the first buffered bytes; the rest is rescanned for the next frame start """
+        del self._buffer[:count]
+        self.discarded_bytes += count
+        self._in_sync = False
+
+    def _decode(self, final=False):
+        buffer = self._buffer
+        while len(buffer) >= 3:
+            length = self.get_plausible_frame_length(buffer[0], buffer[1], buffer[2])
+            if length is None:
+                self._slide()
+                continue
+
+            if len(buffer) < length:
+                if not final:
+                    return
+                self.truncated_frames += 1
+                self._slide()
+                continue
+
+            if crc8.crc8_update(buffer[:length - 1]) != buffer[length - 1]:
+                self.crc_errors += 1
+                self._slide()
+                continue
+
+            if not self._in_sync:
+                self.resync_events += 1
+                self._in_sync = True
+
+            if not self.is_for_this_device(buffer[0]):
+                # frame for another device is dropped as a whole, its content is never rescanned
+                del buffer[:length]
+                self.foreign_frames_skipped += 1
+                continue
+
+            frame = Frame(buffer[:length])
+            del buffer[:length]
+            self.frames_received += 1
+            yield frame
+
+        if final and buffer:
+            self._slide(len(buffer))
@@ -0,0 +1,127 @@
+import itertools
+from collections import OrderedDict
+
+from pjon_python.protocol import pjon_protocol_constants
+
+BREAKER_CLOSED = 0
+BREAKER_OPEN = 1
+BREAKER_HALF_OPEN = 2
+
+
+class OutgoingPacketsTable(object):
+    """ outgoing packets indexed by stable handles
+
+    handles are allocated from a monotonically increasing counter and never reused, so a handle
+    returned by dispatch() stays valid (or becomes unknown) no matter which other packets are
+    removed. Insertion and removal are O(1); iteration follows insertion order.
+    """
+    def __init__(self):
+        self._packets = OrderedDict()
+        self._handles = itertools.count()
+
+    def allocate_handle(self):
+        """ safe to call from any thread """
+        handle = next(self._handles)
+        if handle == pjon_protocol_constants.FAIL:  # dispatch() returns FAIL on error so it can't be a handle
+            handle = next(self._handles)
+        return handle
+
+    def add(self, outgoing_packet):
+        outgoing_packet.handle = self.allocate_handle()
+        return self.insert(outgoing_packet)
+
+    def insert(self, outgoing_packet):
+        """ adds packet with handle already allocated """
+        self._packets[outgoing_packet.handle] = outgoing_packet
+        return outgoing_packet.handle
+
+    def remove(self, handle):
+        """ returns removed packet or None if the handle is unknown """
+        return self._packets.pop(handle, None)
+
+    def get(self, handle, default=None):
+        return self._packets.get(handle, default)
+
+    def handles(self):
+        return list(self._packets.keys())
+
+    def __getitem__(self, handle):
+        return self._packets[handle]
+
+    def __contains__(self, handle):
+        return handle in self._packets
+
+    def __len__(self):
+        return len(self._packets)
+
+    def __iter__(self):
+        return iter(list(self._packets.values()))
+
+    def __str__(self):
+        return "[%s]" % ", ".join(str(outgoing_packet) for outgoing_packet in self._packets.values())
+
+
+class DestinationState(object):
+    """ per-destination bookkeeping: number of queued packets and circuit breaker
+
+    breaker opens when the destination is declared lost (CONNECTION_LOST); while open new packets are
+    rejected and queued ones are held. Once probe interval elapses the breaker is half-open and the next
+    packet is let through as a probe - ACK closes the breaker, failure re-opens it for another interval.
+    """
+    __slots__ = ('device_id', 'queued', 'breaker', 'next_probe_ts', 'trips', 'backoff_policy')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.backoff_policy = None  # None - client-wide policy applies
+        self.queued = 0
+        self.breaker = BREAKER_CLOSED
+        self.next_probe_ts = None
+        self.trips = 0
+
+    def trip(self, now, probe_interval):
+        self.breaker = BREAKER_OPEN
+        self.next_probe_ts = now + probe_interval
+        self.trips += 1
+
+    def close(self):
+        self.breaker = BREAKER_CLOSED
+        self.next_probe_ts = None
+
+    def rejects(self, now):
+        """ read-only check usable outside the IO thread """
+        return self.breaker == BREAKER_OPEN and now < self.next_probe_ts
+
+    def accepts(self, now):
+        """ False while breaker is open and probe is not due yet """
+        if self.breaker == BREAKER_OPEN and now >= self.next_probe_ts:
+            self.breaker = BREAKER_HALF_OPEN
+        return self.breaker != BREAKER_OPEN
+
+    def __str__(self):
+        return "device_id: %s, queued: %s, breaker: %s, trips: %s" % (self.device_id, self.queued, self.breaker,
+                                                                      self.trips)
+
+
+class PriorityClassStats(object):
+    """ counters of a single priority class; wait is the time a packet spent due but not yet sent """
+    __slots__ = ('queued', 'sent', 'total_wait', 'max_wait')
+
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_send(self, wait):
+        self.sent += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def as_dict(self):
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait,
+        }
@@ -1,16 +1,30 @@
+import functools
+import heapq
+import itertools
 import logging
-import math
-import random
+import threading
 import time
+from collections import OrderedDict, deque
 
 from pjon_python.protocol import pjon_protocol_constants
-from pjon_python.utils import crc8
+from pjon_python.protocol.pjon_backoff import CubicBackoff, RandomBackoff
+from pjon_python.protocol.pjon_delivery import DeliveryFuture
+from pjon_python.protocol.pjon_frame import encode_frame, FrameDecoder, pack_bus_id, to_byte_array
+from pjon_python.protocol import pjon_outgoing
+from pjon_python.protocol.pjon_outgoing import DestinationState, OutgoingPacketsTable, PriorityClassStats
+from pjon_python.protocol.pjon_received_store import ReceivedPacketsStore
+from pjon_python.utils import crc8, tracing
+
 
 try:
-    xrange
+    unicode
 except NameError:
-    xrange = range
+    unicode = str
+
 
+_OP_DISPATCH = 0
+_OP_CANCEL = 1
+_OP_CALL = 2
 
 log = logging.getLogger("pjon-prot")
 '''
@@ -62,25 +76,42 @@ PJON v4.2
 
 
 class PacketInfo(object):
-    id = 0
-    header = 0
-    receiver_id = 0
-    receiver_bus_id = [0, 0, 0, 0]
-    sender_id = 0
-    sender_bus_id = [0, 0, 0, 0]
+    """ immutable packet metadata; bus ids are packed to 32-bit ints (see pack_bus_id) """
+    __slots__ = ('id', 'header', 'receiver_id', 'receiver_bus_id', 'sender_id', 'sender_bus_id')
+
+    def __init__(self, id=0, header=0, receiver_id=0, receiver_bus_id=0, sender_id=0, sender_bus_id=0):
+        init = object.__setattr__
+        init(self, 'id', id)
+        init(self, 'header', header)
+        init(self, 'receiver_id', receiver_id)
+        init(self, 'receiver_bus_id', pack_bus_id(receiver_bus_id))
+        init(self, 'sender_id', sender_id)
+        init(self, 'sender_bus_id', pack_bus_id(sender_bus_id))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PacketInfo is immutable")
 
     def __str__(self):
         return "%s -> %s" % (self.sender_id, self.receiver_id)
 
 
 class ReceivedPacket(object):
-    def __init__(self, payload, packet_length, packet_info):
+    """ received packet; payload is kept as passed (bytes for packets received by PjonProtocol)
+    and the payload_as_* views are computed on first access and cached """
+    __slots__ = ('_payload', '_packet_length', '_packet_info', '_receive_ts', '_send_ts', '_send_attempts_count',
+                 '_payload_bytes', '_payload_string', '_payload_chars', '_payload_view')
+
+    def __init__(self, payload, packet_length, packet_info, receive_ts=None):
         self._payload = payload
         self._packet_length = packet_length
         self._packet_info = packet_info
-        self._receive_ts = None
+        self._receive_ts = receive_ts
         self._send_ts = None
         self._send_attempts_count = None
+        self._payload_bytes = None
+        self._payload_string = None
+        self._payload_chars = None
+        self._payload_view = None
 
     @property
     def payload(self):
@@ -88,15 +119,34 @@ class ReceivedPacket(object):
 
     @property
     def payload_as_string(self):
-        return self.payload
+        if self._payload_string is None:
+            if isinstance(self._payload, (str, unicode)):
+                self._payload_string = self._payload
+            else:
+                self._payload_string = self.payload_as_bytes.decode('latin-1')
+        return self._payload_string
 
     @property
     def payload_as_chars(self):
-        return [item for item in self._payload]
+        if self._payload_chars is None:
+            self._payload_chars = tuple(self.payload_as_string)
+        return self._payload_chars
 
     @property
     def payload_as_bytes(self):
-        return [ord(item) for item in self._payload]
+        if self._payload_bytes is None:
+            if isinstance(self._payload, bytes):
+                self._payload_bytes = self._payload
+            else:
+                self._payload_bytes = bytes(to_byte_array(self._payload))
+        return self._payload_bytes
+
+    @property
+    def payload_view(self):
+        """ read-only memoryview of the payload bytes e.g. for struct.unpack_from """
+        if self._payload_view is None:
+            self._payload_view = memoryview(self.payload_as_bytes)
+        return self._payload_view
 
     @property
     def packet_length(self):
@@ -106,12 +156,24 @@ class ReceivedPacket(object):
     def packet_info(self):
         return self._packet_info
 
+    @property
+    def receive_ts(self):
+        return self._receive_ts
+
     def __str__(self):
         return "%s [%s]" % (str(self._packet_info), self.payload)
 
 
 class OutgoingPacket(object):
+    __slots__ = ('handle', 'header', 'content', 'device_id', 'sender_id', 'length', 'state', 'registration',
+                 'timing', 'attempts', 'due_ts', 'priority', 'coalesce_key', 'delivery', 'deadline')
+
     def __init__(self):
+        self.handle = None
+        self.delivery = None
+        self.deadline = None
+        self.priority = pjon_protocol_constants.PRIORITY_NORMAL
+        self.coalesce_key = None
         self.header = None
         self.content = None
         self.device_id = None
@@ -121,13 +183,14 @@ class OutgoingPacket(object):
         self.registration = None
         self.timing = None
         self.attempts = 0
+        self.due_ts = None
 
     def __str__(self):
-        return "registration: %s. device_id: %s, payload: %s, state: %s, attempts: %s" % (self.registration, self.device_id, self.content, self.state, self.attempts)
+        return "handle: %s, registration: %s. device_id: %s, payload: %s, state: %s, attempts: %s" % (self.handle, self.registration, self.device_id, self.content, self.state, self.attempts)
 
 
 class PjonProtocol(object):
-    def __init__(self, device_id, strategy):
+    def __init__(self, device_id, strategy, received_packets_buffer_length=32, tracer=None):
         self._acknowledge = True
         self._sender_info = True
         self._router = False
@@ -141,8 +204,8 @@ class PjonProtocol(object):
         self._receiver_function = self.dummy_receiver
         self._error_function = self.dummy_error
         self._store_packets = True
-        self._stored_received_packets = []
-        self._received_packets_buffer_length = 32
+        self._received_packets_buffer_length = received_packets_buffer_length
+        self._stored_received_packets = ReceivedPacketsStore(received_packets_buffer_length)
         self._bit_index_by_value = {
             1:  0,
             2:  1,
@@ -152,21 +215,68 @@ class PjonProtocol(object):
             32: 5,
             64: 6
         }
-        self.outgoing_packets = []
+        self.outgoing_packets = OutgoingPacketsTable()
+        self._send_schedule = []
+        self._schedule_seq = itertools.count()
+        self._destinations = OrderedDict()  # device_id -> DestinationState; order is round-robin order
+        self._priority_stats = dict((priority, PriorityClassStats())
+                                    for priority in pjon_protocol_constants.PRIORITIES)
+        self._backoff_policy = CubicBackoff()
+        self._collision_backoff_policy = RandomBackoff()
+        self._coalesce_prefix_length = None  # coalescing by payload prefix disabled
+        self._pending_by_coalesce_key = {}
+        self._coalesced_packets_count = 0
+        self._dispatch_lock = threading.RLock()
+        self._dispatch_queue = deque()  # (operation, argument) handed over from caller threads to the IO thread
+        self._handed_off_packets = {}  # handle -> packet waiting in dispatch queue
+        self._io_thread_ident = None
+        self._wakeup_function = None
+        self._inline_response_wait = True
+        self._awaited_response = None  # (packet, destination, sent_ts, response deadline)
+        self._space_available = threading.Condition()
+        self._space_waiters = 0
+        self._high_watermark = None
+        self._low_watermark = None
+        self._high_watermark_callback = None
+        self._low_watermark_callback = None
+        self._above_high_watermark = False
+        self._circuit_breaker = True
+        self._probe_interval = pjon_protocol_constants.CIRCUIT_BREAKER_PROBE_INTERVAL / 1000.0
         self._auto_delete = True
+        self._decoder = FrameDecoder(self._device_id, router=self._router, shared=self._shared)
+        self._tracer = None
+        self.set_tracer(tracer if tracer is not None else tracing.Tracer())
 
     def begin(self):
         pass
 
     @staticmethod
     def compute_crc_8_for_byte(input_byte, crc):
-        try:
-            return crc8.AddToCRC(input_byte, crc)
-        except TypeError:
-            if type(input_byte) is str:
-                if len(input_byte) == 1:
-                    return crc8.AddToCRC(ord(input_byte), crc)
-        raise TypeError("unsupported type for crc calculation; should be byte or str length==1")
+        if type(input_byte) is str and len(input_byte) == 1:
+            input_byte = ord(input_byte)
+        elif type(input_byte) is not int:
+            raise TypeError("unsupported type for crc calculation; should be byte or str length==1")
+        return crc8.CRC8_TABLE[crc ^ (input_byte & 0xFF)]
+
+    def set_received_packets_buffer_length(self, length):
+        self._received_packets_buffer_length = length
+        self._stored_received_packets.set_capacity(length)
+
+    def iter_received(self, since_ts=None, sender=None):
+        """ iterates over stored received packets (oldest first) without removing them """
+        return self._stored_received_packets.iter_received(since_ts=since_ts, sender=sender)
+
+    def get_last_received_packet(self, sender=None):
+        return self._stored_received_packets.latest(sender=sender)
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    def set_tracer(self, tracer):
+        """ tracer is shared with the strategy so both record to the same ring """
+        self._tracer = tracer
+        self._strategy.set_tracer(tracer)
 
     def receiver_function(self, new_ref):
         self._receiver_function = new_ref
@@ -191,6 +301,7 @@ class PjonProtocol(object):
         if val:
             self._router = True
         self._router = False
+        self._configure_decoder()
 
     def set_receiver(self, receiver_function):
         self._receiver_function = receiver_function
@@ -222,6 +333,14 @@ class PjonProtocol(object):
 
     def set_shared_network(self, new_val):
         self._shared = new_val
+        self._configure_decoder()
+
+    def _configure_decoder(self):
+        self._decoder.configure(self._device_id, self._router, self._shared)
+
+    @property
+    def decoder(self):
+        return self._decoder
 
     @staticmethod
     def dummy_receiver(*args, **kwargs):
@@ -233,197 +352,161 @@ class PjonProtocol(object):
 
     @staticmethod
     def get_packet_info(packet):
-        packet_info = PacketInfo()
-        packet_info.receiver_id = packet[pjon_protocol_constants.RECEIVER_ID_BYTE_ORDER]
-        packet_info.header = packet[pjon_protocol_constants.RECEIVER_HEADER_BYTE_ORDER]
-        if packet_info.header & pjon_protocol_constants.MODE_BIT != 0:
-            packet_info.receiver_bus_id = packet[pjon_protocol_constants.RECEIVER_BUS_ID_WITH_NET_INFO_BYTE_ORDER]
-            if packet_info.header & pjon_protocol_constants.SENDER_INFO_BIT != 0:
-                packet_info.sender_bus_id = 0 # packet + 7);
-                packet_info.sender_id = packet[pjon_protocol_constants.SENDER_ID_WITH_NET_INFO_BYTE_ORDER]
-
-        elif packet_info.header & pjon_protocol_constants.SENDER_INFO_BIT != 0:
-            packet_info.sender_id = packet[pjon_protocol_constants.SENDER_ID_WITHOUT_NET_INFO_BYTE_ORDER]
-
-        return packet_info
+        header = packet[pjon_protocol_constants.RECEIVER_HEADER_BYTE_ORDER]
+        receiver_bus_id = 0
+        sender_id = 0
+        if header & pjon_protocol_constants.MODE_BIT != 0:
+            bus_id_offset = pjon_protocol_constants.RECEIVER_BUS_ID_WITH_NET_INFO_BYTE_ORDER
+            receiver_bus_id = packet[bus_id_offset:bus_id_offset + 4]
+            if header & pjon_protocol_constants.SENDER_INFO_BIT != 0:
+                sender_id = packet[pjon_protocol_constants.SENDER_ID_WITH_NET_INFO_BYTE_ORDER]
+
+        elif header & pjon_protocol_constants.SENDER_INFO_BIT != 0:
+            sender_id = packet[pjon_protocol_constants.SENDER_ID_WITHOUT_NET_INFO_BYTE_ORDER]
+
+        return PacketInfo(header=header,
+                          receiver_id=packet[pjon_protocol_constants.RECEIVER_ID_BYTE_ORDER],
+                          receiver_bus_id=receiver_bus_id,
+                          sender_id=sender_id)
 
     def get_bit_index_by_value(self, bit_value):
         return self._bit_index_by_value[bit_value]
 
     def receive(self):
-        data = [None for item in xrange(pjon_protocol_constants.PACKET_MAX_LENGTH)]
-        state = 0
-        packet_length = pjon_protocol_constants.PACKET_MAX_LENGTH
-        CRC = 0
-        shared = False
-        includes_sender_info = False
-        acknowledge_requested = False
-        log.debug(">>> new packet assembly")
-        for i in xrange(pjon_protocol_constants.PACKET_MAX_LENGTH):
-            log.debug(" >> i: %s" % i)
-
-            data[i] = state = self._strategy.receive_byte()
-            if state == pjon_protocol_constants.FAIL:
-                log.debug("  > returning fail - byte was not read")
-                return pjon_protocol_constants.FAIL
-
-            if i == 0 and data[i] != self._device_id and data[i] != pjon_protocol_constants.BROADCAST and not self.router:
-                log.debug("  > returning busy; packet for someone else [i: %s, sreceiver: %s target: %s]" % (i, self._device_id, data[i]))
+        chunk = self._strategy.receive_bytes()
+        if chunk and self._awaited_response is not None:
+            # first byte after the frame sent is its ACK/NAK
+            self._complete_response(chunk[0], self._strategy.last_received_ts)
+            chunk = chunk[1:]
+            if not chunk:
                 return pjon_protocol_constants.BUSY
-
-            if i == 1:
-                if data[i] > 4 and data[i] < pjon_protocol_constants.PACKET_MAX_LENGTH:
-                    packet_length = data[i]
-                else:
-                    log.debug("  > returning fail on wrong packet length")
-                    return pjon_protocol_constants.FAIL
-
-            if i == 2:   #  Packet header
-                shared = data[2] & pjon_protocol_constants.MODE_BIT
-                includes_sender_info = data[2] & pjon_protocol_constants.SENDER_INFO_BIT
-                acknowledge_requested = data[2] & pjon_protocol_constants.ACK_REQUEST_BIT
-                if(shared != self.shared) and not self.router:
-                    log.debug("  > ret busy")
-                    return pjon_protocol_constants.BUSY # Keep private and shared buses apart
-
-            """
-            If an id is assigned to this bus it means that is potentially
-            sharing its medium, or the device could be connected in parallel
-            with other buses. Bus id equality is checked to avoid collision
-            i.e. id 1 bus 1, should not receive a message for id 1 bus 2.
-            """
-            '''
-            if self.shared and shared and  not self.router and i > 2 and i < 7:
-                if bus_id[i - 3] != data[i]:
-                    return pjon_protocol_constants.BUSY
-            '''
-            if i == packet_length - 1:
-                break
-            CRC = self.compute_crc_8_for_byte(data[i], CRC)
-
-        data = data[:packet_length]
-        log.info(" >> packet: %s" % data)
-        log.info(" >> calc CRC: %s" % CRC)
-
-        if data[-1] == CRC:
-            log.debug("CRC OK")
-            if acknowledge_requested and data[0] != pjon_protocol_constants.BROADCAST and self.mode != pjon_protocol_constants.SIMPLEX:
-                if not self.shared or (self.shared and shared and self.bus_id_equality(data + 3, self.bus_id)):
-                    self.strategy.send_response(pjon_protocol_constants.ACK)
-
-            last_packet_info = self.get_packet_info(data)
-            payload_offset = 3
-
-            if shared:
-                if includes_sender_info:
-                    payload_offset += 9
-                else:
-                    payload_offset += 4
-            else:
-                if includes_sender_info:
-                    payload_offset += 1
-            payload = data[payload_offset:-1]
-
-            log.info(" >> payload: %s" % payload)
-
-            if self._receiver_function is not None:
-                #                       payload, length,        packietInfo
-                self._receiver_function(payload, packet_length, last_packet_info)
-
-            if self._store_packets:
-                packet_to_store = ReceivedPacket(payload, packet_length, last_packet_info)
-                self._stored_received_packets.append(packet_to_store)
-                if len(self._stored_received_packets) > self._received_packets_buffer_length:
-                    log.debug("truncating received packets")
-                    self._stored_received_packets = self._stored_received_packets[
-                                                    len(self._stored_received_packets) - self._received_packets_buffer_length:]
-
-            return pjon_protocol_constants.ACK
-        else:
-            if acknowledge_requested and data[0] != pjon_protocol_constants.BROADCAST and self.mode != pjon_protocol_constants.SIMPLEX:
-                if not self.shared and ( self.shared and shared and self.bus_id_equality(data + 3, self.bus_id)):
-                    self.strategy.send_response(pjon_protocol_constants.NAK)
+        if not chunk:
+            return self.flush_received()
+        return self._process_frames(self._decoder.feed(chunk), pjon_protocol_constants.BUSY)
+
+    def flush_received(self, now=None):
+        """ once the inter-byte timeout passed since the last received byte, incomplete frame starts are
+        given up and the rest of the buffered bytes is rescanned. Event driven loops, which call receive()
+        only when the port is readable, call it when time_until_receive_timeout() elapsed """
+        if not self._decoder.buffered_bytes_count:
+            return pjon_protocol_constants.FAIL
+        if now is None:
+            now = time.time()
+        if now < self._get_receive_deadline():
+            return pjon_protocol_constants.FAIL
+        # bytes still missing will not come
+        return self._process_frames(self._decoder.flush(), pjon_protocol_constants.FAIL)
+
+    def time_until_receive_timeout(self, now=None):
+        """ seconds until flush_received() would give up buffered incomplete frames; None if nothing is buffered """
+        if not self._decoder.buffered_bytes_count:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0.0, self._get_receive_deadline() - now)
+
+    def _get_receive_deadline(self):
+        return self._strategy.last_received_ts + self._strategy.timing.inter_byte_timeout()
+
+    def _process_frames(self, frames, result):
+        crc_errors = self._decoder.crc_errors
+        for frame in frames:
+            self.process_received_frame(frame)
+            result = pjon_protocol_constants.ACK
+
+        if result != pjon_protocol_constants.ACK and self._decoder.crc_errors != crc_errors:
             return pjon_protocol_constants.NAK
+        return result
+
+    def process_received_frame(self, frame):
+        if self._tracer.enabled:
+            self._tracer.record(tracing.FRAME_RX, frame.receiver_id, frame.sender_id, frame.length)
+
+        if frame.acknowledge_requested and frame.receiver_id != pjon_protocol_constants.BROADCAST and self.mode != pjon_protocol_constants.SIMPLEX:
+            if not self.shared or (self.shared and frame.shared and self.bus_id_equality(frame.data[3:7], self.bus_id)):
+                self.strategy.send_response(pjon_protocol_constants.ACK)
+
+        last_packet_info = PacketInfo(header=frame.header,
+                                      receiver_id=frame.receiver_id,
+                                      receiver_bus_id=frame.receiver_bus_id,
+                                      sender_id=frame.sender_id)
+
+        """
+        If an id is assigned to this bus it means that is potentially
+        sharing its medium, or the device could be connected in parallel
+        with other buses. Bus id equality is checked to avoid collision
+        i.e. id 1 bus 1, should not receive a message for id 1 bus 2.
+        """
+        payload = frame.payload
+        packet_length = frame.length
+
+        if self._receiver_function is not None:
+            #                       payload, length,        packietInfo
+            self._receiver_function(payload, packet_length, last_packet_info)
+
+        if self._store_packets:
+            packet_to_store = ReceivedPacket(payload, packet_length, last_packet_info, receive_ts=time.time())
+            self._stored_received_packets.append(packet_to_store)
 
     def send_string(self, recipient_id, string_to_send, sender_id=None, string_length=None, packet_header=None):
-        log.debug("send_string to device: %s payload: %s header: %s" % (recipient_id, string_to_send, packet_header))
+        result = self._transmit_string(recipient_id, string_to_send, sender_id=sender_id,
+                                       string_length=string_length, packet_header=packet_header)
+        if result is not None:
+            return result
+
+        if self._tracer.enabled:
+            response_wait_start_ts = time.time()
+            response = self.strategy.receive_response(recipient_id)
+            self._tracer.record(tracing.RESPONSE_RX, recipient_id, response, time.time() - response_wait_start_ts)
+        else:
+            response = self.strategy.receive_response(recipient_id)
+
+        return self._get_response_result(recipient_id, response)
+
+    def _transmit_string(self, recipient_id, string_to_send, sender_id=None, string_length=None, packet_header=None):
+        """ writes the frame; returns the send result or None if ACK/NAK response is expected """
         if packet_header is None:
             log.warning("send_string: packed_header is None")
             packet_header = self.get_header_from_internal_config()
 
         if string_length is None:
-            log.debug("calculating str length")
             string_length = len(string_to_send)
 
         if string_to_send is None:
-            log.debug("string is None; ret FAIL")
             return pjon_protocol_constants.FAIL
 
         if self.mode != pjon_protocol_constants.SIMPLEX and not self.strategy.can_start():    #FIXME: mode does not chec
-            log.debug("HALF_DUPLEX and BUSY: ret BUSY")
             return pjon_protocol_constants.BUSY
 
-        includes_sender_info = packet_header & pjon_protocol_constants.SENDER_INFO_BIT
-
-        CRC = 0
-
-        # Transmit recipient device id
-        self.strategy.send_byte(recipient_id)
-        CRC = self.compute_crc_8_for_byte(recipient_id, CRC)
-
-        packet_meta_size_bytes = 4
-        if includes_sender_info:
-            packet_meta_size_bytes += 1
-
-        # Transmit packet length
-        self.strategy.send_byte(string_length + packet_meta_size_bytes)
-        CRC = self.compute_crc_8_for_byte(string_length + packet_meta_size_bytes, CRC)
-
-        # Transmit header header
-        self.strategy.send_byte(packet_header)
-        CRC = self.compute_crc_8_for_byte(packet_header, CRC)
-
         ''' If an id is assigned to the bus, the packet's content is prepended by
            the ricipient's bus id. This opens up the possibility to have more than
            one bus sharing the same medium. '''
 
-        # transmit sender id if included in header
-        if includes_sender_info:
-            self.strategy.send_byte(sender_id)
-            CRC = self.compute_crc_8_for_byte(sender_id, CRC)
-
-        for i in xrange(string_length):
-            self.strategy.send_byte(string_to_send[i])
-            CRC = self.compute_crc_8_for_byte(string_to_send[i], CRC)
-
-        self.strategy.send_byte(CRC)
+        frame = encode_frame(recipient_id, string_to_send, packet_header, sender_id, payload_length=string_length)
+        self.strategy.send_frame(frame)
+        if self._tracer.enabled:
+            self._tracer.record(tracing.FRAME_TX, recipient_id, len(frame), packet_header)
 
         if not (packet_header & pjon_protocol_constants.ACK_REQUEST_BIT > 0):
-            log.debug("packet_header: %s" % packet_header)
-            log.debug("no ACK required; ret ACK")
             return pjon_protocol_constants.ACK
         if (recipient_id == pjon_protocol_constants.BROADCAST):
-            log.debug("BROADCAST; ret ACK")
             return pjon_protocol_constants.ACK
         if (self.mode == pjon_protocol_constants.SIMPLEX):
-            log.debug("SIMPLEX; ret ACK")
             return pjon_protocol_constants.ACK
+        return None
 
-        log.debug(">>> receiving response")
-        response = self.strategy.receive_response()
-        log.info("<<< receiving response; received: %s" % response)
-
+    def _get_response_result(self, recipient_id, response):
         if response == pjon_protocol_constants.ACK:
-            log.debug("received ACK resp; ret ACK")
             return pjon_protocol_constants.ACK
 
         ''' Random delay if NAK, corrupted ACK/NAK or collision '''
 
         if response != pjon_protocol_constants.FAIL:
-            log.debug("collision or corruption; sleeping")
-            time.sleep(random.randint(0, pjon_protocol_constants.COLLISION_MAX_DELAY / 1000))
+            if self._tracer.enabled:
+                self._tracer.record(tracing.COLLISION, recipient_id, response)
 
             # FIXME: original PJON lib does not return anything
+            # original random delay is applied by update() as a re-scheduled retry so receiving is not blocked
             return pjon_protocol_constants.BUSY
 
         if response == pjon_protocol_constants.NAK:
@@ -431,12 +514,226 @@ class PjonProtocol(object):
 
         return pjon_protocol_constants.FAIL
 
-    def send(self, recipient_id, payload):
-        return self.dispatch(recipient_id, payload)
+    def send(self, recipient_id, payload, priority=pjon_protocol_constants.PRIORITY_NORMAL, block=False, timeout=None):
+        return self.dispatch(recipient_id, payload, priority=priority, block=block, timeout=timeout)
+
+    def send_tracked(self, recipient_id, payload, delivery_timeout=None, **kwargs):
+        """ like dispatch() but returns DeliveryFuture resolved with the final outcome of the packet;
+        delivery_timeout [s] limits time the packet may spend waiting for an ACK """
+        delivery = DeliveryFuture()
+        handle = self.dispatch(recipient_id, payload, delivery=delivery, delivery_timeout=delivery_timeout, **kwargs)
+        if handle == pjon_protocol_constants.FAIL:
+            delivery.resolve(pjon_protocol_constants.FAIL)
+        return delivery
+
+    def set_circuit_breaker(self, enabled, probe_interval=None):
+        """ probe_interval in ms """
+        self._circuit_breaker = enabled
+        if probe_interval is not None:
+            self._probe_interval = probe_interval / 1000.0
+        if not enabled:
+            self._call_on_scheduler(self._close_breakers)
+
+    def _close_breakers(self):
+        for destination in self._destinations.values():
+            destination.close()
+
+    def set_inline_response_wait(self, enabled):
+        """ with inline response wait disabled update() returns right after a frame requesting ACK was
+        written; the response is taken by the next receive() or given up by update() once the strategy's
+        ACK timeout passed. Meant for event loops which must never block """
+        self._inline_response_wait = enabled
+        if enabled and self._awaited_response is not None:
+            self._complete_response(pjon_protocol_constants.FAIL, time.time())
+
+    @property
+    def awaiting_response(self):
+        return self._awaited_response is not None
+
+    def set_backoff_policy(self, policy, device_id=None):
+        """ retry delay policy (see pjon_backoff) for all destinations or, if device_id is given, for
+        that destination only; policy None restores the default """
+        if device_id is None:
+            self._backoff_policy = policy if policy is not None else CubicBackoff()
+        else:
+            self._call_on_scheduler(self._set_destination_backoff_policy, device_id, policy)
+
+    def _set_destination_backoff_policy(self, device_id, policy):
+        self.get_destination(device_id).backoff_policy = policy
+
+    def set_collision_backoff_policy(self, policy):
+        """ delay before retrying a packet which could not be sent because of busy medium or collision """
+        self._collision_backoff_policy = policy if policy is not None else RandomBackoff()
+
+    def set_coalescing(self, enabled, prefix_length=1):
+        """ when enabled, a packet dispatched while another one to the same destination with the same
+        first prefix_length payload bytes is still pending replaces content of the pending packet
+        (last value wins) instead of being queued; dispatch(coalesce_key=...) coalesces per call """
+        self._coalesce_prefix_length = prefix_length if enabled else None
+
+    @property
+    def coalesced_packets_count(self):
+        return self._coalesced_packets_count
+
+    def _get_coalesce_key(self, recipient_id, payload, coalesce_key):
+        if coalesce_key is None:
+            if self._coalesce_prefix_length is None:
+                return None
+            coalesce_key = bytes(to_byte_array(payload)[:self._coalesce_prefix_length])
+        return recipient_id, coalesce_key
+
+    def _find_coalesce_target(self, recipient_id, payload, coalesce_key):
+        coalesce_key = self._get_coalesce_key(recipient_id, payload, coalesce_key)
+        if coalesce_key is None:
+            return None
+        return self._get_coalesce_target(coalesce_key)
+
+    def _get_coalesce_target(self, coalesce_key):
+        """ pending packet a new value can be merged into; a packet being sent or waiting for its ACK is
+        already on the wire (no due_ts) so the new value has to go out as a packet of its own """
+        pending_packet = self._pending_by_coalesce_key.get(coalesce_key)
+        if pending_packet is None or pending_packet.due_ts is None:
+            return None
+        return pending_packet
+
+    def _coalesce(self, pending_packet, payload, header, sender_id, delivery):
+        """ packet keeps its handle and place in the schedule; only what goes on the wire is replaced """
+        if delivery is not None:
+            delivery.handle = pending_packet.handle
+            if pending_packet.delivery is None:
+                delivery.dispatch_ts = pending_packet.registration
+                pending_packet.delivery = delivery
+            else:
+                delivery.follow(pending_packet.delivery)
+        pending_packet.content = payload
+        pending_packet.length = len(payload)
+        pending_packet.header = header
+        pending_packet.sender_id = sender_id
+        self._coalesced_packets_count += 1
+        return pending_packet.handle
+
+    def set_watermarks(self, high, low, on_high=None, on_low=None):
+        """ on_high(depth) is called once outgoing queue depth reaches high, on_low(depth) once it drops
+        back to low; lets producers throttle before the queue is full """
+        if low >= high:
+            raise ValueError("low watermark should be below high watermark")
+        self._high_watermark = high
+        self._low_watermark = low
+        self._high_watermark_callback = on_high
+        self._low_watermark_callback = on_low
+        self._above_high_watermark = False
+
+    def _check_watermarks(self):
+        if self._high_watermark is None:
+            return
+        depth = len(self.outgoing_packets)
+        if not self._above_high_watermark:
+            if depth >= self._high_watermark:
+                self._above_high_watermark = True
+                if self._high_watermark_callback is not None:
+                    self._high_watermark_callback(depth)
+        elif depth <= self._low_watermark:
+            self._above_high_watermark = False
+            if self._low_watermark_callback is not None:
+                self._low_watermark_callback(depth)
+
+    def _is_outgoing_queue_full(self):
+        return len(self.outgoing_packets) + len(self._handed_off_packets) > pjon_protocol_constants.MAX_PACKETS
+
+    def _wait_for_space(self, timeout):
+        """ blocks until a packet is removed from a full outgoing queue; must not be called from the thread
+        running update() as nothing would free the space """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._space_available:
+            self._space_waiters += 1
+            try:
+                while self._is_outgoing_queue_full():
+                    if deadline is None:
+                        self._space_available.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        self._space_available.wait(remaining)
+            finally:
+                self._space_waiters -= 1
+        return True
+
+    def dispatch_async(self, recipient_id, payload, timeout=None, loop=None, **kwargs):
+        """ awaitable variant of dispatch(..., block=True); the wait for queue space runs in the loop's
+        default executor so the event loop is not blocked """
+        import asyncio
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        return loop.run_in_executor(None, functools.partial(self.dispatch, recipient_id, payload, block=True,
+                                                            timeout=timeout, **kwargs))
+
+    def get_destination(self, device_id):
+        """ adds destination not seen yet; scheduler state - not to be called outside the IO thread """
+        destination = self._destinations.get(device_id)
+        if destination is None:
+            destination = self._destinations[device_id] = DestinationState(device_id)
+        return destination
+
+    def is_connection_lost(self, device_id):
+        destination = self._destinations.get(device_id)
+        return destination is not None and destination.breaker != pjon_outgoing.BREAKER_CLOSED
+
+    def dispatch(self, recipient_id, payload, header=None, target_net=None, timing=None, forced_sender_id=None,
+                 priority=pjon_protocol_constants.PRIORITY_NORMAL, coalesce_key=None, block=False, timeout=None,
+                 delivery=None, delivery_timeout=None):
+        """ returns handle of the queued packet or FAIL; with block=True waits up to timeout seconds
+        (forever if None) for space in a full outgoing queue instead of failing right away. block is ignored
+        in the thread running update() or with no IO thread attached - nothing would free the space """
+        if block and not self.owns_scheduler() and self._is_outgoing_queue_full() and \
+                self._find_coalesce_target(recipient_id, payload, coalesce_key) is None:
+            self._wait_for_space(timeout)
+
+        with self._dispatch_lock:
+            return self._dispatch(recipient_id, payload, header, timing, forced_sender_id, priority, coalesce_key,
+                                  delivery, delivery_timeout)
+
+    def send_many(self, packets, track_delivery=False):
+        """ enqueues a batch of (device_id, payload) or (device_id, payload, options) items, options being
+        a dict of dispatch() keyword arguments (header, timing, forced_sender_id, priority, coalesce_key,
+        delivery_timeout); header config and clock are read once, the dispatch lock is taken and the IO thread
+        woken up once for the whole batch.
+        Returns list of handles (FAIL for rejected items) or of DeliveryFutures if track_delivery is set """
+        default_header = self.get_header_from_internal_config()
+        results = []
+        now = time.time()
+        with self._dispatch_lock:
+            for item in packets:
+                options = item[2] if len(item) > 2 else {}
+                delivery = DeliveryFuture() if track_delivery else None
+                handle = self._dispatch(item[0], item[1],
+                                        options.get('header', default_header),
+                                        options.get('timing'),
+                                        options.get('forced_sender_id'),
+                                        options.get('priority', pjon_protocol_constants.PRIORITY_NORMAL),
+                                        options.get('coalesce_key'),
+                                        delivery,
+                                        options.get('delivery_timeout'),
+                                        now=now, wakeup=False)
+                if delivery is None:
+                    results.append(handle)
+                else:
+                    if handle == pjon_protocol_constants.FAIL:
+                        delivery.resolve(pjon_protocol_constants.FAIL)
+                    results.append(delivery)
+        if self._dispatch_queue and self._wakeup_function is not None:
+            self._wakeup_function()
+        return results
+
+    def _dispatch(self, recipient_id, payload, header, timing, forced_sender_id, priority, coalesce_key, delivery,
+                  delivery_timeout, now=None, wakeup=True):
+        """ validates and builds the packet in the caller's thread; the packet is handed over to the IO thread
+        unless the caller owns scheduler state (see attach_io_thread) """
+        if priority not in self._priority_stats:
+            log.error("unknown priority class: %s", priority)
+            return pjon_protocol_constants.FAIL
 
-    def dispatch(self, recipient_id, payload, header=None, target_net=None, timing=None, forced_sender_id=None):
         if header is None:
-            log.debug("dispatch: getting header from internal config")
             header = self.get_header_from_internal_config()
 
         payload_length = len(payload)
@@ -451,39 +748,127 @@ class PjonProtocol(object):
         if self.shared:
             raise NotImplementedError("operation on shared bus (multiple networks) not implemented")
 
-        if len(self.outgoing_packets) <= pjon_protocol_constants.MAX_PACKETS:
-            outgoing_packet = OutgoingPacket()
-            outgoing_packet.header = header
-            outgoing_packet.content = payload
-            outgoing_packet.device_id = recipient_id
-            if forced_sender_id is None:
-                outgoing_packet.sender_id = self.device_id
-            else:
-                outgoing_packet.sender_id = forced_sender_id
-            outgoing_packet.length = len(payload)
-            outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
-            outgoing_packet.registration = time.time()
-            outgoing_packet.timing = timing
-            outgoing_packet.attempts = 0
-            log.debug("adding packet to the outgoing packets list: %s" % str(outgoing_packet))
-            self.outgoing_packets.append(outgoing_packet)
-
-            return len(self.outgoing_packets) - 1
+        if forced_sender_id is None:
+            sender_id = self.device_id
+        else:
+            sender_id = forced_sender_id
+
+        owns_scheduler = self.owns_scheduler()
+        coalesce_key = self._get_coalesce_key(recipient_id, payload, coalesce_key)
+        pending_packet = None
+        if coalesce_key is not None:
+            pending_packet = self._get_coalesce_target(coalesce_key)
+            if pending_packet is not None and owns_scheduler:
+                return self._coalesce(pending_packet, payload, header, sender_id, delivery)
+
+        if pending_packet is None and self._is_outgoing_queue_full():
+            self._error_function(pjon_protocol_constants.PACKETS_BUFFER_FULL, pjon_protocol_constants.MAX_PACKETS)
+            return pjon_protocol_constants.FAIL
 
-        self._error_function(pjon_protocol_constants.PACKETS_BUFFER_FULL, pjon_protocol_constants.MAX_PACKETS)
+        if now is None:
+            now = time.time()
+        destination = self._destinations.get(recipient_id)
+        if destination is not None and destination.rejects(now):
+            self._error_function(pjon_protocol_constants.CONNECTION_LOST, recipient_id)
+            return pjon_protocol_constants.FAIL
 
-        return pjon_protocol_constants.FAIL
+        outgoing_packet = OutgoingPacket()
+        outgoing_packet.handle = self.outgoing_packets.allocate_handle()
+        outgoing_packet.header = header
+        outgoing_packet.content = payload
+        outgoing_packet.device_id = recipient_id
+        outgoing_packet.sender_id = sender_id
+        outgoing_packet.length = payload_length
+        outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
+        outgoing_packet.registration = now
+        outgoing_packet.timing = timing
+        outgoing_packet.attempts = 0
+        outgoing_packet.priority = priority
+        outgoing_packet.coalesce_key = coalesce_key
+        if delivery_timeout is not None:
+            outgoing_packet.deadline = now + delivery_timeout
+        if delivery is not None:
+            delivery.handle = outgoing_packet.handle
+            delivery.dispatch_ts = now
+            outgoing_packet.delivery = delivery
+
+        if owns_scheduler:
+            self._accept_packet(outgoing_packet)
+        else:
+            self._handed_off_packets[outgoing_packet.handle] = outgoing_packet
+            self._dispatch_queue.append((_OP_DISPATCH, outgoing_packet))
+            if wakeup and self._wakeup_function is not None:
+                self._wakeup_function()
+
+        return outgoing_packet.handle
+
+    def _accept_packet(self, outgoing_packet):
+        """ IO thread side of dispatch: puts packet to the outgoing table and send schedule """
+        if outgoing_packet.coalesce_key is not None:
+            pending_packet = self._get_coalesce_target(outgoing_packet.coalesce_key)
+            if pending_packet is not None:
+                # handle of a packet merged after hand-off is retired; its delivery follows the pending packet
+                self._coalesce(pending_packet, outgoing_packet.content, outgoing_packet.header,
+                               outgoing_packet.sender_id, outgoing_packet.delivery)
+                return
+            # a packet already on the wire with the same key is superseded (see _retire_superseded)
+            self._pending_by_coalesce_key[outgoing_packet.coalesce_key] = outgoing_packet
+
+        self.outgoing_packets.insert(outgoing_packet)
+        self.get_destination(outgoing_packet.device_id).queued += 1
+        self._priority_stats[outgoing_packet.priority].queued += 1
+        self.schedule(outgoing_packet)
+        self._check_watermarks()
+
+    def attach_io_thread(self, thread=None):
+        """ makes thread (current one by default) the sole owner of scheduler state; dispatch(), cancel() and
+        destination settings called from other threads are then handed over through a queue drained by update() """
+        if thread is None:
+            thread = threading.current_thread()
+        self._io_thread_ident = thread.ident
+
+    def set_wakeup(self, wakeup_function):
+        """ wakeup_function is called (from caller's thread) after a dispatch or cancel was handed over
+        so an IO loop blocked waiting for serial data can serve it right away """
+        self._wakeup_function = wakeup_function
+
+    def detach_io_thread(self):
+        self._drain_dispatch_queue()
+        self._io_thread_ident = None
+
+    def owns_scheduler(self):
+        return self._io_thread_ident is None or self._io_thread_ident == threading.current_thread().ident
+
+    def _call_on_scheduler(self, function, *args):
+        """ runs function changing scheduler state right away in the IO thread, otherwise hands it over
+        to the next update() - destinations are iterated and reordered there without a lock """
+        if self.owns_scheduler():
+            function(*args)
+            return
+        self._dispatch_queue.append((_OP_CALL, functools.partial(function, *args)))
+        if self._wakeup_function is not None:
+            self._wakeup_function()
+
+    def _drain_dispatch_queue(self):
+        dispatch_queue = self._dispatch_queue
+        while dispatch_queue:
+            operation, argument = dispatch_queue.popleft()
+            if operation == _OP_DISPATCH:
+                self._accept_packet(argument)
+                # popped after insertion so queue depth is never under-counted by callers
+                self._handed_off_packets.pop(argument.handle, None)
+            elif operation == _OP_CANCEL:
+                self._cancel(argument)
+            else:
+                argument()
 
     def get_header_from_internal_config(self):
         header = 0
         if self.shared:
-            log.debug("header for shared bus")
             header |= pjon_protocol_constants.MODE_BIT
         if self._sender_info:
-            log.debug("header with sender info")
             header |= pjon_protocol_constants.SENDER_INFO_BIT
         if self._acknowledge:
-            log.debug("header requiring ACK")
             header |= pjon_protocol_constants.ACK_REQUEST_BIT
 
         return header
@@ -509,74 +894,306 @@ class PjonProtocol(object):
 
         return header
 
+    def schedule(self, outgoing_packet):
+        """ puts packet to the send schedule at its next eligible send time:
+        registration + timing + backoff policy delay for attempts made so far [ms] """
+        delay = 0
+        if outgoing_packet.attempts:
+            policy = self._destinations[outgoing_packet.device_id].backoff_policy or self._backoff_policy
+            delay = policy(outgoing_packet.attempts)
+        self._schedule_at(outgoing_packet, outgoing_packet.registration +
+                          (outgoing_packet.timing + delay) / 1000.0)
+
+    def _schedule_at(self, outgoing_packet, due_ts):
+        if outgoing_packet.deadline is not None and due_ts > outgoing_packet.deadline:
+            due_ts = outgoing_packet.deadline  # wake up in time to report TIMEOUT
+        outgoing_packet.due_ts = due_ts
+        heapq.heappush(self._send_schedule, (due_ts, next(self._schedule_seq), outgoing_packet))
+
+    def _pop_due_packets(self, now):
+        due_packets = []
+        send_schedule = self._send_schedule
+        while send_schedule and send_schedule[0][0] <= now:
+            due_ts, seq, outgoing_packet = heapq.heappop(send_schedule)
+            if outgoing_packet.due_ts == due_ts:  # skip entries of removed or re-scheduled packets
+                due_packets.append(outgoing_packet)
+        return due_packets
+
+    def _order_due_packets(self, due_packets):
+        """ strict priority between classes; within a class destinations are interleaved so each gets
+        one send per round and recently served ones go to the back of the order - a busy or dead
+        destination can not starve the others """
+        if len(due_packets) < 2:
+            return due_packets
+        ordered = []
+        for priority in pjon_protocol_constants.PRIORITIES:
+            queues = OrderedDict((device_id, deque()) for device_id in self._destinations)
+            for outgoing_packet in due_packets:
+                if outgoing_packet.priority == priority:
+                    queues[outgoing_packet.device_id].append(outgoing_packet)
+
+            active = [queue for queue in queues.values() if queue]
+            while active:
+                for queue in active:
+                    ordered.append(queue.popleft())
+                active = [queue for queue in active if queue]
+        return ordered
+
+    def _mark_served(self, destination):
+        self._destinations[destination.device_id] = self._destinations.pop(destination.device_id)
+
+    def time_until_next_send(self, now=None):
+        """ seconds the IO loop can sleep until the next scheduled packet is due; None if nothing is scheduled """
+        if self._dispatch_queue:
+            return 0.0
+        if self._awaited_response is not None:  # nothing is sent before the response or its timeout
+            if now is None:
+                now = time.time()
+            return max(0.0, self._awaited_response[3] - now)
+        send_schedule = self._send_schedule
+        while send_schedule and send_schedule[0][2].due_ts != send_schedule[0][0]:
+            heapq.heappop(send_schedule)
+        if not send_schedule:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0.0, send_schedule[0][0] - now)
+
+    def remove_outgoing_packet(self, outgoing_packet):
+        outgoing_packet.due_ts = None
+        if self.outgoing_packets.remove(outgoing_packet.handle) is not None:
+            self._destinations[outgoing_packet.device_id].queued -= 1
+            self._priority_stats[outgoing_packet.priority].queued -= 1
+            if self._pending_by_coalesce_key.get(outgoing_packet.coalesce_key) is outgoing_packet:
+                del self._pending_by_coalesce_key[outgoing_packet.coalesce_key]
+            self._check_watermarks()
+            if self._space_waiters:
+                with self._space_available:
+                    self._space_available.notify_all()
+
+    def get_priority_stats(self):
+        """ per priority class: queued packets, sent packets, average and max wait [s] between becoming
+        due and being sent """
+        return dict((priority, stats.as_dict()) for priority, stats in self._priority_stats.items())
+
+    def cancel(self, handle):
+        """ removes not yet delivered packet; returns False if the handle is unknown (already delivered,
+        failed or cancelled). Called outside the IO thread the cancellation is carried out by next update() """
+        if not self.owns_scheduler():
+            if handle not in self.outgoing_packets and handle not in self._handed_off_packets:
+                return False
+            self._dispatch_queue.append((_OP_CANCEL, handle))
+            if self._wakeup_function is not None:
+                self._wakeup_function()
+            return True
+        self._drain_dispatch_queue()
+        return self._cancel(handle)
+
+    def _cancel(self, handle):
+        outgoing_packet = self.outgoing_packets.get(handle)
+        if outgoing_packet is None:
+            return False
+        self.remove_outgoing_packet(outgoing_packet)
+        if outgoing_packet.delivery is not None:
+            outgoing_packet.delivery.cancel()
+        return True
+
+    def _get_pending_packet(self, handle):
+        outgoing_packet = self.outgoing_packets.get(handle)
+        if outgoing_packet is None:
+            outgoing_packet = self._handed_off_packets.get(handle)
+        return outgoing_packet
+
+    def get_delivery(self, handle):
+        """ DeliveryFuture of a pending packet dispatched with delivery tracking; None otherwise """
+        outgoing_packet = self._get_pending_packet(handle)
+        if outgoing_packet is None:
+            return None
+        return outgoing_packet.delivery
+
+    @staticmethod
+    def _complete_delivery(outgoing_packet, result, attempts):
+        delivery = outgoing_packet.delivery
+        if delivery is None or delivery.done():
+            return
+        time_to_ack = None
+        if result == pjon_protocol_constants.ACK:
+            time_to_ack = time.time() - delivery.dispatch_ts
+        delivery.resolve(result, attempts=attempts, time_to_ack=time_to_ack)
+
+    def status(self, handle):
+        """ returns state of the packet (TO_BE_SENT, BUSY, FAIL, ACK..) or None if the handle is unknown """
+        outgoing_packet = self._get_pending_packet(handle)
+        if outgoing_packet is None:
+            return None
+        return outgoing_packet.state
+
     def update(self):
-        log.debug(">>> update")
-        for outgoing_packet in self.outgoing_packets:
-            log.debug(" >> processing packet: %s" % outgoing_packet)
-            if outgoing_packet.state == 0:
-                log.debug("  > continue on outgoing_packet.state == 0")
+        if self._dispatch_queue:
+            self._drain_dispatch_queue()
+        now = time.time()
+        if self._awaited_response is not None:
+            if now < self._awaited_response[3]:
+                return len(self.outgoing_packets)
+            self._complete_response(pjon_protocol_constants.FAIL, now)
+        sent = False
+        sent_handles = set()
+        due_packets = deque(self._order_due_packets(self._pop_due_packets(now)))
+        while due_packets:
+            if sent:
+                sent = False
+                now = time.time()  # each send may have blocked up to the response timeout
+                due_packets = self._merge_newly_due_packets(due_packets, now, sent_handles)
+                if not due_packets:
+                    break
+            outgoing_packet = due_packets.popleft()
+            if outgoing_packet.due_ts is None:  # cancelled
                 continue
-
-            if (time.time() - outgoing_packet.registration)*1000 >= \
-                outgoing_packet.timing + math.pow(outgoing_packet.attempts, 3):
-                log.debug("   sending packet with header: %s" % outgoing_packet.header)
+            if outgoing_packet.deadline is not None and now >= outgoing_packet.deadline:
+                self.remove_outgoing_packet(outgoing_packet)
+                self._complete_delivery(outgoing_packet, pjon_protocol_constants.TIMEOUT, outgoing_packet.attempts)
+                continue
+            destination = self._destinations[outgoing_packet.device_id]
+            if self._circuit_breaker and not destination.accepts(now):
+                self._schedule_at(outgoing_packet, destination.next_probe_ts)
+                continue
+            self._mark_served(destination)
+            self._priority_stats[outgoing_packet.priority].record_send(now - outgoing_packet.due_ts)
+            outgoing_packet.due_ts = None
+            sent = True
+            sent_handles.add(outgoing_packet.handle)
+            if self._inline_response_wait:
                 outgoing_packet.state = self.send_string(outgoing_packet.device_id,
                                                          outgoing_packet.content,
                                                          sender_id=outgoing_packet.sender_id,
                                                          packet_header=outgoing_packet.header)
-                log.info("  > send_string returned: %s" % outgoing_packet.state)
             else:
-                log.debug("  > continue on time.time() - registration > timing + pow(attempts, 3)")
-                continue
-
-        was_packet_deleted = True
-        while was_packet_deleted:
-            was_packet_deleted = False
-            for outgoing_packet in self.outgoing_packets:
-                if outgoing_packet.state == pjon_protocol_constants.ACK:
-                    if not outgoing_packet.timing:
-                        if self._auto_delete:
-                            log.debug("  > deleting packet from outgoing buffer")
-                            log.debug("  > buffer before deletion: %s" % str(self.outgoing_packets))
-                            self.outgoing_packets[:] = [item for item in self.outgoing_packets if item is not outgoing_packet]
-                            log.debug("  > buffer after deletion: %s" % str(self.outgoing_packets))
-                            was_packet_deleted = True
-                            break
-                    else:
-                        outgoing_packet.attempts = 0
-                        outgoing_packet.registration = time.time()
-                        outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
-
-                if outgoing_packet.state == pjon_protocol_constants.FAIL:
-                    outgoing_packet.attempts += 1
-                    if outgoing_packet.attempts > pjon_protocol_constants.MAX_ATTEMPTS:
-                        if outgoing_packet.content[0] == pjon_protocol_constants.ACQUIRE_ID:
-                            # FIXME: not really understand why outgoing packets queue would ever get ID acquisition packet?
-                            self._device_id = outgoing_packet.device_id
-                            self.outgoing_packets[:] = [item for item in self.outgoing_packets if
-                                                        item is not outgoing_packet]
-                            log.debug("  > continue on ACQUIRE ID")
-                            was_packet_deleted = True
-                            break
-                            #continue
-                        else:
-                            self._error_function(pjon_protocol_constants.CONNECTION_LOST,
-                                                 outgoing_packet.device_id)
-
-                        if not outgoing_packet.timing:
-                            if self._auto_delete:
-                                log.debug("  > auto deleting failed packet")
-                                self.outgoing_packets[:] = [item for item in self.outgoing_packets if
-                                                            item is not outgoing_packet]
-                                was_packet_deleted = True
-                                break
-                        else:
-                            outgoing_packet.attempts = 0
-                            outgoing_packet.registration = time.time()
-                            outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
-                    #FIXME: original PJON is not re-scheduling failed packets for re-sending
-                    # if delivery failed but attempts below maximum allowable count; fixed below
-                    #else:
-                    #    outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
+                outgoing_packet.state = self._transmit_string(outgoing_packet.device_id,
+                                                              outgoing_packet.content,
+                                                              sender_id=outgoing_packet.sender_id,
+                                                              packet_header=outgoing_packet.header)
+                if outgoing_packet.state is None:
+                    self._await_response(outgoing_packet, destination, due_packets)
+                    break
+            self._finish_send(outgoing_packet, destination, now)
 
         return len(self.outgoing_packets)
+
+    def _await_response(self, outgoing_packet, destination, due_packets):
+        """ bus is held until the response arrives or times out; rest of the pass goes back to the schedule """
+        for due_packet in due_packets:
+            if due_packet.due_ts is not None:
+                self._schedule_at(due_packet, due_packet.due_ts)
+        outgoing_packet.state = pjon_protocol_constants.AWAITING_RESPONSE
+        sent_ts = time.time()
+        self._awaited_response = (outgoing_packet, destination, sent_ts,
+                                  sent_ts + self._strategy.get_ack_timeout(outgoing_packet.device_id))
+
+    def _complete_response(self, response, now):
+        outgoing_packet, destination, sent_ts, deadline = self._awaited_response
+        self._awaited_response = None
+        waited = None
+        if response != pjon_protocol_constants.FAIL:
+            waited = now - sent_ts
+        self._strategy.record_response(outgoing_packet.device_id, waited)
+        if self._tracer.enabled:
+            self._tracer.record(tracing.RESPONSE_RX, outgoing_packet.device_id, response, now - sent_ts)
+        outgoing_packet.state = self._get_response_result(outgoing_packet.device_id, response)
+        if outgoing_packet.handle not in self.outgoing_packets:  # cancelled while waiting
+            return
+        self._finish_send(outgoing_packet, destination, now)
+
+    def _finish_send(self, outgoing_packet, destination, now):
+        if self._tracer.enabled and outgoing_packet.attempts:
+            self._tracer.record(tracing.RETRY, outgoing_packet.device_id, outgoing_packet.attempts,
+                                outgoing_packet.state)
+        self._process_send_result(outgoing_packet, destination, now)
+        if outgoing_packet.coalesce_key is not None and outgoing_packet.handle in self.outgoing_packets and \
+                self._pending_by_coalesce_key.get(outgoing_packet.coalesce_key) is not outgoing_packet:
+            self._retire_superseded(outgoing_packet)
+
+    def _retire_superseded(self, outgoing_packet):
+        """ a newer value was dispatched while this packet was on the wire; instead of sending the old value
+        again (retry, collision or repetition) the packet is dropped and its delivery follows the newer one """
+        newer_packet = self._pending_by_coalesce_key[outgoing_packet.coalesce_key]
+        self.remove_outgoing_packet(outgoing_packet)
+        delivery = outgoing_packet.delivery
+        if delivery is not None and not delivery.done():
+            if newer_packet.delivery is None:
+                delivery.handle = newer_packet.handle
+                newer_packet.delivery = delivery
+            else:
+                delivery.follow(newer_packet.delivery)
+        self._coalesced_packets_count += 1
+
+    def _merge_newly_due_packets(self, due_packets, now, sent_handles):
+        """ packets dispatched or becoming due while this pass was sending join the rest of the pass in
+        priority order, so a HIGH packet does not wait behind a batch of LOW ones; packets already sent
+        in this pass go back to the schedule for the next pass """
+        if self._dispatch_queue:
+            self._drain_dispatch_queue()
+        newly_due = []
+        for outgoing_packet in self._pop_due_packets(now):
+            if outgoing_packet.handle in sent_handles:
+                self._schedule_at(outgoing_packet, outgoing_packet.due_ts)
+            else:
+                newly_due.append(outgoing_packet)
+        if not newly_due:
+            return due_packets
+        return deque(self._order_due_packets(list(due_packets) + newly_due))
+
+    def _process_send_result(self, outgoing_packet, destination, now):
+        if outgoing_packet.state == pjon_protocol_constants.ACK:
+            if destination.breaker != pjon_outgoing.BREAKER_CLOSED:
+                log.info("connection to device %s restored", destination.device_id)
+                destination.close()
+            if outgoing_packet.delivery is not None:
+                self._complete_delivery(outgoing_packet, pjon_protocol_constants.ACK, outgoing_packet.attempts + 1)
+            outgoing_packet.deadline = None
+            if not outgoing_packet.timing:
+                if self._auto_delete:
+                    self.remove_outgoing_packet(outgoing_packet)
+            else:
+                outgoing_packet.attempts = 0
+                outgoing_packet.registration = now
+                outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
+                self.schedule(outgoing_packet)
+            return
+
+        if outgoing_packet.state == pjon_protocol_constants.FAIL:
+            outgoing_packet.attempts += 1
+            if destination.breaker == pjon_outgoing.BREAKER_HALF_OPEN:
+                destination.trip(now, self._probe_interval)
+            if outgoing_packet.attempts > pjon_protocol_constants.MAX_ATTEMPTS:
+                if outgoing_packet.content[0] == pjon_protocol_constants.ACQUIRE_ID:
+                    # FIXME: not really understand why outgoing packets queue would ever get ID acquisition packet?
+                    self._device_id = outgoing_packet.device_id
+                    self._configure_decoder()
+                    self.remove_outgoing_packet(outgoing_packet)
+                    self._complete_delivery(outgoing_packet, pjon_protocol_constants.FAIL, outgoing_packet.attempts)
+                    return
+
+                if self._tracer.enabled:
+                    self._tracer.record(tracing.CONNECTION_LOST, outgoing_packet.device_id, outgoing_packet.attempts)
+                self._error_function(pjon_protocol_constants.CONNECTION_LOST, outgoing_packet.device_id)
+                if self._circuit_breaker:
+                    destination.trip(now, self._probe_interval)
+                self._complete_delivery(outgoing_packet, pjon_protocol_constants.FAIL, outgoing_packet.attempts)
+
+                if not outgoing_packet.timing:
+                    if self._auto_delete:
+                        self.remove_outgoing_packet(outgoing_packet)
+                    return
+
+                outgoing_packet.attempts = 0
+                outgoing_packet.registration = now
+                outgoing_packet.state = pjon_protocol_constants.TO_BE_SENT
+
+            # FIXME: original PJON is not re-scheduling failed packets for re-sending
+            # if delivery failed but attempts below maximum allowable count; fixed here
+            self.schedule(outgoing_packet)
+            return
+
+        # busy medium or collision; retry after random delay instead of sleeping in send_string()
+        collision_delay = self._collision_backoff_policy(outgoing_packet.attempts + 1)
+        self._schedule_at(outgoing_packet, now + collision_delay / 1000.0)
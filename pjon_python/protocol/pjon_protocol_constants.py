@@ -17,7 +17,9 @@ NOT_ASSIGNED = 255
 
 ''' Internalconstants '''
 FAIL = 0x100                # 256
+TIMEOUT = 0x101             # 257; delivery not confirmed within requested time
 TO_BE_SENT = 74
+AWAITING_RESPONSE = 0x102   # 258; frame sent, waiting for ACK/NAK outside of update()
 
 ''' HEADER CONFIGURATION '''
 ''' Packet header bits '''
@@ -36,6 +38,15 @@ ID_ACQUISITION_FAIL = 105
 ''' Constraints '''
 MAX_ATTEMPTS = 125
 
+''' Interval between probes sent to a destination after connection was lost (ms) '''
+CIRCUIT_BREAKER_PROBE_INTERVAL = 1000
+
+''' Outgoing packet priority classes; lower value is served first '''
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
 ''' Packets buffer length '''
 MAX_PACKETS = 128
 
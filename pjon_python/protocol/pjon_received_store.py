@@ -0,0 +1,112 @@
+from collections import deque
+
+
+class ReceivedPacketsStore(object):
+    """ fixed capacity ring buffer of received packets with O(1) append
+
+    a secondary index keeps sequence numbers of stored packets per sender id, so reading packets
+    (or just the latest one) from a given node does not scan the whole buffer. Reads never
+    remove packets; the IO thread appends while other threads read.
+    """
+    def __init__(self, capacity=32):
+        if capacity < 1:
+            raise ValueError("capacity should be > 0 but %s passed" % capacity)
+        self._capacity = capacity
+        self._slots = [None] * capacity
+        self._first_seq = 0
+        self._next_seq = 0
+        self._seqs_by_sender = {}
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @staticmethod
+    def get_sender_id(packet):
+        if packet.packet_info is None:
+            return None
+        return packet.packet_info.sender_id
+
+    def append(self, packet):
+        seq = self._next_seq
+        index = seq % self._capacity
+        evicted = self._slots[index]
+        if evicted is not None:
+            # the evicted packet is always the oldest one stored for its sender
+            evicted_sender_id = self.get_sender_id(evicted[1])
+            sender_seqs = self._seqs_by_sender[evicted_sender_id]
+            sender_seqs.popleft()
+            if not sender_seqs:
+                del self._seqs_by_sender[evicted_sender_id]
+
+        self._slots[index] = (seq, packet)
+        sender_id = self.get_sender_id(packet)
+        sender_seqs = self._seqs_by_sender.get(sender_id)
+        if sender_seqs is None:
+            sender_seqs = self._seqs_by_sender[sender_id] = deque()
+        sender_seqs.append(seq)
+        self._next_seq = seq + 1
+
+    def clear(self):
+        self._slots = [None] * self._capacity
+        self._first_seq = self._next_seq
+        self._seqs_by_sender = {}
+
+    def set_capacity(self, capacity):
+        """ changes capacity keeping the newest packets """
+        if capacity < 1:
+            raise ValueError("capacity should be > 0 but %s passed" % capacity)
+        packets = list(self)[-capacity:]
+        self._capacity = capacity
+        self.clear()
+        for packet in packets:
+            self.append(packet)
+
+    def _get_by_seq(self, seq):
+        slot = self._slots[seq % self._capacity]
+        if slot is None or slot[0] != seq:
+            return None  # overwritten by a newer packet in the meantime
+        return slot[1]
+
+    def _iter_seqs(self, seqs):
+        for seq in seqs:
+            packet = self._get_by_seq(seq)
+            if packet is not None:
+                yield packet
+
+    def __len__(self):
+        return min(self._next_seq - self._first_seq, self._capacity)
+
+    def __iter__(self):
+        """ iterates from the oldest to the newest packet """
+        next_seq = self._next_seq
+        return self._iter_seqs(range(max(self._first_seq, next_seq - self._capacity), next_seq))
+
+    def __getitem__(self, index):
+        packets = list(self)
+        return packets[index]
+
+    def iter_received(self, since_ts=None, sender=None):
+        """ non-destructive iteration (oldest first) over stored packets received after since_ts
+        and/or from the given sender id """
+        if sender is None:
+            packets = iter(self)
+        else:
+            packets = self._iter_seqs(list(self._seqs_by_sender.get(sender, ())))
+
+        for packet in packets:
+            if since_ts is None or (packet.receive_ts is not None and packet.receive_ts > since_ts):
+                yield packet
+
+    def latest(self, sender=None):
+        """ returns the newest packet (from the given sender id if passed) or None """
+        if sender is None:
+            seq = self._next_seq - 1
+            if seq < self._first_seq:
+                return None
+            return self._get_by_seq(seq)
+
+        try:
+            return self._get_by_seq(self._seqs_by_sender[sender][-1])
+        except (KeyError, IndexError):
+            return None
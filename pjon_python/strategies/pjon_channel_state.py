@@ -0,0 +1,75 @@
+from pjon_python.protocol import pjon_protocol_constants
+
+DEFAULT_BAUD_RATE = 115200
+BITS_PER_BYTE = 10  # start bit + 8 data bits + stop bit
+
+
+def get_byte_time(baud_rate):
+    """ seconds needed to transmit a single byte at baud_rate (8N1) """
+    return float(BITS_PER_BYTE) / baud_rate
+
+
+class ChannelState(object):
+    """ carrier sense model updated as bytes arrive
+
+    tracks position within the frame being received; once the length byte is seen the frame end is
+    known (frame start + length * byte time) so the channel is reported busy until then even if the
+    rest of the frame did not arrive yet. A gap longer than inter_byte_gap ends the current frame
+    (lone ACK/NAK bytes, noise). is_clear() is a plain comparison, safe to call from any thread.
+    """
+    __slots__ = ('byte_time', 'clearance', 'inter_byte_gap', 'last_activity_ts', 'expected_frame_end',
+                 'busy_until', 'frames_seen', '_position', '_frame_start_ts', '_frame_length')
+
+    def __init__(self, byte_time=None, clearance=0.0001, inter_byte_gap=None):
+        if byte_time is None:
+            byte_time = get_byte_time(DEFAULT_BAUD_RATE)
+        self.byte_time = byte_time
+        self.clearance = clearance
+        self.inter_byte_gap = inter_byte_gap if inter_byte_gap is not None else max(3 * byte_time, clearance)
+        self.last_activity_ts = 0
+        self.expected_frame_end = 0
+        self.busy_until = 0
+        self.frames_seen = 0
+        self._position = 0
+        self._frame_start_ts = 0
+        self._frame_length = None
+
+    def on_bytes(self, data, now):
+        """ data arrived by now; byte arrival times are spread back from now by byte time """
+        byte_time = self.byte_time
+        byte_ts = now - (len(data) - 1) * byte_time
+        for b in data:
+            if self._position and byte_ts - self.last_activity_ts > self.inter_byte_gap:
+                self._position = 0
+            if self._position == 0:
+                self._frame_start_ts = byte_ts
+                self._frame_length = None
+            elif self._position == 1:
+                if 4 < b <= pjon_protocol_constants.PACKET_MAX_LENGTH:
+                    self._frame_length = b
+                    self.expected_frame_end = self._frame_start_ts + b * byte_time
+            self._position += 1
+            if self._frame_length is not None and self._position >= self._frame_length:
+                self._position = 0
+                self.frames_seen += 1
+            self.last_activity_ts = byte_ts
+            byte_ts += byte_time
+
+        if self._position and self._frame_length is None:
+            busy_until = self.last_activity_ts + self.inter_byte_gap  # length not known yet
+        else:
+            busy_until = self.last_activity_ts + self.clearance
+        if self._position and self.expected_frame_end + self.clearance > busy_until:
+            busy_until = self.expected_frame_end + self.clearance
+        self.busy_until = busy_until
+
+    def is_clear(self, now):
+        return now >= self.busy_until
+
+    def get_stats(self):
+        return {
+            'last_activity_ts': self.last_activity_ts,
+            'expected_frame_end': self.expected_frame_end,
+            'busy_until': self.busy_until,
+            'frames_seen': self.frames_seen,
+        }
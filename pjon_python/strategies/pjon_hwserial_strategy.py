@@ -1,15 +1,20 @@
 import logging
+import threading
 import time
 
 from serial import SerialTimeoutException
 
 from pjon_python.protocol import pjon_protocol_constants
+from pjon_python.protocol.pjon_frame import to_byte_array
+from pjon_python.strategies.pjon_channel_state import ChannelState
+from pjon_python.strategies.pjon_rtt import RttEstimator
+from pjon_python.strategies.pjon_serial_timing import SerialTiming
+from pjon_python.utils import tracing
 
 log = logging.getLogger("ser-strat")
 
-THROUGH_HARDWARE_SERIAL_MAX_TIME_TO_WAIT_FOR_INCOMING_BYTE = 0.01
-THROUGH_HARDWARE_SERIAL_MAX_TIME_TO_WAIT_FOR_RESPONSE_BYTE = 0.5
-THROUGH_HARDWARE_SERIAL_MIN_TIME_CHANNEL_CLEARANCE = 0.0001
+READER_IDLE_SLEEP = 0.001  # for ports returning from read() right away when there is no data
+ACK_TIMEOUT_FLOOR = 0.002  # adaptive ACK timeout never drops below it to tolerate host scheduling jitter
 
 
 class UnsupportedPayloadType(Exception):
@@ -17,11 +22,15 @@ class UnsupportedPayloadType(Exception):
 
 
 class PJONserialStrategy(object):
-    def __init__(self, serial_port=None):
+    """ with start_reader() a background thread reads the port in bulk into a capped in-memory buffer
+    and receive_* calls are served from memory
+
+    timeouts come from a SerialTiming instance built for the port baud rate unless timing is passed """
+    def __init__(self, serial_port=None, read_buffer_size=32768, timing=None):
         if serial_port is None:
             raise NotImplementedError("serial==None but autodiscovery of serial-pjon proxy is not imeplemented yet")
         else:
-            log.info("passed serial port %s" % serial_port)
+            log.info("passed serial port %s", serial_port)
             self._ser = serial_port
             if self._ser.closed:
                 log.debug("openning serial")
@@ -30,27 +39,170 @@ class PJONserialStrategy(object):
             # time.sleep(3)
             self._ser.flushInput()
             self._ser.flushOutput()
-            self._read_buffer = []
-            self._READ_BUFFER_SIZE = 32768
+            self._read_buffer = bytearray()
+            self._READ_BUFFER_SIZE = read_buffer_size
 
+        self._read_condition = threading.Condition()
+        self._reader_thread = None
+        self._reader_stopped = True
+        self._data_callback = None
+        self._bytes_read = 0
+        self._overflow_events = 0
+        self._dropped_bytes = 0
         self._last_received_ts = 0
+        self._last_frame_length = pjon_protocol_constants.PACKET_MAX_LENGTH
+        self._rtt = {}
+        self._adaptive_ack_timeout = True
+        self._ack_timeout_floor = ACK_TIMEOUT_FLOOR
+        self._ack_timeout_ceiling = None
+        self._tracer = tracing.Tracer()
+        if timing is None:
+            timing = self._get_port_timing()
+        self.set_timing(timing)
+
+    def _get_port_timing(self):
+        baud_rate = getattr(self._ser, 'baudrate', None)
+        if isinstance(baud_rate, (int, float)) and not isinstance(baud_rate, bool) and baud_rate > 0:
+            return SerialTiming(baud_rate)
+        return SerialTiming()
+
+    @property
+    def timing(self):
+        return self._timing
+
+    def set_timing(self, timing):
+        """ replaces the timing model; channel state is reset to match the new byte time """
+        self._timing = timing
+        self._channel = ChannelState(byte_time=timing.byte_time, clearance=timing.channel_clearance(),
+                                     inter_byte_gap=max(timing.inter_byte_gap(), timing.channel_clearance()))
+
+    @property
+    def last_received_ts(self):
+        return self._last_received_ts
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    def set_tracer(self, tracer):
+        self._tracer = tracer
+
+    @property
+    def reader_running(self):
+        return self._reader_thread is not None
+
+    def set_data_callback(self, data_callback):
+        """ data_callback() is called from the reader thread after new bytes were buffered """
+        self._data_callback = data_callback
+
+    def start_reader(self):
+        if self._reader_thread is not None:
+            return
+        self._reader_stopped = False
+        self._reader_thread = threading.Thread(target=self._read_loop, name="pjon-serial-reader")
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+
+    def stop_reader(self, timeout=1.0):
+        if self._reader_thread is None:
+            return
+        self._reader_stopped = True
+        cancel_read = getattr(self._ser, 'cancel_read', None)
+        if cancel_read is not None:
+            try:
+                cancel_read()
+            except Exception:
+                log.debug("cancel_read not supported by serial port")
+        self._reader_thread.join(timeout)
+        self._reader_thread = None
+
+    def get_reader_stats(self):
+        with self._read_condition:
+            return {
+                'buffered_bytes': len(self._read_buffer),
+                'bytes_read': self._bytes_read,
+                'overflow_events': self._overflow_events,
+                'dropped_bytes': self._dropped_bytes,
+            }
+
+    def _read_loop(self):
+        while not self._reader_stopped:
+            try:
+                rcv_vals = self._ser.read(size=max(1, self._ser.inWaiting()))
+            except StopIteration:  # needed for mocking in unit tests
+                rcv_vals = None
+            except Exception:
+                if self._reader_stopped or self._ser.closed:
+                    break
+                log.exception("serial read failed")
+                time.sleep(READER_IDLE_SLEEP)
+                continue
+            if rcv_vals:
+                self._buffer_received(to_byte_array(rcv_vals))
+            else:
+                time.sleep(READER_IDLE_SLEEP)
+
+    def _buffer_received(self, data):
+        with self._read_condition:
+            self._read_buffer.extend(data)
+            self._bytes_read += len(data)
+            overflow = len(self._read_buffer) - self._READ_BUFFER_SIZE
+            if overflow > 0:
+                del self._read_buffer[:overflow]  # oldest bytes are dropped
+                self._overflow_events += 1
+                self._dropped_bytes += overflow
+            self._last_received_ts = time.time()
+            self._channel.on_bytes(data, self._last_received_ts)
+            self._read_condition.notify_all()
+        if overflow > 0:
+            log.error("serial read buffer overflow; %s oldest bytes dropped", overflow)
+        if self._tracer.enabled:
+            self._tracer.record(tracing.BYTES_RX, len(data), 0.0)
+        if self._data_callback is not None:
+            self._data_callback()
+
+    def _take_buffered(self, size, wait_time):
+        """ returns up to size bytes (all if size is None) from the read buffer waiting up to wait_time
+        for the first one """
+        with self._read_condition:
+            if not self._read_buffer and wait_time > 0:
+                deadline = time.time() + wait_time
+                while not self._read_buffer:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or self._reader_stopped:
+                        break
+                    self._read_condition.wait(remaining)
+            if size is None:
+                data = self._read_buffer
+                self._read_buffer = bytearray()
+            else:
+                data = self._read_buffer[:size]
+                del self._read_buffer[:size]
+            return data
 
     def can_start(self):
+        """ with reader thread running the channel model is fed with every received byte so no port
+        access is needed; otherwise bytes still waiting in the port mean the channel is in use.
+        Bytes not processed yet hold transmission too, the response wait would take them for ACK/NAK """
+        if not self._channel.is_clear(time.time()):
+            return False
+        if self._reader_thread is not None:
+            return not self._read_buffer
         if self._ser:
-            if self._ser.inWaiting() == 0:
-                if time.time() - self._last_received_ts > THROUGH_HARDWARE_SERIAL_MIN_TIME_CHANNEL_CLEARANCE:
-                    return True
+            return self._ser.inWaiting() == 0
         return False
 
     def send_byte(self, b):
         try:
             if type(b) is str and len(b) == 1:
-                log.debug("sending byte: %s (%s)" % (b, ord(b)))
                 self._ser.write(b)
             elif type(b) is int:
                 b = chr(b)
                 if type(b) is str and len(b) == 1:
-                    log.debug("sending byte: %s (%s)" % (b, ord(b)))
                     self._ser.write(b)
                 else:
                     raise TypeError
@@ -64,50 +216,125 @@ class PJONserialStrategy(object):
 
         return 0
 
+    def send_frame(self, frame):
+        """ writes the whole encoded frame (bytes or bytearray) to the serial port in a single call """
+        self._last_frame_length = len(frame)
+        try:
+            self._ser.write(frame)
+        except SerialTimeoutException:
+            log.exception("write timeout")
+
+        return 0
+
     def receive_byte(self, is_ack_response=False):
-        # FIXME: move serial port reading to thread reading input to queue and change receive_byte to read from queue
-        ##log.debug("    >>> rcv byte")
-        if len(self._read_buffer) > 0:
-            return self._read_buffer.pop()
+        if is_ack_response:
+            receive_wait_time = self._timing.response_timeout(self._last_frame_length)
+        else:
+            receive_wait_time = self._timing.inter_byte_timeout()
+        return self._wait_for_byte(receive_wait_time)[0]
+
+    def _wait_for_byte(self, receive_wait_time):
+        """ returns (byte, seconds waited for it) or (FAIL, None) """
+        if self._reader_thread is not None:
+            start_time = time.time()
+            data = self._take_buffered(1, receive_wait_time)
+            if data:
+                return data[0], max(0, self._last_received_ts - start_time)
+            return pjon_protocol_constants.FAIL, None
 
         start_time = time.time()
-        receive_wait_time = THROUGH_HARDWARE_SERIAL_MAX_TIME_TO_WAIT_FOR_INCOMING_BYTE
-        if is_ack_response:
-            receive_wait_time = THROUGH_HARDWARE_SERIAL_MAX_TIME_TO_WAIT_FOR_RESPONSE_BYTE
         while time.time() - start_time < receive_wait_time:
             try:
-                if True:
-                    rcv_vals = self._ser.read(size=1)
-                    for rcv_val in rcv_vals:
-                        if rcv_val != '':
-                            # log.debug("      > received byte: %s (%s)" % (ord(rcv_val), rcv_val))
-                            self._last_received_ts = time.time()
-                            return ord(rcv_val)
-                    '''
-                    bytes_waiting = self._ser.inWaiting()
-                    if bytes_waiting > 0:  #  bug in pyserial? for single byte 0 is returned
-                        #log.debug("     >> waiting bytes: %s" % bytes_waiting)
-                        rcv_vals = self._ser.read(size=1)
-                        for rcv_val in rcv_vals:
-                            if rcv_val != '':
-                                #log.debug("      > received byte: %s (%s)" % (ord(rcv_val), rcv_val))
-                                self._last_received_ts = time.time()
-                                #self._read_buffer.append(ord(rcv_val))
-                                return ord(rcv_val)
-                    #if len(self._read_buffer) > 0:
-                    #    if len(self._read_buffer) > self._READ_BUFFER_SIZE:
-                    #        log.error("serial read buffer over max size trimming last bytes")
-                    #        self._read_buffer = self._read_buffer[:self._READ_BUFFER_SIZE]
-                    #    return self._read_buffer.pop()
-                    #time.sleep(0.0005)
-                    '''
+                rcv_vals = self._ser.read(size=1)
+                for rcv_val in rcv_vals:
+                    if rcv_val != '':
+                        self._last_received_ts = time.time()
+                        if type(rcv_val) is not int:
+                            rcv_val = ord(rcv_val)
+                        self._channel.on_bytes((rcv_val,), self._last_received_ts)
+                        return rcv_val, self._last_received_ts - start_time
+            except StopIteration:  # needed for mocking in unit tests
+                pass
+        return pjon_protocol_constants.FAIL, None
 
+    def receive_bytes(self):
+        """ reads everything waiting in the serial input buffer in one call; waits up to
+        timing.inter_byte_timeout() for the first byte to arrive
+        (with reader thread running returns what is buffered without waiting) """
+        if self._reader_thread is not None:
+            return self._take_buffered(None, 0)
+
+        receive_wait_time = self._timing.inter_byte_timeout()
+        start_time = time.time()
+        while time.time() - start_time < receive_wait_time:
+            try:
+                rcv_vals = self._ser.read(size=max(1, self._ser.inWaiting()))
+                if rcv_vals:
+                    self._last_received_ts = time.time()
+                    if self._tracer.enabled:
+                        self._tracer.record(tracing.BYTES_RX, len(rcv_vals), self._last_received_ts - start_time)
+                    received = to_byte_array(rcv_vals)
+                    self._channel.on_bytes(received, self._last_received_ts)
+                    return received
             except StopIteration:  # needed for mocking in unit tests
                 pass
-        return pjon_protocol_constants.FAIL
+        return bytearray()
+
+    def set_ack_timeout_bounds(self, floor=None, ceiling=None):
+        """ floor and ceiling of adaptive ACK timeout in seconds; ceiling=None uses timing.response_timeout() """
+        if floor is not None:
+            self._ack_timeout_floor = floor
+        self._ack_timeout_ceiling = ceiling
+
+    def set_adaptive_ack_timeout(self, enabled):
+        self._adaptive_ack_timeout = enabled
 
-    def receive_response(self):
-        return self.receive_byte(is_ack_response=True)
+    def get_ack_timeout(self, device_id=None):
+        ceiling = self._ack_timeout_ceiling
+        if ceiling is None:
+            ceiling = self._timing.response_timeout(self._last_frame_length)
+        rtt = self._rtt.get(device_id)
+        if rtt is None or not self._adaptive_ack_timeout:
+            return ceiling
+        # RTT samples exclude transmission time so they apply to frames of any length
+        frame_time = self._timing.frame_time(self._last_frame_length)
+        return min(frame_time + rtt.timeout(min(self._ack_timeout_floor, ceiling), ceiling), ceiling)
+
+    def get_rtt_stats(self, device_id=None):
+        """ RTT statistics of a single device or dict of them for all devices which were sent a frame """
+        if device_id is not None:
+            rtt = self._rtt.get(device_id)
+            return rtt.as_dict() if rtt is not None else None
+        return dict((dev_id, rtt.as_dict()) for dev_id, rtt in list(self._rtt.items()))
+
+    def reset_rtt(self, device_id=None):
+        if device_id is None:
+            self._rtt.clear()
+        else:
+            self._rtt.pop(device_id, None)
+
+    def receive_response(self, device_id=None):
+        """ waits for ACK/NAK; when device_id is given the wait adapts to RTT measured for the device
+
+        the wait starts when the frame was handed to the port so the frame's own transmission time
+        is subtracted from RTT samples and added back to the timeout of every frame """
+        if device_id is None:
+            return self.receive_byte(is_ack_response=True)
+
+        response, waited = self._wait_for_byte(self.get_ack_timeout(device_id))
+        self.record_response(device_id, waited)
+        return response
+
+    def record_response(self, device_id, waited):
+        """ updates RTT of device_id; waited is time between writing the frame and its response or
+        None if no response came in time """
+        rtt = self._rtt.get(device_id)
+        if rtt is None:
+            rtt = self._rtt[device_id] = RttEstimator()
+        if waited is None:
+            rtt.on_timeout()
+        else:
+            rtt.add_sample(max(0, waited - self._timing.frame_time(self._last_frame_length)))
 
     def send_response(self, response):
         self.send_byte(response)
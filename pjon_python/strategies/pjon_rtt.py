@@ -0,0 +1,59 @@
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+RTT_K = 4
+MAX_BACKOFF = 64
+
+
+class RttEstimator(object):
+    """ smoothed round-trip time and variance of ACK responses from a single device (RFC 6298 style)
+
+    timeout() is srtt + K * rttvar, doubled for every consecutive response timeout and bounded by
+    floor and ceiling; until the first sample arrives the ceiling is used
+    """
+    __slots__ = ('srtt', 'rttvar', 'samples', 'timeouts', 'last_rtt', 'min_rtt', 'max_rtt', '_backoff')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.timeouts = 0
+        self.last_rtt = None
+        self.min_rtt = None
+        self.max_rtt = None
+        self._backoff = 1
+
+    def add_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples += 1
+        self.last_rtt = rtt
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if self.max_rtt is None or rtt > self.max_rtt:
+            self.max_rtt = rtt
+        self._backoff = 1
+
+    def on_timeout(self):
+        self.timeouts += 1
+        self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+
+    def timeout(self, floor, ceiling):
+        if self.srtt is None:
+            return ceiling
+        rto = (self.srtt + RTT_K * self.rttvar) * self._backoff
+        return min(max(rto, floor), ceiling)
+
+    def as_dict(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+            'last_rtt': self.last_rtt,
+            'min_rtt': self.min_rtt,
+            'max_rtt': self.max_rtt,
+        }
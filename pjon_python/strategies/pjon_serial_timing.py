@@ -0,0 +1,47 @@
+from pjon_python.protocol import pjon_protocol_constants
+from pjon_python.strategies.pjon_channel_state import DEFAULT_BAUD_RATE, get_byte_time
+
+
+class SerialTiming(object):
+    """ strategy timeouts derived from baud rate and frame length
+
+    turnaround is the time the remote device needs between receiving a frame and starting its
+    response; host_latency covers OS and USB-serial adapter delays on this side. Every value is
+    computed by a method so subclasses (or instances with adjusted attributes) can override any of them.
+    """
+    def __init__(self, baud_rate=DEFAULT_BAUD_RATE, turnaround=0.005, host_latency=0.005, inter_byte_gap_bytes=3,
+                 clearance_bytes=1, min_clearance=0.0001):
+        self.baud_rate = baud_rate
+        self.turnaround = turnaround
+        self.host_latency = host_latency
+        self.inter_byte_gap_bytes = inter_byte_gap_bytes
+        self.clearance_bytes = clearance_bytes
+        self.min_clearance = min_clearance
+
+    @property
+    def byte_time(self):
+        return get_byte_time(self.baud_rate)
+
+    def frame_time(self, frame_length):
+        return frame_length * self.byte_time
+
+    def inter_byte_gap(self):
+        """ silence on the wire ending a frame """
+        return self.inter_byte_gap_bytes * self.byte_time
+
+    def inter_byte_timeout(self):
+        """ how long to wait for the next byte of a frame being received """
+        return self.host_latency + self.inter_byte_gap()
+
+    def response_timeout(self, frame_length=pjon_protocol_constants.PACKET_MAX_LENGTH):
+        """ how long to wait for ACK/NAK after writing a frame; the frame may still be
+        leaving the transmit buffer when the wait starts """
+        return self.frame_time(frame_length) + self.turnaround + self.byte_time + self.host_latency
+
+    def channel_clearance(self):
+        """ silence required after the last received byte before transmitting """
+        return max(self.min_clearance, self.clearance_bytes * self.byte_time)
+
+    def __str__(self):
+        return "SerialTiming(baud=%s, inter_byte_timeout=%.6f, response_timeout=%.6f, clearance=%.6f)" % \
+               (self.baud_rate, self.inter_byte_timeout(), self.response_timeout(), self.channel_clearance())
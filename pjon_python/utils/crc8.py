@@ -5,10 +5,7 @@ if sys.version_info[0] == 3:
 
 
 def calc_crc_for_byte_array(byte_array):
-    crc = 0
-    for b in byte_array:
-        crc = AddToCRC(b, crc)
-    return crc
+    return crc8_update(byte_array)
 
 
 def calc_crc_for_hex_string(incoming):
@@ -17,11 +14,7 @@ def calc_crc_for_hex_string(incoming):
         hex_data = codecs.decode(incoming, "hex_codec")
     else:
         hex_data = incoming.decode("hex")
-    msg = bytearray(hex_data)
-    result = 0
-    for i in msg:
-        result = AddToCRC(i, result)
-    return hex(result)
+    return hex(crc8_update(bytearray(hex_data)))
 
 
 def AddToCRC(b, crc):
@@ -37,6 +30,22 @@ def AddToCRC(b, crc):
     return crc
 
 
+""" lookup table with AddToCRC(b, 0) precomputed for every byte value; the crc is
+reflected (LSB first) so a single step is CRC8_TABLE[crc ^ b] """
+CRC8_TABLE = tuple(AddToCRC(i, 0) for i in range(256))
+
+
+def crc8_update(buffer, crc=0):
+    """ computes crc over the whole buffer in a single call starting from the passed crc;
+    buffer can be bytes, bytearray, memoryview or a sequence of ints """
+    table = CRC8_TABLE
+    if not isinstance(buffer, bytearray):
+        buffer = bytearray(buffer)
+    for b in buffer:
+        crc = table[crc ^ b]
+    return crc
+
+
 def check(incoming):
     """Returns True if CRC Outcome Is 0xx or 0x0"""
     result = calc_crc_for_hex_string(incoming)
@@ -65,6 +65,8 @@ class Serial:
         self._isOpen = False
 
     def write(self, string):
+        if isinstance(string, bytearray):
+            string = bytes(string)  # bytearray content is not preserved by jsonpickle
         message = dict()
         message['originator_uuid'] = self._uuid
         message['payload'] = string
@@ -0,0 +1,90 @@
+import errno
+import os
+import select
+import sys
+import threading
+
+
+def get_selectable_fileno(serial_port):
+    """ file descriptor usable with select() or None (Windows, fake serial, closed port) """
+    if sys.platform.startswith('win'):
+        return None
+    try:
+        fileno = serial_port.fileno()
+    except Exception:
+        return None
+    return fileno if isinstance(fileno, int) and fileno >= 0 else None
+
+
+class IoWaiter(object):
+    """ blocks the IO thread until serial port has incoming bytes, timeout passes or wake() is called
+
+    on POSIX serial port descriptor is select()-ed together with a self-pipe written by wake();
+    where the port is not selectable the waiter falls back to an event with poll_interval granularity.
+    serial_port None means arrival of data is signalled with wake() too (e.g. by a reader thread)
+    """
+    def __init__(self, serial_port, poll_interval=0.001):
+        self._wake_only = serial_port is None
+        self._fileno = None if self._wake_only else get_selectable_fileno(serial_port)
+        self._poll_interval = poll_interval
+        if self._fileno is not None:
+            self._wake_read_fd, self._wake_write_fd = os.pipe()
+            for fd in (self._wake_read_fd, self._wake_write_fd):
+                set_non_blocking(fd)
+            self._event = None
+        else:
+            self._wake_read_fd = self._wake_write_fd = None
+            self._event = threading.Event()
+
+    @property
+    def selectable(self):
+        return self._fileno is not None
+
+    def wake(self):
+        """ safe to call from any thread """
+        if self._event is not None:
+            self._event.set()
+            return
+        try:
+            os.write(self._wake_write_fd, b'\0')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):  # pipe full means wake-up is already pending
+                raise
+
+    def wait(self, timeout=None):
+        """ returns True if serial port may have incoming bytes """
+        if self._event is not None:
+            if not self._wake_only and (timeout is None or timeout > self._poll_interval):
+                timeout = self._poll_interval
+            woken = self._event.wait(timeout)
+            self._event.clear()
+            return woken or not self._wake_only
+
+        try:
+            readable, _, _ = select.select([self._fileno, self._wake_read_fd], [], [], timeout)
+        except (OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return True
+            raise
+        if self._wake_read_fd in readable:
+            self._drain_wake_pipe()
+        return self._fileno in readable
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_read_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        for fd in (self._wake_read_fd, self._wake_write_fd):
+            if fd is not None:
+                os.close(fd)
+        self._wake_read_fd = self._wake_write_fd = None
+
+
+def set_non_blocking(fd):
+    import fcntl
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
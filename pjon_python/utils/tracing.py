@@ -0,0 +1,57 @@
+import time
+from collections import deque
+
+''' Trace events '''
+FRAME_RX = 'frame_rx'            # receiver_id, sender_id, frame length
+FRAME_TX = 'frame_tx'            # recipient_id, frame length, header
+BYTES_RX = 'bytes_rx'            # bytes count, seconds waited for the first byte
+RESPONSE_RX = 'response_rx'      # recipient_id, response, seconds waited
+RETRY = 'retry'                  # recipient_id, attempts, send_string result
+COLLISION = 'collision'          # recipient_id, response
+CONNECTION_LOST = 'connection_lost'  # recipient_id, attempts
+
+
+class Tracer(object):
+    """ structured event recorder for the IO hot path
+
+    disabled by default; call sites check the enabled attribute before recording so a disabled
+    tracer costs a single attribute lookup:
+
+        if self._tracer.enabled:
+            self._tracer.record(tracing.FRAME_TX, recipient_id, len(frame), header)
+
+    when enabled events (timestamp, event, fields) are kept in a bounded in-memory ring
+    and can be dumped on demand.
+    """
+    def __init__(self, capacity=1024, enabled=False):
+        self.enabled = enabled
+        self._events = deque(maxlen=capacity)
+
+    @property
+    def capacity(self):
+        return self._events.maxlen
+
+    def enable(self, capacity=None):
+        if capacity is not None and capacity != self._events.maxlen:
+            self._events = deque(self._events, maxlen=capacity)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def record(self, event, *fields):
+        self._events.append((time.time(), event, fields))
+
+    def clear(self):
+        self._events.clear()
+
+    def dump(self, clear=False):
+        """ returns list of recorded (timestamp, event, fields) tuples, oldest first """
+        events = list(self._events)
+        if clear:
+            self._events.clear()
+        return events
+
+    def format_events(self, clear=False):
+        return ["%.6f %s %s" % (ts, event, " ".join(str(field) for field in fields))
+                for ts, event, fields in self.dump(clear=clear)]
@@ -408,11 +408,10 @@ class ReceivedPacketsProcessor(threading.Thread):
         return packet_string.split("data=")[-1]
 
     def get_packet_info_obj_for_packet_string(self, packet_str):
-        packet_info = PacketInfo()
-        PacketInfo.receiver_id = self.get_from_packet_string__rcv_id(packet_str)
-        PacketInfo.receiver_bus_id = self.get_from_packet_string__rcv_net(packet_str)
-        PacketInfo.sender_id = self.get_from_packet_string__snd_id(packet_str)
-        PacketInfo.sender_bus_id = self.get_from_packet_string__snd_net(packet_str)
+        packet_info = PacketInfo(receiver_id=self.get_from_packet_string__rcv_id(packet_str),
+                                 receiver_bus_id=self.get_from_packet_string__rcv_net(packet_str),
+                                 sender_id=self.get_from_packet_string__snd_id(packet_str),
+                                 sender_bus_id=self.get_from_packet_string__snd_net(packet_str))
         payload = self.get_from_packet_string__data(packet_str)
         length = self.get_from_packet_string__data_len(packet_str)
 
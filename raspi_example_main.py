@@ -5,12 +5,14 @@ import time
 # adjust serial port below to match your arduino's port
 # run this example; expected output:
 #
-# pakets in outgoing queue: 0
-# received from 35 payload: [66, 49, 50, 51, 52, 53, 54, 55, 56, 57]
-# pakets in outgoing queue: 0
-# pakets in outgoing queue: 0
-# received from 35 payload: [66, 49, 50, 51, 52, 53, 54, 55, 56, 57]
-# pakets in outgoing queue: 0
+# delivery to 35: 6
+# received from 35 payload: B123456789
+# delivery to 35: 6
+# delivery to 35: 6
+# received from 35 payload: B123456789
+# delivery to 35: 6
+#
+# (6 - ACK, 256 - FAIL, 257 - TIMEOUT)
 #
 
 cli = PjonBaseSerialClient(1, '/dev/ttyUSB1', write_timeout=0.005, timeout=0.005)
@@ -34,5 +36,6 @@ cli.set_error(error_handler)
 cli.start_client()
 
 while True:
-    print "pakets in outgoing queue: %s" % cli.send(35, "C123")
+    delivery = cli.send(35, "C123", delivery_timeout=1)
+    print "delivery to 35: %s" % delivery.result()
     time.sleep(.1)
\ No newline at end of file
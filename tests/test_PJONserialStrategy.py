@@ -1,8 +1,13 @@
+import threading
+import time
 from unittest import TestCase, skip
 
 import mock
 
+from pjon_python.protocol import pjon_protocol, pjon_protocol_constants
 from pjon_python.strategies.pjon_hwserial_strategy import PJONserialStrategy, UnsupportedPayloadType
+from pjon_python.strategies.pjon_rtt import RttEstimator
+from pjon_python.strategies.pjon_serial_timing import SerialTiming
 
 
 class TestPJONserialStrategy(TestCase):
@@ -65,3 +70,176 @@ class TestPJONserialStrategy(TestCase):
 
             self.assertEqual(len(serial_strategy._read_buffer), 32767)
 
+
+    def test_send_frame_should_write_whole_frame_in_single_call(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_strategy = PJONserialStrategy(serial_port=ser)
+            self.assertEquals(serial_strategy.send_frame(bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])), 0)
+            ser.write.assert_called_once_with(bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71]))
+
+    def test_receive_bytes_should_read_all_waiting_bytes_in_single_call(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            ser.inWaiting.return_value = 4
+            ser.read.return_value = [chr(item) for item in [1, 9, 2, 45]]
+            serial_strategy = PJONserialStrategy(serial_port=ser)
+
+            self.assertEqual(bytearray([1, 9, 2, 45]), serial_strategy.receive_bytes())
+            ser.read.assert_called_once_with(size=4)
+
+    def test_timing_should_follow_serial_port_baud_rate(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            ser.baudrate = 9600
+            serial_strategy = PJONserialStrategy(serial_port=ser)
+
+            self.assertEqual(9600, serial_strategy.timing.baud_rate)
+
+    def test_response_timeout_should_account_for_length_of_sent_frame(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            timing = SerialTiming(baud_rate=9600)
+            serial_strategy = PJONserialStrategy(serial_port=ser, timing=timing)
+            ser.read.return_value = b''
+            serial_strategy.send_frame(bytearray(10))
+
+            with mock.patch('time.time', side_effect=[0, 0, timing.response_timeout(10) - 0.0001,
+                                                      timing.response_timeout(10)]):
+                self.assertEqual(pjon_protocol_constants.FAIL, serial_strategy.receive_response())
+            self.assertEqual(2, ser.read.call_count)
+
+    def test_receive_response_should_measure_rtt_per_device(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            timing = SerialTiming(baud_rate=9600)
+            serial_strategy = PJONserialStrategy(serial_port=ser, timing=timing)
+            ser.read.return_value = [6]
+            serial_strategy.send_frame(bytearray(5))
+
+            with mock.patch('time.time', side_effect=[10.0, 10.0, 10.004 + timing.frame_time(5)]):
+                self.assertEqual(pjon_protocol_constants.ACK, serial_strategy.receive_response(7))
+
+            stats = serial_strategy.get_rtt_stats(7)
+            self.assertAlmostEqual(0.004, stats['srtt'])
+            self.assertEqual(1, stats['samples'])
+            self.assertEqual([7], list(serial_strategy.get_rtt_stats().keys()))
+            self.assertIsNone(serial_strategy.get_rtt_stats(8))
+
+    def test_ack_timeout_should_adapt_to_measured_rtt_within_bounds(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            timing = SerialTiming(baud_rate=9600)
+            serial_strategy = PJONserialStrategy(serial_port=ser, timing=timing)
+            serial_strategy.send_frame(bytearray(5))
+            ceiling = serial_strategy.get_ack_timeout(7)
+            serial_strategy._rtt[7] = RttEstimator()
+            serial_strategy._rtt[7].add_sample(0.0002)
+
+            self.assertAlmostEqual(timing.frame_time(5) + 0.002, serial_strategy.get_ack_timeout(7))
+            self.assertEqual(ceiling, serial_strategy.get_ack_timeout(8))
+
+            serial_strategy.set_ack_timeout_bounds(floor=0.0001, ceiling=0.0005)
+            self.assertEqual(0.0005, serial_strategy.get_ack_timeout(7))
+
+            serial_strategy.set_adaptive_ack_timeout(False)
+            self.assertEqual(0.0005, serial_strategy.get_ack_timeout(7))
+
+    def test_ack_timeout_learned_with_short_frames_should_cover_long_frame(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            timing = SerialTiming(baud_rate=9600)
+            serial_strategy = PJONserialStrategy(serial_port=ser, timing=timing)
+            ser.read.return_value = [6]
+            for frame_length in (5, 5, 5, 45, 5):
+                serial_strategy.send_frame(bytearray(frame_length))
+                with mock.patch('time.time', side_effect=[0, 0, 0.003 + timing.frame_time(frame_length)]):
+                    self.assertEqual(pjon_protocol_constants.ACK, serial_strategy.receive_response(7))
+
+            self.assertAlmostEqual(0.003, serial_strategy.get_rtt_stats(7)['max_rtt'])
+            serial_strategy.send_frame(bytearray(45))
+            self.assertGreater(serial_strategy.get_ack_timeout(7), timing.frame_time(45) + 0.003)
+            serial_strategy.send_frame(bytearray(5))
+            self.assertLess(serial_strategy.get_ack_timeout(7), timing.frame_time(45))
+
+    def test_missing_response_should_count_timeout_for_device(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_strategy = PJONserialStrategy(serial_port=ser)
+            ser.read.return_value = b''
+
+            with mock.patch('time.time', side_effect=[0, 1, 1]):
+                self.assertEqual(pjon_protocol_constants.FAIL, serial_strategy.receive_response(7))
+
+            self.assertEqual(1, serial_strategy.get_rtt_stats(7)['timeouts'])
+
+
+class TestPJONserialStrategyReaderThread(TestCase):
+    def setUp(self):
+        self.chunks = []
+        self.serial_patcher = mock.patch('serial.Serial', create=True)
+        self.ser = self.serial_patcher.start()
+        self.ser.inWaiting.side_effect = lambda: len(self.chunks[0]) if self.chunks else 0
+
+        def read(size=1):
+            if self.chunks:
+                return self.chunks.pop(0)
+            time.sleep(0.001)
+            return b''
+        self.ser.read.side_effect = read
+
+    def tearDown(self):
+        self.serial_strategy.stop_reader()
+        self.serial_patcher.stop()
+
+    def start_reader(self, read_buffer_size=32768):
+        self.serial_strategy = PJONserialStrategy(serial_port=self.ser, read_buffer_size=read_buffer_size)
+        self.data_callback = mock.Mock()
+        self.serial_strategy.set_data_callback(self.data_callback)
+        self.serial_strategy.start_reader()
+
+    def wait_for_buffered(self, count):
+        deadline = time.time() + 1
+        while self.serial_strategy.get_reader_stats()['bytes_read'] < count and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_receive_bytes_should_return_bytes_read_in_bulk_by_reader(self):
+        self.chunks.extend([b'\x01\x09\x02', b'\x2d'])
+        self.start_reader()
+        self.wait_for_buffered(4)
+
+        self.assertEqual(bytearray([1, 9, 2, 45]), self.serial_strategy.receive_bytes())
+        self.assertEqual(bytearray(), self.serial_strategy.receive_bytes())
+        self.ser.read.assert_any_call(size=3)
+        self.assertTrue(self.data_callback.called)
+
+    def test_receive_response_should_wait_for_byte_from_reader(self):
+        self.start_reader()
+        self.serial_strategy.set_timing(SerialTiming(turnaround=0.2))
+        threading.Timer(0.02, self.chunks.append, args=(b'\x06',)).start()
+
+        self.assertEqual(6, self.serial_strategy.receive_response())
+        self.assertEqual(pjon_protocol_constants.FAIL, self.serial_strategy.receive_byte())
+
+    def test_reader_should_drop_oldest_bytes_on_overflow(self):
+        self.chunks.extend([b'\x01\x02\x03', b'\x04\x05\x06'])
+        self.start_reader(read_buffer_size=4)
+        self.wait_for_buffered(6)
+
+        stats = self.serial_strategy.get_reader_stats()
+        self.assertEqual(1, stats['overflow_events'])
+        self.assertEqual(2, stats['dropped_bytes'])
+        self.assertEqual(bytearray([3, 4, 5, 6]), self.serial_strategy.receive_bytes())
+
+    def test_can_start_should_check_channel_model_instead_of_serial_port(self):
+        self.start_reader()
+        self.ser.inWaiting.reset_mock()
+
+        self.assertTrue(self.serial_strategy.can_start())
+        self.serial_strategy._buffer_received(bytearray([1]))
+        self.assertFalse(self.serial_strategy.can_start())
+        self.assertFalse(self.ser.inWaiting.called)
+
+    def test_can_start_should_wait_for_buffered_bytes_to_be_processed(self):
+        self.start_reader()
+        frame = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])
+        self.serial_strategy._buffer_received(frame)
+        proto = pjon_protocol.PjonProtocol(2, strategy=self.serial_strategy)
+
+        with mock.patch('time.time', return_value=time.time() + 1):  # channel quiet for long
+            self.assertFalse(self.serial_strategy.can_start())
+            self.assertEqual(pjon_protocol_constants.BUSY, proto.send_string(1, 'B', packet_header=6))
+        self.assertEqual(frame, self.serial_strategy.receive_bytes())
+        self.assertTrue(self.serial_strategy.can_start())
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import time
+from unittest import TestCase, skipIf
+
+import serial
+
+from pjon_python.async_client import AsyncPjonClient
+from pjon_python.protocol import pjon_protocol_constants
+from pjon_python.protocol.pjon_frame import encode_frame
+from pjon_python.strategies.pjon_serial_timing import SerialTiming
+
+
+@skipIf(not hasattr(os, 'openpty'), "pty not available")
+class TestAsyncPjonClient(TestCase):
+    def setUp(self):
+        self.master_fd, slave_fd = os.openpty()
+        self.ser = serial.Serial(os.ttyname(slave_fd), 115200, timeout=0.005)
+        os.close(slave_fd)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.ser.close()
+        os.close(self.master_fd)
+
+    def respond_to_frames(self, response_byte, frames_count=1):
+        """ plays remote device: reads frames written by the client and answers each with response_byte """
+        def responder():
+            for i in range(frames_count):
+                data = bytearray()
+                while len(data) < 2 or len(data) < data[1]:
+                    data.extend(os.read(self.master_fd, 64))
+                os.write(self.master_fd, bytearray([response_byte]))
+        thread = threading.Thread(target=responder)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_send_should_resolve_on_ack(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                responder = self.respond_to_frames(pjon_protocol_constants.ACK)
+                result = await asyncio.wait_for(client.send(35, 'C123'), 5)
+                responder.join(1)
+                return result
+
+        self.assertEqual(pjon_protocol_constants.ACK, self.loop.run_until_complete(scenario()))
+
+    def test_send_should_resolve_with_timeout_when_not_acknowledged(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                client.protocol.set_circuit_breaker(False)
+                return await asyncio.wait_for(client.send(35, 'C123', delivery_timeout=0.2), 5)
+
+        self.assertEqual(pjon_protocol_constants.TIMEOUT, self.loop.run_until_complete(scenario()))
+
+    def test_packets_should_yield_received_packets(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                header = pjon_protocol_constants.SENDER_INFO_BIT
+                for payload in (b'first', b'second'):
+                    os.write(self.master_fd, encode_frame(1, payload, header, sender_id=35))
+                received = []
+                async for packet in client.packets():
+                    received.append((packet.packet_info.sender_id, packet.payload_as_bytes))
+                    if len(received) == 2:
+                        break
+                return received
+
+        received = self.loop.run_until_complete(asyncio.wait_for(scenario(), 5))
+        self.assertEqual([(35, b'first'), (35, b'second')], received)
+
+    def test_packets_should_follow_truncated_frame_start_once_port_goes_quiet(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                os.write(self.master_fd, bytearray([1, 40, 2, 9]) + encode_frame(1, b'after', 2, sender_id=35))
+                async for packet in client.packets():
+                    return packet.payload_as_bytes, client.protocol.decoder.truncated_frames
+
+        payload, truncated_frames = self.loop.run_until_complete(asyncio.wait_for(scenario(), 5))
+        self.assertEqual(b'after', payload)
+        self.assertEqual(1, truncated_frames)
+
+    def test_dispatch_from_other_thread_should_wake_up_the_loop(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                responder = self.respond_to_frames(pjon_protocol_constants.ACK)
+                delivery = await self.loop.run_in_executor(None, client.protocol.send_tracked, 35, 'C123')
+                result = await asyncio.wait_for(asyncio.wrap_future(delivery), 5)
+                responder.join(1)
+                return result
+
+        self.assertEqual(pjon_protocol_constants.ACK, self.loop.run_until_complete(scenario()))
+
+    def test_waiting_for_ack_should_not_block_the_loop(self):
+        async def ticker(gaps, stop):
+            last_ts = time.time()
+            while not stop.is_set():
+                await asyncio.sleep(0.005)
+                gaps.append(time.time() - last_ts)
+                last_ts = time.time()
+
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                client.protocol.set_circuit_breaker(False)
+                client.protocol.strategy.set_timing(SerialTiming(turnaround=0.2))  # slow, unresponsive device
+                gaps, stop = [], asyncio.Event()
+                ticks = asyncio.ensure_future(ticker(gaps, stop))
+                result = await asyncio.wait_for(client.send(35, 'C123', delivery_timeout=0.5), 5)
+                stop.set()
+                await ticks
+                return result, client.protocol.strategy.get_rtt_stats(35), max(gaps)
+
+        result, rtt_stats, max_gap = self.loop.run_until_complete(scenario())
+        self.assertEqual(pjon_protocol_constants.TIMEOUT, result)
+        self.assertTrue(rtt_stats['timeouts'] >= 1)
+        self.assertLess(max_gap, 0.1)
+
+    def test_send_should_reject_blocking_dispatch(self):
+        async def scenario():
+            async with AsyncPjonClient(1, self.ser) as client:
+                await client.send(35, 'C123', block=True)
+
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(scenario())
@@ -9,3 +9,19 @@ class TestCelc_crc_for_byte_array(TestCase):
         self.assertEquals(198, crc8.calc_crc_for_byte_array([1, 8, 2, 45, 65, 66, 67]))
         self.assertEquals(71, crc8.calc_crc_for_byte_array([1, 9, 2, 45, 65, 65, 65, 65]))
         self.assertEquals(57, crc8.calc_crc_for_byte_array([35, 8, 1, 67, 49, 50, 51]))
+
+    def test_crc8_update_should_match_bitwise_crc_for_all_supported_buffer_types(self):
+        data = [1, 21, 2, 45, 49, 97, 50, 115, 51, 100, 52, 102, 53, 103, 54, 104, 55, 106, 56, 107]
+        self.assertEquals(106, crc8.crc8_update(bytes(bytearray(data))))
+        self.assertEquals(106, crc8.crc8_update(bytearray(data)))
+        self.assertEquals(106, crc8.crc8_update(memoryview(bytearray(data))))
+        self.assertEquals(106, crc8.crc8_update(data))
+
+    def test_crc8_update_should_continue_from_passed_crc(self):
+        data = bytearray([1, 9, 2, 45, 65, 65, 65, 65])
+        self.assertEquals(71, crc8.crc8_update(memoryview(data)[4:], crc8.crc8_update(memoryview(data)[:4])))
+
+    def test_crc8_table_should_match_bitwise_crc(self):
+        for b in range(256):
+            for crc in (0, 1, 0x8C, 255):
+                self.assertEquals(crc8.AddToCRC(b, crc), crc8.crc8_update([b], crc))
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from pjon_python.strategies.pjon_channel_state import ChannelState, get_byte_time
+
+
+class TestChannelState(TestCase):
+    def setUp(self):
+        self.byte_time = get_byte_time(9600)
+        self.channel = ChannelState(byte_time=self.byte_time, clearance=0.0001)
+
+    def test_byte_time_should_follow_baud_rate(self):
+        self.assertAlmostEqual(0.0010417, get_byte_time(9600), places=6)
+        self.assertAlmostEqual(0.00001, get_byte_time(1000000))
+
+    def test_should_be_clear_when_nothing_was_received(self):
+        self.assertTrue(self.channel.is_clear(0))
+
+    def test_should_stay_busy_until_end_of_frame_announced_by_length_byte(self):
+        self.channel.on_bytes(bytearray([35, 20]), now=100.0)  # first 2 of 20 bytes arrived
+
+        frame_start = 100.0 - self.byte_time
+        self.assertAlmostEqual(frame_start + 20 * self.byte_time, self.channel.expected_frame_end)
+        self.assertFalse(self.channel.is_clear(100.0 + 10 * self.byte_time))
+        self.assertTrue(self.channel.is_clear(frame_start + 20 * self.byte_time + 0.0001))
+
+    def test_should_be_clear_right_after_complete_frame(self):
+        self.channel.on_bytes(bytearray([35, 5, 0, 65, 99]), now=100.0)
+
+        self.assertEqual(1, self.channel.frames_seen)
+        self.assertFalse(self.channel.is_clear(100.0))
+        self.assertTrue(self.channel.is_clear(100.0 + 0.0001))
+
+    def test_lone_byte_should_keep_channel_busy_for_inter_byte_gap_only(self):
+        self.channel.on_bytes(bytearray([6]), now=100.0)  # ACK
+
+        self.assertFalse(self.channel.is_clear(100.0 + self.byte_time))
+        self.assertTrue(self.channel.is_clear(100.0 + self.channel.inter_byte_gap))
+
+    def test_gap_should_start_new_frame(self):
+        self.channel.on_bytes(bytearray([6]), now=100.0)
+        self.channel.on_bytes(bytearray([35, 5, 0, 65, 99]), now=101.0)
+
+        self.assertEqual(1, self.channel.frames_seen)
+        self.assertAlmostEqual(101.0 - 4 * self.byte_time + 5 * self.byte_time, self.channel.expected_frame_end)
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from unittest import TestCase, skipIf
+
+import mock
+import serial
+
+from pjon_python.base_client import PjonIoUpdateThread
+from pjon_python.protocol import pjon_protocol, pjon_protocol_constants
+from pjon_python.strategies import pjon_hwserial_strategy
+from pjon_python.utils import io_wait
+
+
+@skipIf(not hasattr(os, 'openpty'), "pty not available")
+class TestIoWaiter(TestCase):
+    def setUp(self):
+        self.master_fd, slave_fd = os.openpty()
+        self.ser = serial.Serial(os.ttyname(slave_fd), 115200, timeout=0.005)
+        os.close(slave_fd)
+        self.waiter = io_wait.IoWaiter(self.ser)
+
+    def tearDown(self):
+        self.waiter.close()
+        self.ser.close()
+        os.close(self.master_fd)
+
+    def test_should_use_select_on_serial_port(self):
+        self.assertTrue(self.waiter.selectable)
+
+    def test_should_time_out_when_nothing_happens(self):
+        start_ts = time.time()
+        self.assertFalse(self.waiter.wait(0.05))
+        self.assertTrue(time.time() - start_ts >= 0.04)
+
+    def test_should_return_readable_when_bytes_arrive(self):
+        threading.Timer(0.02, os.write, args=(self.master_fd, b'\x01')).start()
+        start_ts = time.time()
+        self.assertTrue(self.waiter.wait(5))
+        self.assertTrue(time.time() - start_ts < 1)
+
+    def test_should_return_on_wake_from_other_thread(self):
+        threading.Timer(0.02, self.waiter.wake).start()
+        start_ts = time.time()
+        self.assertFalse(self.waiter.wait(5))
+        self.assertTrue(time.time() - start_ts < 1)
+        self.assertFalse(self.waiter.wait(0))  # wake-up consumed
+
+    def test_should_fall_back_to_event_for_not_selectable_port(self):
+        waiter = io_wait.IoWaiter(object(), poll_interval=0.01)
+        self.assertFalse(waiter.selectable)
+        waiter.wake()
+        start_ts = time.time()
+        self.assertTrue(waiter.wait(5))
+        self.assertTrue(time.time() - start_ts < 0.01)
+        waiter.close()
+
+
+@skipIf(not hasattr(os, 'openpty'), "pty not available")
+class TestPjonIoUpdateThread(TestCase):
+    def setUp(self):
+        self.master_fd, slave_fd = os.openpty()
+        self.ser = serial.Serial(os.ttyname(slave_fd), 115200, timeout=0.005)
+        os.close(slave_fd)
+        self.proto = pjon_protocol.PjonProtocol(1, strategy=pjon_hwserial_strategy.PJONserialStrategy(self.ser))
+        self.proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+        self.proto.update = mock.Mock(wraps=self.proto.update)
+        self.proto.receive = mock.Mock(wraps=self.proto.receive)
+        self.io_thread = PjonIoUpdateThread(self.proto, self.ser)
+        self.io_thread.start()
+
+    def tearDown(self):
+        self.io_thread.stop()
+        self.io_thread.join()
+        self.ser.close()
+        os.close(self.master_fd)
+
+    def wait_for(self, condition, timeout=1.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.001)
+        return condition()
+
+    def test_should_sleep_when_idle(self):
+        time.sleep(0.3)
+        self.assertTrue(self.proto.update.call_count <= 3)
+        self.assertTrue(self.proto.receive.call_count <= 1)
+
+    def test_should_wake_up_on_dispatch_from_other_thread(self):
+        time.sleep(0.05)
+        self.proto.dispatch(2, 'test')
+        self.assertTrue(self.wait_for(lambda: self.proto.send_string.called, timeout=0.2))
+
+    def test_should_wake_up_on_incoming_bytes(self):
+        time.sleep(0.05)
+        receive_calls = self.proto.receive.call_count
+        os.write(self.master_fd, b'\x01')
+        self.assertTrue(self.wait_for(lambda: self.proto.receive.call_count > receive_calls, timeout=0.2))
+
+
+    def test_should_give_up_truncated_frame_start_when_port_goes_quiet(self):
+        received = []
+        self.proto.set_receiver(lambda payload, length, packet_info: received.append(payload))
+        time.sleep(0.05)
+        os.write(self.master_fd, bytearray([1, 40, 2, 9]) + bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71]))
+
+        self.assertTrue(self.wait_for(lambda: received, timeout=1.0))
+        self.assertEqual([b'AAAA'], received)
+        self.assertEqual(1, self.proto.decoder.truncated_frames)
+        self.assertEqual(0, self.proto.decoder.buffered_bytes_count)
+
+class TestWakeOnlyIoWaiter(TestCase):
+    def test_should_sleep_until_woken_when_data_is_signalled_by_reader(self):
+        waiter = io_wait.IoWaiter(None)
+        start_ts = time.time()
+        self.assertFalse(waiter.wait(0.05))
+        self.assertTrue(time.time() - start_ts >= 0.04)
+
+        threading.Timer(0.02, waiter.wake).start()
+        self.assertTrue(waiter.wait(5))
+        waiter.close()
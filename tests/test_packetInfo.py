@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from pjon_python.protocol.pjon_frame import pack_bus_id, unpack_bus_id
+from pjon_python.protocol.pjon_protocol import PacketInfo
+
+
+class TestPacketInfo(TestCase):
+    def test_packet_info__should_pack_bus_ids(self):
+        packet_info = PacketInfo(receiver_id=45, receiver_bus_id=[205, 205, 205, 205],
+                                 sender_id=44, sender_bus_id=[0, 0, 0, 1])
+
+        self.assertEqual(0xCDCDCDCD, packet_info.receiver_bus_id)
+        self.assertEqual(1, packet_info.sender_bus_id)
+        self.assertEqual([205, 205, 205, 205], unpack_bus_id(packet_info.receiver_bus_id))
+
+    def test_packet_info__should_be_immutable_and_not_shared_between_instances(self):
+        first = PacketInfo(receiver_id=1, sender_id=2)
+        second = PacketInfo(receiver_id=3, sender_id=4)
+
+        self.assertRaises(AttributeError, setattr, first, 'receiver_id', 5)
+        self.assertEqual(1, first.receiver_id)
+        self.assertEqual(3, second.receiver_id)
+        self.assertEqual(0, PacketInfo().receiver_id)
+
+    def test_pack_bus_id__should_accept_ints_and_byte_sequences(self):
+        self.assertEqual(0x01020304, pack_bus_id([1, 2, 3, 4]))
+        self.assertEqual(0x01020304, pack_bus_id(bytearray([1, 2, 3, 4])))
+        self.assertEqual(0x01020304, pack_bus_id(0x01020304))
@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from pjon_python.protocol import pjon_backoff
+
+
+class TestBackoffPolicies(TestCase):
+    def test_cubic_should_match_original_pjon_retry_delay(self):
+        policy = pjon_backoff.CubicBackoff()
+        self.assertEqual([1, 8, 27], [policy(attempts) for attempts in (1, 2, 3)])
+
+    def test_exponential_should_grow_up_to_cap(self):
+        policy = pjon_backoff.ExponentialBackoff(initial=10, multiplier=2, cap=50)
+        self.assertEqual([10, 20, 40, 50, 50], [policy(attempts) for attempts in range(1, 6)])
+        self.assertEqual(50, policy(10000))
+
+    def test_exponential_jitter_should_reduce_delay_by_random_fraction(self):
+        policy = pjon_backoff.ExponentialBackoff(initial=100, multiplier=2, cap=1000, jitter=0.5,
+                                                 rand=lambda: 1.0)
+        self.assertEqual(50, policy(1))
+        self.assertEqual(100, policy(2))
+        self.assertRaises(ValueError, pjon_backoff.ExponentialBackoff, jitter=2)
+
+    def test_linear_and_fixed(self):
+        self.assertEqual([5, 10, 12], [pjon_backoff.LinearBackoff(step=5, cap=12)(attempts) for attempts in (1, 2, 3)])
+        self.assertEqual([7, 7], [pjon_backoff.FixedBackoff(7)(attempts) for attempts in (1, 100)])
+
+    def test_random_should_stay_within_max_delay(self):
+        policy = pjon_backoff.RandomBackoff(max_delay=48)
+        for attempts in range(1, 100):
+            self.assertTrue(0 <= policy(attempts) <= 48)
@@ -1,6 +1,7 @@
 from unittest import TestCase, skip
 from unittest2.compatibility import wraps
 from pjon_python import base_client
+from pjon_python.protocol import pjon_protocol_constants
 
 import time
 import platform
@@ -36,6 +37,15 @@ class TestPjonBaseClient(TestCase):
         time.sleep(.4)
         self.assertEquals(2, len(self.cli_2._protocol._stored_received_packets))
 
+    def test_send_methods_should_return_delivery_futures(self):
+        deliveries = [self.cli_1.send(2, 'test1'),
+                      self.cli_1.send_without_ack(2, 'test2'),
+                      self.cli_1.send_with_forced_sender_id(2, 7, 'test3')]
+
+        done, not_done = self.cli_1.wait(deliveries, timeout=2)
+        self.assertEquals(0, len(not_done))
+        self.assertEquals([pjon_protocol_constants.ACK] * 3, [delivery.result() for delivery in deliveries])
+
     @skip_if_condition(platform.platform().find('armv') > 0, 'skipping on ARM due to performance')
     def test_fake_serial_should_pass_messages_between_clients_with_ack(self):
         self.cli_1.send(2, 'test1')
@@ -0,0 +1,87 @@
+import threading
+from unittest import TestCase
+
+import mock
+
+from pjon_python.protocol import pjon_delivery, pjon_protocol, pjon_protocol_constants
+from pjon_python.strategies import pjon_hwserial_strategy
+
+
+class TestDeliveryFutures(TestCase):
+    def setUp(self):
+        self.serial_patcher = mock.patch('serial.Serial', create=True)
+        ser = self.serial_patcher.start()
+        self.proto = pjon_protocol.PjonProtocol(1, strategy=pjon_hwserial_strategy.PJONserialStrategy(ser))
+        self.proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+    def tearDown(self):
+        self.serial_patcher.stop()
+
+    def test_should_resolve_with_ack_attempts_and_time_to_ack(self):
+        self.proto.send_string.side_effect = [pjon_protocol_constants.FAIL, pjon_protocol_constants.ACK]
+        delivery = self.proto.send_tracked(2, 'test')
+        self.assertEqual(0, delivery.handle)
+        self.assertIs(delivery, self.proto.get_delivery(delivery.handle))
+
+        self.proto.update()
+        self.assertFalse(delivery.done())
+        self.proto._schedule_at(self.proto.outgoing_packets[0], 0)  # skip retry delay
+        self.proto.update()
+
+        self.assertEqual(pjon_protocol_constants.ACK, delivery.result(timeout=0))
+        self.assertTrue(delivery.delivered)
+        self.assertEqual(2, delivery.attempts)
+        self.assertTrue(delivery.time_to_ack >= 0)
+
+    def test_should_resolve_with_fail_after_max_attempts(self):
+        self.proto.send_string.return_value = pjon_protocol_constants.FAIL
+        with mock.patch.object(pjon_protocol_constants, 'MAX_ATTEMPTS', 1):
+            delivery = self.proto.send_tracked(2, 'test')
+            for i in range(2):
+                self.proto._schedule_at(self.proto.outgoing_packets[0], 0)  # skip retry delay
+                self.proto.update()
+
+        self.assertEqual(pjon_protocol_constants.FAIL, delivery.result(timeout=0))
+        self.assertEqual(2, delivery.attempts)
+        self.assertEqual(None, delivery.time_to_ack)
+
+    def test_should_resolve_with_fail_right_away_when_packet_is_rejected(self):
+        delivery = self.proto.send_tracked(2, 'x' * pjon_protocol_constants.PACKET_MAX_LENGTH)
+        self.assertEqual(pjon_protocol_constants.FAIL, delivery.result(timeout=0))
+
+    def test_should_resolve_with_timeout_when_not_delivered_in_time(self):
+        self.proto.send_string.return_value = pjon_protocol_constants.FAIL
+        delivery = self.proto.send_tracked(2, 'test', delivery_timeout=0.01)
+        self.proto.update()
+        self.proto.outgoing_packets[0].deadline = 0
+        self.proto._schedule_at(self.proto.outgoing_packets[0], 0)  # skip retry delay
+        self.proto.update()
+
+        self.assertEqual(pjon_protocol_constants.TIMEOUT, delivery.result(timeout=0))
+        self.assertEqual(1, delivery.attempts)
+        self.assertEqual(0, len(self.proto.outgoing_packets))
+
+    def test_should_be_cancelled_with_packet(self):
+        delivery = self.proto.send_tracked(2, 'test')
+        self.proto.cancel(delivery.handle)
+        self.assertTrue(delivery.cancelled())
+
+    def test_coalesced_sends_should_resolve_together(self):
+        first = self.proto.send_tracked(2, 'S1', coalesce_key='setpoint')
+        second = self.proto.send_tracked(2, 'S2', coalesce_key='setpoint')
+        self.proto.update()
+
+        self.assertEqual(first.handle, second.handle)
+        self.assertEqual(pjon_protocol_constants.ACK, second.result(timeout=0))
+        self.proto.send_string.assert_called_once_with(2, 'S2', sender_id=1,
+                                                       packet_header=self.proto.get_header_from_internal_config())
+
+    def test_wait_deliveries_should_wait_on_many(self):
+        deliveries = [self.proto.send_tracked(device_id, 'test') for device_id in range(2, 6)]
+        updater = threading.Timer(0.02, self.proto.update)
+        updater.start()
+        done, not_done = pjon_delivery.wait_deliveries(deliveries, timeout=5)
+        updater.join()
+
+        self.assertEqual(4, len(done))
+        self.assertEqual(0, len(not_done))
@@ -0,0 +1,143 @@
+from unittest import TestCase
+
+from pjon_python.protocol import pjon_protocol_constants
+from pjon_python.protocol.pjon_frame import encode_frame, FrameDecoder
+from pjon_python.utils import crc8
+
+
+class TestEncodeFrame(TestCase):
+    def test_encode_frame__should_include_sender_id_when_requested_in_header(self):
+        frame = encode_frame(1, 'AAAA', pjon_protocol_constants.SENDER_INFO_BIT, sender_id=45)
+        self.assertEqual(bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71]), frame)
+
+    def test_encode_frame__should_skip_sender_id_when_not_in_header(self):
+        frame = encode_frame(35, 'C123', pjon_protocol_constants.ACK_REQUEST_BIT, sender_id=45)
+        expected_crc = crc8.calc_crc_for_byte_array([35, 8, 4, 67, 49, 50, 51])
+        self.assertEqual(bytearray([35, 8, 4, 67, 49, 50, 51, expected_crc]), frame)
+
+    def test_encode_frame__should_accept_supported_payload_types(self):
+        expected = encode_frame(1, 'ABC', 2, sender_id=45)
+        self.assertEqual(expected, encode_frame(1, b'ABC', 2, sender_id=45))
+        self.assertEqual(expected, encode_frame(1, bytearray(b'ABC'), 2, sender_id=45))
+        self.assertEqual(expected, encode_frame(1, [65, 66, 67], 2, sender_id=45))
+        self.assertEqual(expected, encode_frame(1, ['A', 'B', 'C'], 2, sender_id=45))
+
+    def test_encode_frame__should_truncate_payload_to_passed_length(self):
+        self.assertEqual(encode_frame(1, 'AB', 2, sender_id=45), encode_frame(1, 'ABCD', 2, sender_id=45, payload_length=2))
+
+
+class TestFrameDecoder(TestCase):
+    def setUp(self):
+        self.decoder = FrameDecoder(1)
+
+    def test_feed__should_yield_frame_split_across_chunks(self):
+        self.assertEqual([], list(self.decoder.feed(bytearray([1, 9, 2]))))
+        self.assertEqual([], list(self.decoder.feed(bytearray([45, 65, 65]))))
+        frames = list(self.decoder.feed(bytearray([65, 65, 71])))
+
+        self.assertEqual(1, len(frames))
+        self.assertEqual(1, frames[0].receiver_id)
+        self.assertEqual(9, frames[0].length)
+        self.assertEqual(2, frames[0].header)
+        self.assertEqual(45, frames[0].sender_id)
+        self.assertEqual(b'AAAA', frames[0].payload)
+        self.assertEqual(0, self.decoder.buffered_bytes_count)
+
+    def test_feed__should_yield_multiple_frames_from_single_chunk_and_keep_partial_one(self):
+        chunk = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71, 1, 8, 2, 100, 61, 62, 63, 65, 1, 9])
+        frames = list(self.decoder.feed(chunk))
+
+        self.assertEqual([45, 100], [frame.sender_id for frame in frames])
+        self.assertEqual(b'=>?', frames[1].payload)
+        self.assertEqual(2, self.decoder.buffered_bytes_count)
+
+    def test_feed__should_decode_frames_built_by_encode_frame(self):
+        frame = encode_frame(1, 'C123', pjon_protocol_constants.ACK_REQUEST_BIT)
+        decoded = list(self.decoder.feed(frame))
+
+        self.assertEqual(1, len(decoded))
+        self.assertTrue(decoded[0].acknowledge_requested)
+        self.assertFalse(decoded[0].includes_sender_info)
+        self.assertEqual(b'C123', decoded[0].payload)
+
+    def test_feed__should_drop_frame_with_wrong_crc(self):
+        self.assertEqual([], list(self.decoder.feed(bytearray([1, 9, 2, 45, 65, 65, 65, 65, 70]))))
+        self.assertEqual(1, self.decoder.crc_errors)
+
+    def test_feed__should_resync_on_frame_following_garbage_in_same_buffer(self):
+        garbage = bytearray([1, 30, 4, 7, 1, 9])
+        frames = list(self.decoder.feed(garbage + bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])))
+        self.assertEqual([], frames)  # garbage announces 30 bytes frame, nothing is known until a gap
+
+        frames = list(self.decoder.flush())
+        self.assertEqual(1, len(frames))
+        self.assertEqual(b'AAAA', frames[0].payload)
+        self.assertEqual(len(garbage), self.decoder.discarded_bytes)
+        self.assertEqual(1, self.decoder.resync_events)
+
+    def test_feed__should_not_lose_frame_following_corrupted_one(self):
+        corrupted = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 70])
+        valid = bytearray([1, 8, 2, 100, 61, 62, 63, 65])
+        frames = list(self.decoder.feed(corrupted[:5]))
+        frames.extend(self.decoder.feed(corrupted[5:] + valid[:4]))
+        frames.extend(self.decoder.feed(valid[4:]))
+
+        self.assertEqual([100], [frame.sender_id for frame in frames])
+        self.assertEqual(len(corrupted), self.decoder.discarded_bytes)
+        self.assertEqual(1, self.decoder.resync_events)
+
+    def test_feed__should_resync_after_mid_frame_start(self):
+        frame = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])
+        frames = list(self.decoder.feed(frame[3:] + frame + frame))
+
+        self.assertEqual(2, len(frames))
+        self.assertEqual(6, self.decoder.discarded_bytes)
+
+    def test_feed__should_skip_foreign_frames_by_length(self):
+        foreign = encode_frame(7, 'AAAAAAAAAA', pjon_protocol_constants.SENDER_INFO_BIT, sender_id=1)
+        own = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])
+        frames = list(self.decoder.feed(foreign[:6]))
+        frames.extend(self.decoder.feed(foreign[6:] + own + foreign))
+
+        self.assertEqual([45], [frame.sender_id for frame in frames])
+        self.assertEqual(2, self.decoder.foreign_frames_skipped)
+        self.assertEqual(0, self.decoder.discarded_bytes)
+        self.assertEqual(0, self.decoder.resync_events)
+        self.assertEqual(0, self.decoder.buffered_bytes_count)
+
+    def test_feed__should_wait_for_incomplete_frame_instead_of_decoding_its_payload(self):
+        payload = b'\x09' + bytes(encode_frame(pjon_protocol_constants.BROADCAST, '', 0)) + b'\x01\x02'
+        frame = encode_frame(1, payload, pjon_protocol_constants.ACK_REQUEST_BIT)
+        for split in range(1, len(frame)):
+            decoder = FrameDecoder(1)
+            frames = list(decoder.feed(frame[:split]))
+            frames.extend(decoder.feed(frame[split:]))
+
+            self.assertEqual([payload], [frame.payload for frame in frames], "split at %d" % split)
+            self.assertEqual(0, decoder.crc_errors)
+            self.assertEqual(0, decoder.discarded_bytes)
+            self.assertEqual(0, decoder.buffered_bytes_count)
+
+    def test_flush__should_give_up_truncated_frame_and_rescan_its_bytes(self):
+        own = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])
+        truncated = encode_frame(7, 'A' * 30, 0)[:6]
+
+        self.assertEqual([], list(self.decoder.feed(truncated + own)))
+        frames = list(self.decoder.flush())
+
+        self.assertEqual([45], [frame.sender_id for frame in frames])
+        self.assertEqual(1, self.decoder.truncated_frames)
+        self.assertEqual(len(truncated), self.decoder.discarded_bytes)
+        self.assertEqual(0, self.decoder.buffered_bytes_count)
+
+    def test_feed__should_not_deliver_broadcast_looking_content_of_partly_received_foreign_frame(self):
+        embedded = encode_frame(pjon_protocol_constants.BROADCAST, 'X', pjon_protocol_constants.ACK_REQUEST_BIT)
+        foreign = encode_frame(7, b'\x05' + bytes(embedded) * 3, pjon_protocol_constants.SENDER_INFO_BIT, sender_id=9)
+        for split in range(1, len(foreign)):
+            decoder = FrameDecoder(1)
+            frames = list(decoder.feed(foreign[:split]))
+            frames.extend(decoder.feed(foreign[split:]))
+
+            self.assertEqual([], frames, "split at %d" % split)
+            self.assertEqual(1, decoder.foreign_frames_skipped)
+            self.assertEqual(0, decoder.discarded_bytes)
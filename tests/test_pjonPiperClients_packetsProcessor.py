@@ -55,9 +55,9 @@ class TestPipierClientPacketsProcessor(TestCase):
         self.assertNotEquals(None, packet)
         self.assertEqual(44, packet.packet_info.sender_id)
         self.assertEqual(45, packet.packet_info.receiver_id)
-        self.assertEqual([205, 205, 205, 205], packet.packet_info.receiver_bus_id)
-        self.assertEqual([204, 204, 204, 204], packet.packet_info.sender_bus_id)
+        self.assertEqual(0xCDCDCDCD, packet.packet_info.receiver_bus_id)
+        self.assertEqual(0xCCCCCCCC, packet.packet_info.sender_bus_id)
         self.assertEqual('ABC test', packet.payload)
         self.assertEqual('ABC test', packet.payload_as_string)
-        self.assertEqual(['A', 'B', 'C', ' ', 't', 'e', 's', 't'], packet.payload_as_chars)
-        self.assertEqual([65, 66, 67, 32, 116, 101, 115, 116], packet.payload_as_bytes)
+        self.assertEqual(('A', 'B', 'C', ' ', 't', 'e', 's', 't'), packet.payload_as_chars)
+        self.assertEqual(b'ABC test', packet.payload_as_bytes)
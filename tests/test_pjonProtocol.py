@@ -1,4 +1,6 @@
+import itertools
 import logging
+import threading
 import time
 from unittest import TestCase, skip
 
@@ -6,7 +8,9 @@ import mock
 import serial
 
 from pjon_python.protocol import pjon_protocol, pjon_protocol_constants
+from pjon_python.protocol.pjon_backoff import FixedBackoff
 from pjon_python.strategies import pjon_hwserial_strategy
+from pjon_python.strategies.pjon_serial_timing import SerialTiming
 
 try:
     xrange
@@ -85,9 +89,24 @@ class TestPjonProtocol(TestCase):
             self.assertEquals(1, len(proto._stored_received_packets))
             self.assertEquals(1, proto._stored_received_packets[-1].packet_info.receiver_id)
             self.assertEquals(45, proto._stored_received_packets[-1].packet_info.sender_id)
-            self.assertEquals([65, 65, 65, 65], proto._stored_received_packets[-1].payload)
+            self.assertEquals(b'AAAA', proto._stored_received_packets[-1].payload)
             self.assertEquals(9, proto._stored_received_packets[-1].packet_length)
 
+    def test_receive_should_give_up_incomplete_frame_start_after_reception_gap(self):
+        strategy = mock.Mock()
+        strategy.receive_bytes.side_effect = [bytearray([7, 40, 0, 1, 9, 2]) + bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71]),
+                                              bytearray()]
+        strategy.last_received_ts = 0
+        strategy.timing = SerialTiming()
+        proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+
+        self.assertEqual(pjon_protocol_constants.BUSY, proto.receive())
+        self.assertEqual(0, len(proto._stored_received_packets))
+
+        self.assertEqual(pjon_protocol_constants.ACK, proto.receive())
+        self.assertEqual(b'AAAA', proto._stored_received_packets[-1].payload)
+        self.assertEqual(0, proto.decoder.buffered_bytes_count)
+
     def test_receive_should_get_multiple_packets_from_local_bus(self):
         with mock.patch('serial.Serial', create=True) as ser:
             ser.read.side_effect = [chr(item) for item in [1, 9, 2, 45, 65, 65, 65, 65, 71,    1, 8, 2, 100, 61, 62, 63, 65]]
@@ -106,7 +125,7 @@ class TestPjonProtocol(TestCase):
             self.assertEquals(2, len(proto._stored_received_packets))
             self.assertEquals(1, proto._stored_received_packets[-1].packet_info.receiver_id)
             self.assertEquals(100, proto._stored_received_packets[-1].packet_info.sender_id)
-            self.assertEquals([61, 62, 63], proto._stored_received_packets[-1].payload)
+            self.assertEquals(b'=>?', proto._stored_received_packets[-1].payload)
             self.assertEquals(8, proto._stored_received_packets[-1].packet_length)
 
     def test_protocol_client_should_truncate_received_packets_buffer(self):
@@ -134,7 +153,7 @@ class TestPjonProtocol(TestCase):
             serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
             proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
             proto.receiver_function(self.print_args)
-            proto._received_packets_buffer_length = 8
+            proto.set_received_packets_buffer_length(8)
 
             timeout = 1.15
             start_ts = time.time()
@@ -146,7 +165,7 @@ class TestPjonProtocol(TestCase):
             self.assertEquals(proto._received_packets_buffer_length, len(proto._stored_received_packets))
             self.assertEquals(1, proto._stored_received_packets[-1].packet_info.receiver_id)
             self.assertEquals(45, proto._stored_received_packets[-1].packet_info.sender_id)
-            self.assertEquals([65, 65, 65, 65], proto._stored_received_packets[-1].payload)
+            self.assertEquals(b'AAAA', proto._stored_received_packets[-1].payload)
             self.assertEquals(9, proto._stored_received_packets[-1].packet_length)
 
     @skip("hardware-dependant test skipped")
@@ -168,7 +187,7 @@ class TestPjonProtocol(TestCase):
 
         self.assertEquals(1, proto._stored_received_packets[-1].packet_info.receiver_id)
         self.assertEquals(45, proto._stored_received_packets[-1].packet_info.sender_id)
-        self.assertEquals([65, 65, 65, 65], proto._stored_received_packets[-1].payload)
+        self.assertEquals(b'AAAA', proto._stored_received_packets[-1].payload)
         self.assertEquals(9, proto._stored_received_packets[-1].packet_length)
 
     @skip("hardware-dependant test skipped")
@@ -190,7 +209,7 @@ class TestPjonProtocol(TestCase):
 
         self.assertEquals(1, proto._stored_received_packets[-1].packet_info.receiver_id)
         self.assertEquals(35, proto._stored_received_packets[-1].packet_info.sender_id)
-        self.assertEquals([65, 65, 65, 65], proto._stored_received_packets[-1].payload)
+        self.assertEquals(b'AAAA', proto._stored_received_packets[-1].payload)
         self.assertEquals(9, proto._stored_received_packets[-1].packet_length)
 
     def test_protocol_client_should_send_packets_with_ack(self):
@@ -207,7 +226,7 @@ class TestPjonProtocol(TestCase):
 
             self.assertEquals(pjon_protocol_constants.ACK, proto.send_string(1, "test", sender_id=11))
 
-            self.assertEquals(8, ser.write.call_count)
+            self.assertEquals(1, ser.write.call_count)
             self.assertEquals(1, ser.read.call_count)
 
     def test_protocol_client_should_send_packets_without_ack(self):
@@ -223,7 +242,7 @@ class TestPjonProtocol(TestCase):
 
             self.assertEquals(pjon_protocol_constants.ACK, proto.send_string(1, "test", sender_id=2))
 
-            self.assertEquals(8, ser.write.call_count)
+            self.assertEquals(1, ser.write.call_count)
             self.assertEquals(0, ser.read.call_count)
 
     def test_protocol_client_should_send_packets_with_sender_info_without_ack(self):
@@ -239,7 +258,8 @@ class TestPjonProtocol(TestCase):
 
             self.assertEquals(pjon_protocol_constants.ACK, proto.send_string(1, "test", sender_id=13))
 
-            self.assertEquals(9, ser.write.call_count)
+            self.assertEquals(1, ser.write.call_count)
+            ser.write.assert_called_once_with(bytearray([1, 9, 2, 13, 116, 101, 115, 116, 65]))
             self.assertEquals(0, ser.read.call_count)
 
     def test_protocol_client_should_send_packets_with_sender_info_with_ack(self):
@@ -255,7 +275,7 @@ class TestPjonProtocol(TestCase):
 
             self.assertEquals(pjon_protocol_constants.ACK, proto.send_string(1, "test", sender_id=2))
 
-            self.assertEquals(9, ser.write.call_count)
+            self.assertEquals(1, ser.write.call_count)
             self.assertEquals(1, ser.read.call_count)
 
     @skip("hardware-dependant test skipped")
@@ -359,9 +379,9 @@ class TestPjonProtocol(TestCase):
 
             self.assertEquals(1, len(proto.outgoing_packets))
 
-            self.assertEquals(proto.outgoing_packets[-1].state, pjon_protocol_constants.TO_BE_SENT)
-            self.assertEquals(proto.outgoing_packets[-1].content, 'test')
-            self.assertEquals(proto.outgoing_packets[-1].device_id, 17)
+            self.assertEquals(proto.outgoing_packets[0].state, pjon_protocol_constants.TO_BE_SENT)
+            self.assertEquals(proto.outgoing_packets[0].content, 'test')
+            self.assertEquals(proto.outgoing_packets[0].device_id, 17)
 
     def test_dispatch_should_fail_on_too_many_outgoing_packets(self):
         with mock.patch('serial.Serial', create=True) as ser:
@@ -439,3 +459,639 @@ class TestPjonProtocol(TestCase):
                 self.assertEquals(2, error_function_mock.call_count)
 
 
+
+    def test_update_should_send_only_due_packets_and_report_time_until_next_one(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_acknowledge(False)
+            serial_hw_strategy.can_start = mock.Mock(return_value=True)
+            serial_hw_strategy.send_frame = mock.Mock(return_value=0)
+
+            self.assertEquals(None, proto.time_until_next_send())
+            proto.dispatch(1, 'now')
+            proto.dispatch(2, 'later', timing=10000)
+
+            self.assertEquals(0, proto.time_until_next_send())
+            self.assertEquals(1, proto.update())
+            self.assertEquals(1, serial_hw_strategy.send_frame.call_count)
+            self.assertTrue(9 < proto.time_until_next_send() <= 10)
+
+            self.assertEquals(1, proto.update())
+            self.assertEquals(1, serial_hw_strategy.send_frame.call_count)
+
+    def test_update_should_reschedule_failed_packet_with_cubic_backoff(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.FAIL)
+
+            proto.dispatch(1, 'test')
+            packet = proto.outgoing_packets[0]
+            with mock.patch('pjon_python.protocol.pjon_protocol.time', create=True) as time_mock:
+                time_mock.time.return_value = packet.registration
+                proto.update()
+                proto.update()
+                self.assertEquals(1, packet.attempts)
+                self.assertEquals(1, proto.send_string.call_count)
+                self.assertAlmostEqual(packet.registration + 0.001, packet.due_ts)
+
+                time_mock.time.return_value = packet.registration + 0.001
+                proto.update()
+                self.assertEquals(2, packet.attempts)
+                self.assertAlmostEqual(packet.registration + 0.008, packet.due_ts)
+
+    def test_dispatch_should_return_stable_handles(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+
+            handles = [proto.dispatch(device_id, 'test') for device_id in range(1, 5)]
+            self.assertEquals([0, 1, 2, 3], handles)
+
+            self.assertTrue(proto.cancel(handles[0]))
+            self.assertFalse(proto.cancel(handles[0]))
+            self.assertEquals(None, proto.status(handles[0]))
+
+            self.assertEquals(4, proto.outgoing_packets[handles[3]].device_id)
+            self.assertEquals(pjon_protocol_constants.TO_BE_SENT, proto.status(handles[3]))
+            self.assertEquals(4, proto.dispatch(5, 'test'))
+            self.assertEquals(4, len(proto.outgoing_packets))
+
+    def test_update_should_not_send_cancelled_packets(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+            handle = proto.dispatch(1, 'test0')
+            proto.dispatch(2, 'test1')
+            proto.cancel(handle)
+            proto.update()
+
+            proto.send_string.assert_called_once_with(2, 'test1', sender_id=1, packet_header=proto.get_header_from_internal_config())
+            self.assertEquals(0, len(proto.outgoing_packets))
+
+    def test_update_should_serve_destinations_round_robin(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+            proto.dispatch(2, 'a0')
+            proto.dispatch(2, 'a1')
+            proto.dispatch(2, 'a2')
+            proto.dispatch(3, 'b0')
+            proto.update()
+
+            sent = [call[0][:2] for call in proto.send_string.call_args_list]
+            self.assertEquals([(2, 'a0'), (3, 'b0'), (2, 'a1'), (2, 'a2')], sent)
+
+    def test_circuit_breaker_should_fail_fast_after_connection_lost_and_close_on_probe_ack(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock, \
+                mock.patch.object(pjon_protocol_constants, 'MAX_ATTEMPTS', 1):
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_circuit_breaker(True, probe_interval=1000)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.FAIL)
+            error_function = mock.Mock()
+            proto.set_error(error_function)
+
+            time_mock.time.return_value = 100.0
+            proto.dispatch(2, 'test')
+            proto.update()
+            time_mock.time.return_value = 101.0
+            proto.update()
+
+            error_function.assert_called_once_with(pjon_protocol_constants.CONNECTION_LOST, 2)
+            self.assertTrue(proto.is_connection_lost(2))
+            self.assertEquals(0, len(proto.outgoing_packets))
+
+            time_mock.time.return_value = 101.5
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(2, 'test'))
+            self.assertEquals(2, error_function.call_count)
+            self.assertEquals(1, proto.dispatch(3, 'test'))  # healthy destination not affected
+
+            time_mock.time.return_value = 102.0
+            probe_handle = proto.dispatch(2, 'probe')
+            self.assertNotEquals(pjon_protocol_constants.FAIL, probe_handle)
+            proto.send_string.return_value = pjon_protocol_constants.ACK
+            proto.update()
+
+            self.assertFalse(proto.is_connection_lost(2))
+            self.assertEquals(None, proto.status(probe_handle))
+
+    def test_circuit_breaker_should_hold_queued_packets_and_reopen_on_failed_probe(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock, \
+                mock.patch.object(pjon_protocol_constants, 'MAX_ATTEMPTS', 1):
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_circuit_breaker(True, probe_interval=1000)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.FAIL)
+
+            time_mock.time.return_value = 100.0
+            proto.dispatch(2, 'lost')
+            proto.update()
+            time_mock.time.return_value = 100.5
+            proto.dispatch(2, 'queued')
+            proto.update()  # 'lost' exceeds attempts, breaker opens before 'queued' goes out
+            self.assertEquals(2, proto.send_string.call_count)
+
+            time_mock.time.return_value = 101.0
+            proto.update()
+            self.assertEquals(2, proto.send_string.call_count)
+
+            time_mock.time.return_value = 101.6
+            proto.update()  # probe
+            self.assertEquals(3, proto.send_string.call_count)
+            self.assertTrue(proto.is_connection_lost(2))
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(2, 'test'))
+
+    def test_update_should_serve_higher_priority_first_and_count_per_class(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+            proto.dispatch(2, 'poll0', priority=pjon_protocol_constants.PRIORITY_LOW)
+            proto.dispatch(3, 'poll1', priority=pjon_protocol_constants.PRIORITY_LOW)
+            proto.dispatch(2, 'status')
+            proto.dispatch(3, 'command', priority=pjon_protocol_constants.PRIORITY_HIGH)
+
+            stats = proto.get_priority_stats()
+            self.assertEquals(1, stats[pjon_protocol_constants.PRIORITY_HIGH]['queued'])
+            self.assertEquals(1, stats[pjon_protocol_constants.PRIORITY_NORMAL]['queued'])
+            self.assertEquals(2, stats[pjon_protocol_constants.PRIORITY_LOW]['queued'])
+
+            proto.update()
+
+            sent = [call[0][1] for call in proto.send_string.call_args_list]
+            self.assertEquals(['command', 'status', 'poll0', 'poll1'], sent)
+            stats = proto.get_priority_stats()
+            self.assertEquals(0, stats[pjon_protocol_constants.PRIORITY_LOW]['queued'])
+            self.assertEquals(2, stats[pjon_protocol_constants.PRIORITY_LOW]['sent'])
+            self.assertEquals(1, stats[pjon_protocol_constants.PRIORITY_HIGH]['sent'])
+            self.assertTrue(stats[pjon_protocol_constants.PRIORITY_LOW]['max_wait'] >= 0)
+
+    def test_update_should_send_high_priority_packet_dispatched_during_pass_next(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.attach_io_thread()
+            for device_id in xrange(2, 32):
+                proto.dispatch(device_id, 'poll', priority=pjon_protocol_constants.PRIORITY_LOW)
+
+            def send_string(device_id, payload, **kwargs):
+                if device_id == 2:
+                    caller = threading.Thread(target=proto.dispatch, args=(40, 'command'),
+                                              kwargs={'priority': pjon_protocol_constants.PRIORITY_HIGH})
+                    caller.start()
+                    caller.join()
+                return pjon_protocol_constants.ACK
+            proto.send_string = mock.Mock(side_effect=send_string)
+
+            proto.update()
+
+            sent = [call[0][0] for call in proto.send_string.call_args_list]
+            self.assertEquals(31, len(sent))
+            self.assertEquals([2, 40], sent[:2])
+
+    def test_update_should_not_resend_repeating_packet_within_single_pass(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock:
+            time_mock.time.side_effect = itertools.count(100)  # every clock read is 1 s later
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+            proto.dispatch(2, 'repeated', timing=1)
+            proto.dispatch(3, 'once')
+
+            proto.update()
+            self.assertEquals([2, 3], [call[0][0] for call in proto.send_string.call_args_list])
+            proto.update()
+            self.assertEquals(3, proto.send_string.call_count)
+
+    def test_update_without_inline_response_wait_should_take_ack_from_receive(self):
+        strategy = mock.Mock()
+        strategy.can_start.return_value = True
+        strategy.get_ack_timeout.return_value = 10.0
+        proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+        proto.set_inline_response_wait(False)
+        first = proto.dispatch(2, 'first')
+        proto.dispatch(3, 'second')
+
+        proto.update()
+        self.assertEquals(1, strategy.send_frame.call_count)
+        self.assertEquals(pjon_protocol_constants.AWAITING_RESPONSE, proto.status(first))
+        self.assertFalse(strategy.receive_response.called)
+        self.assertTrue(0 < proto.time_until_next_send() <= 10.0)
+        proto.update()
+        self.assertEquals(1, strategy.send_frame.call_count)  # bus is held until the response
+
+        strategy.receive_bytes.return_value = bytearray([pjon_protocol_constants.ACK])
+        strategy.last_received_ts = time.time()
+        proto.receive()
+        self.assertIsNone(proto.status(first))
+        strategy.record_response.assert_called_once_with(2, mock.ANY)
+
+        proto.update()
+        self.assertEquals(2, strategy.send_frame.call_count)
+
+    def test_update_without_inline_response_wait_should_give_up_response_after_ack_timeout(self):
+        strategy = mock.Mock()
+        strategy.can_start.return_value = True
+        strategy.get_ack_timeout.return_value = 0.0
+        proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+        proto.set_inline_response_wait(False)
+        handle = proto.dispatch(2, 'test')
+
+        proto.update()
+        proto.update()
+
+        self.assertEquals(pjon_protocol_constants.FAIL, proto.status(handle))
+        strategy.record_response.assert_called_once_with(2, None)
+        self.assertFalse(proto.awaiting_response)
+
+    def test_dispatch_should_reject_unknown_priority(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(2, 'test', priority=7))
+            self.assertEquals(0, len(proto.outgoing_packets))
+
+    def test_update_should_use_per_destination_backoff_policy(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.FAIL)
+            proto.set_backoff_policy(lambda attempts: 100 * attempts)
+            proto.set_backoff_policy(FixedBackoff(500), device_id=3)
+
+            time_mock.time.return_value = 100.0
+            default_handle = proto.dispatch(2, 'test')
+            custom_handle = proto.dispatch(3, 'test')
+            proto.update()
+
+            self.assertAlmostEqual(100.1, proto.outgoing_packets[default_handle].due_ts)
+            self.assertAlmostEqual(100.5, proto.outgoing_packets[custom_handle].due_ts)
+
+    def test_update_should_reschedule_packet_after_collision_instead_of_sleeping(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            serial_hw_strategy.can_start = mock.Mock(return_value=True)
+            serial_hw_strategy.send_frame = mock.Mock()
+            serial_hw_strategy.receive_response = mock.Mock(return_value=0x55)  # corrupted response
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_collision_backoff_policy(FixedBackoff(20))
+
+            time_mock.time.return_value = 100.0
+            handle = proto.dispatch(2, 'test')
+            proto.update()
+
+            self.assertFalse(time_mock.sleep.called)
+            self.assertEquals(pjon_protocol_constants.BUSY, proto.status(handle))
+            self.assertEquals(0, proto.outgoing_packets[handle].attempts)
+            self.assertAlmostEqual(100.02, proto.outgoing_packets[handle].due_ts)
+
+    def test_dispatch_should_coalesce_pending_packets_by_key(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+            handle = proto.dispatch(2, 'S10', coalesce_key='setpoint')
+            self.assertEquals(handle, proto.dispatch(2, 'S20', coalesce_key='setpoint'))
+            other_destination_handle = proto.dispatch(3, 'S30', coalesce_key='setpoint')
+            not_coalesced_handle = proto.dispatch(2, 'S40')
+
+            self.assertEquals(3, len(proto.outgoing_packets))
+            self.assertEquals('S20', proto.outgoing_packets[handle].content)
+            self.assertNotEquals(handle, other_destination_handle)
+            self.assertNotEquals(handle, not_coalesced_handle)
+            self.assertEquals(1, proto.coalesced_packets_count)
+
+            proto.update()
+            self.assertEquals(3, proto.send_string.call_count)
+            self.assertNotEquals(handle, proto.dispatch(2, 'S50', coalesce_key='setpoint'))  # sent, so not pending
+
+    def test_dispatch_should_not_coalesce_into_packet_waiting_for_ack(self):
+        strategy = mock.Mock()
+        strategy.can_start.return_value = True
+        strategy.get_ack_timeout.return_value = 10.0
+        proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+        proto.set_inline_response_wait(False)
+
+        first = proto.send_tracked(2, 'S1', coalesce_key='setpoint')
+        proto.update()
+        second = proto.send_tracked(2, 'S2', coalesce_key='setpoint')
+        self.assertNotEquals(first.handle, second.handle)
+
+        strategy.receive_bytes.return_value = bytearray([pjon_protocol_constants.ACK])
+        strategy.last_received_ts = time.time()
+        proto.receive()
+        self.assertEquals(pjon_protocol_constants.ACK, first.result(timeout=0))
+        self.assertFalse(second.done())
+
+        proto.update()
+        proto.receive()
+        self.assertEquals(pjon_protocol_constants.ACK, second.result(timeout=0))
+        sent_payloads = [bytes(call[0][0])[4:-1] for call in strategy.send_frame.call_args_list]
+        self.assertEquals([b'S1', b'S2'], sent_payloads)
+
+    def test_packet_superseded_while_being_sent_should_not_be_retried(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_backoff_policy(FixedBackoff(0))
+            deliveries = []
+
+            def send_string(device_id, payload, **kwargs):
+                if payload == 'S1':
+                    deliveries.append(proto.send_tracked(2, 'S2', coalesce_key='setpoint'))
+                    return pjon_protocol_constants.FAIL
+                return pjon_protocol_constants.ACK
+            proto.send_string = mock.Mock(side_effect=send_string)
+
+            first = proto.send_tracked(2, 'S1', coalesce_key='setpoint')
+            proto.update()
+            self.assertNotEquals(first.handle, deliveries[0].handle)
+            proto.update()
+
+            self.assertEquals(['S1', 'S2'], [call[0][1] for call in proto.send_string.call_args_list])
+            self.assertEquals(pjon_protocol_constants.ACK, deliveries[0].result(timeout=0))
+            self.assertEquals(pjon_protocol_constants.ACK, first.result(timeout=0))
+            self.assertEquals(0, len(proto.outgoing_packets))
+
+    def test_dispatch_should_coalesce_by_payload_prefix_when_enabled(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.set_coalescing(True, prefix_length=2)
+
+            handle = proto.dispatch(2, 'Q1:old')
+            self.assertEquals(handle, proto.dispatch(2, 'Q1:new'))
+            self.assertNotEquals(handle, proto.dispatch(2, 'Q2:new'))
+            self.assertEquals('Q1:new', proto.outgoing_packets[handle].content)
+
+            proto.cancel(handle)
+            self.assertNotEquals(handle, proto.dispatch(2, 'Q1:newer'))
+            self.assertEquals(1, proto.coalesced_packets_count)
+
+    def fill_outgoing_queue(self, proto):
+        for i in xrange(pjon_protocol_constants.MAX_PACKETS + 1):
+            proto.dispatch(2, 'test')
+
+    def test_dispatch_should_block_until_timeout_on_full_queue(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            error_function = mock.Mock()
+            proto.set_error(error_function)
+            self.fill_outgoing_queue(proto)
+            io_thread = threading.Thread(target=lambda: None)
+            io_thread.start()
+            io_thread.join()
+            proto.attach_io_thread(io_thread)
+
+            start_ts = time.time()
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(3, 'test', block=True, timeout=0.05))
+            self.assertTrue(time.time() - start_ts >= 0.05)
+            error_function.assert_called_once_with(pjon_protocol_constants.PACKETS_BUFFER_FULL,
+                                                   pjon_protocol_constants.MAX_PACKETS)
+
+    def test_blocking_dispatch_should_fail_fast_without_io_thread_or_in_io_thread(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            error_function = mock.Mock()
+            proto.set_error(error_function)
+            self.fill_outgoing_queue(proto)
+            error_function.reset_mock()
+
+            start_ts = time.time()
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(3, 'test', block=True, timeout=5))
+            proto.attach_io_thread()
+            self.assertEquals(pjon_protocol_constants.FAIL, proto.dispatch(3, 'test', block=True, timeout=5))
+            delivery = proto.send_tracked(3, 'test', block=True, timeout=5)
+            self.assertTrue(time.time() - start_ts < 1)
+            self.assertEquals(pjon_protocol_constants.FAIL, delivery.result(timeout=0))
+            self.assertEquals([mock.call(pjon_protocol_constants.PACKETS_BUFFER_FULL,
+                                         pjon_protocol_constants.MAX_PACKETS)] * 3, error_function.call_args_list)
+
+    def test_dispatch_should_return_handle_once_blocked_producer_gets_space(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            self.fill_outgoing_queue(proto)
+
+            freeing_thread = threading.Timer(0.05, proto.cancel, args=(0,))
+            freeing_thread.start()
+            proto.attach_io_thread(freeing_thread)
+            handle = proto.dispatch(3, 'test', block=True, timeout=5)
+            freeing_thread.join()
+            proto.detach_io_thread()
+
+            self.assertEquals(pjon_protocol_constants.MAX_PACKETS + 1, handle)
+            self.assertEquals(3, proto.outgoing_packets[handle].device_id)
+
+    def test_dispatch_async_should_wait_for_space(self):
+        import asyncio
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            self.fill_outgoing_queue(proto)
+            proto.attach_io_thread()
+            loop = asyncio.new_event_loop()
+            try:
+                loop.call_later(0.05, proto.cancel, 0)
+                handle = loop.run_until_complete(proto.dispatch_async(3, 'test', timeout=5, loop=loop))
+            finally:
+                loop.close()
+
+            self.assertEquals(pjon_protocol_constants.MAX_PACKETS + 1, handle)
+
+    def test_watermark_callbacks_should_fire_once_per_crossing(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            on_high = mock.Mock()
+            on_low = mock.Mock()
+            proto.set_watermarks(3, 1, on_high=on_high, on_low=on_low)
+
+            handles = [proto.dispatch(2, 'test') for i in range(4)]
+            on_high.assert_called_once_with(3)
+            proto.cancel(handles[0])
+            proto.cancel(handles[1])
+            self.assertFalse(on_low.called)
+            proto.cancel(handles[2])
+            on_low.assert_called_once_with(1)
+            self.assertRaises(ValueError, proto.set_watermarks, 1, 1)
+
+    def test_send_many_should_enqueue_batch_and_return_handles(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.get_header_from_internal_config = mock.Mock(return_value=6)
+
+            handles = proto.send_many([(2, 'poll'),
+                                       (3, 'poll', {'priority': pjon_protocol_constants.PRIORITY_HIGH}),
+                                       (4, 'x' * pjon_protocol_constants.PACKET_MAX_LENGTH),
+                                       (5, 'poll', {'header': 2})])
+
+            self.assertEquals([0, 1, pjon_protocol_constants.FAIL, 2], handles)
+            self.assertEquals(1, proto.get_header_from_internal_config.call_count)
+            self.assertEquals(pjon_protocol_constants.PRIORITY_HIGH, proto.outgoing_packets[1].priority)
+            self.assertEquals(6, proto.outgoing_packets[0].header)
+            self.assertEquals(2, proto.outgoing_packets[2].header)
+
+    def test_send_many_should_return_delivery_futures_when_tracking(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+
+            deliveries = proto.send_many(((device_id, 'poll') for device_id in range(2, 202)), track_delivery=True)
+            self.assertEquals(list(range(0, 129)), [delivery.handle for delivery in deliveries[:129]])
+            self.assertEquals(pjon_protocol_constants.FAIL, deliveries[-1].result(timeout=0))
+
+            proto.update()
+            self.assertEquals(pjon_protocol_constants.ACK, deliveries[0].result(timeout=0))
+
+    def test_send_many_from_other_thread_should_wake_io_thread_once_per_batch(self):
+        with mock.patch('serial.Serial', create=True) as ser, \
+                mock.patch('pjon_python.protocol.pjon_protocol.time') as time_mock:
+            time_mock.time.return_value = 100.0
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            io_thread = threading.Thread(target=lambda: None)
+            io_thread.start()
+            io_thread.join()
+            proto.attach_io_thread(io_thread)
+            wakeup = mock.Mock()
+            proto.set_wakeup(wakeup)
+
+            handles = proto.send_many([(device_id, 'poll') for device_id in range(2, 102)])
+
+            self.assertEquals(100, len(handles))
+            self.assertEquals(1, wakeup.call_count)
+            self.assertEquals(1, time_mock.time.call_count)
+            self.assertEquals(100, len(proto._dispatch_queue))
+
+    def test_dispatch_from_other_threads_should_be_handed_over_to_io_thread(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+            io_thread = threading.Thread(target=lambda: None)
+            io_thread.start()
+            io_thread.join()
+            proto.attach_io_thread(io_thread)
+
+            handle = proto.dispatch(2, 'test')
+            cancelled_handle = proto.dispatch(3, 'test')
+            self.assertEquals(0, len(proto.outgoing_packets))
+            self.assertEquals(pjon_protocol_constants.TO_BE_SENT, proto.status(handle))
+            self.assertEquals(0, proto.time_until_next_send())
+            self.assertTrue(proto.cancel(cancelled_handle))
+
+            proto.attach_io_thread()
+            proto.update()
+            proto.send_string.assert_called_once_with(2, 'test', sender_id=1,
+                                                      packet_header=proto.get_header_from_internal_config())
+            self.assertEquals(None, proto.status(handle))
+            self.assertEquals(None, proto.status(cancelled_handle))
+            self.assertFalse(proto.cancel(cancelled_handle))
+
+    def test_send_from_many_threads_should_enqueue_each_packet_exactly_once(self):
+        threads_count = 8
+        packets_per_thread = 300
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            sent_payloads = []
+
+            def send_string(recipient_id, payload, sender_id=None, packet_header=None):
+                sent_payloads.append(payload)
+                return pjon_protocol_constants.ACK
+            proto.send_string = send_string
+
+            stop = threading.Event()
+
+            def io_loop():
+                proto.attach_io_thread()
+                while not stop.is_set():
+                    proto.update()
+                proto.update()
+
+            handles = []
+
+            def producer(thread_no):
+                for i in xrange(packets_per_thread):
+                    handles.append(proto.send(2 + i % 3, '%s:%s' % (thread_no, i), block=True, timeout=10))
+
+            io_thread = threading.Thread(target=io_loop)
+            io_thread.start()
+            producers = [threading.Thread(target=producer, args=(thread_no,)) for thread_no in range(threads_count)]
+            for thread in producers:
+                thread.start()
+            for thread in producers:
+                thread.join()
+            stop.set()
+            io_thread.join()
+
+            expected_payloads = set('%s:%s' % (thread_no, i) for thread_no in range(threads_count)
+                                    for i in xrange(packets_per_thread))
+            self.assertEquals(threads_count * packets_per_thread, len(sent_payloads))
+            self.assertEquals(expected_payloads, set(sent_payloads))
+            self.assertEquals(threads_count * packets_per_thread, len(set(handles)))
+            self.assertFalse(pjon_protocol_constants.FAIL in handles)
+            self.assertEquals(0, len(proto.outgoing_packets))
+
+    def test_destination_settings_from_other_thread_should_not_disturb_io_thread(self):
+        calls_count = 1000
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+            proto.send_string = mock.Mock(return_value=pjon_protocol_constants.ACK)
+            stop = threading.Event()
+            errors = []
+
+            def io_loop():
+                proto.attach_io_thread()
+                try:
+                    while not stop.is_set():
+                        proto.update()
+                    proto.update()
+                except Exception as e:
+                    errors.append(e)
+
+            io_thread = threading.Thread(target=io_loop)
+            io_thread.start()
+            policy = FixedBackoff(0)
+            try:
+                for i in xrange(calls_count):
+                    proto.send_many([(device_id, 'poll') for device_id in range(2, 12)])
+                    proto.set_backoff_policy(policy, device_id=100 + i)
+                    proto.set_circuit_breaker(False)
+            finally:
+                stop.set()
+                io_thread.join()
+
+            self.assertEquals([], errors)
+            for i in xrange(calls_count):
+                self.assertTrue(proto.get_destination(100 + i).backoff_policy is policy)
+
+    def test_dispatch_should_never_return_handle_equal_to_fail(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            serial_hw_strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=serial_hw_strategy)
+
+            for i in xrange(pjon_protocol_constants.FAIL + 1):
+                handle = proto.dispatch(2, 'test')
+                self.assertNotEquals(pjon_protocol_constants.FAIL, handle)
+                proto.cancel(handle)
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from pjon_python.strategies.pjon_rtt import RttEstimator
+
+
+class TestRttEstimator(TestCase):
+    def setUp(self):
+        self.rtt = RttEstimator()
+
+    def test_should_use_ceiling_until_first_sample(self):
+        self.assertEqual(0.5, self.rtt.timeout(0.001, 0.5))
+
+    def test_first_sample_should_initialize_smoothed_rtt_and_variance(self):
+        self.rtt.add_sample(0.002)
+
+        self.assertEqual(0.002, self.rtt.srtt)
+        self.assertEqual(0.001, self.rtt.rttvar)
+        self.assertAlmostEqual(0.006, self.rtt.timeout(0.001, 0.5))
+
+    def test_should_smooth_following_samples(self):
+        self.rtt.add_sample(0.002)
+        self.rtt.add_sample(0.004)
+
+        self.assertAlmostEqual(0.75 * 0.001 + 0.25 * 0.002, self.rtt.rttvar)
+        self.assertAlmostEqual(0.875 * 0.002 + 0.125 * 0.004, self.rtt.srtt)
+        self.assertEqual(0.002, self.rtt.min_rtt)
+        self.assertEqual(0.004, self.rtt.max_rtt)
+
+    def test_timeout_should_be_bounded_by_floor_and_ceiling(self):
+        self.rtt.add_sample(0.0001)
+        self.assertEqual(0.002, self.rtt.timeout(0.002, 0.5))
+
+        self.rtt.add_sample(1.0)
+        self.assertEqual(0.5, self.rtt.timeout(0.002, 0.5))
+
+    def test_timeouts_should_back_off_until_next_sample(self):
+        self.rtt.add_sample(0.002)
+        self.rtt.on_timeout()
+        self.rtt.on_timeout()
+
+        self.assertAlmostEqual(0.024, self.rtt.timeout(0.001, 0.5))
+        self.assertEqual(2, self.rtt.timeouts)
+
+        self.rtt.add_sample(0.002)
+        self.assertLess(self.rtt.timeout(0.001, 0.5), 0.024)
@@ -1,3 +1,4 @@
+import struct
 from unittest import TestCase
 from pjon_python.protocol.pjon_protocol import  ReceivedPacket
 
@@ -13,13 +14,26 @@ class TestReceivedPacket(TestCase):
         self.assertEqual('ABC123', self._rcv_packet.payload_as_string)
 
     def test_payload_as_chars(self):
-        self.assertEqual(['A', 'B', 'C', '1', '2', '3'], self._rcv_packet.payload_as_chars)
+        self.assertEqual(('A', 'B', 'C', '1', '2', '3'), self._rcv_packet.payload_as_chars)
 
     def test_payload_as_bytes(self):
-        self.assertEqual([65, 66, 67, 49, 50, 51], self._rcv_packet.payload_as_bytes)
+        self.assertEqual(b'ABC123', self._rcv_packet.payload_as_bytes)
+        self.assertEqual([65, 66, 67, 49, 50, 51], list(bytearray(self._rcv_packet.payload_as_bytes)))
 
     def test_packet_length(self):
         self.assertEqual(6, self._rcv_packet.packet_length)
 
     def test_packet_info(self):
         self.assertEqual(None, self._rcv_packet.packet_info)
+
+    def test_payload_views_should_be_cached(self):
+        self.assertIs(self._rcv_packet.payload_as_bytes, self._rcv_packet.payload_as_bytes)
+        self.assertIs(self._rcv_packet.payload_as_chars, self._rcv_packet.payload_as_chars)
+        self.assertIs(self._rcv_packet.payload_view, self._rcv_packet.payload_view)
+
+    def test_bytes_payload_should_be_kept_without_copy(self):
+        payload = b'\x01\x02\x03\x04'
+        packet = ReceivedPacket(payload, 4, None)
+        self.assertIs(payload, packet.payload_as_bytes)
+        self.assertEqual('\x01\x02\x03\x04', packet.payload_as_string)
+        self.assertEqual((0x0102, 0x0304), struct.unpack_from('>HH', packet.payload_view))
@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from pjon_python.protocol.pjon_protocol import PacketInfo, ReceivedPacket
+from pjon_python.protocol.pjon_received_store import ReceivedPacketsStore
+
+
+class TestReceivedPacketsStore(TestCase):
+    def setUp(self):
+        self.store = ReceivedPacketsStore(capacity=4)
+
+    def add_packet(self, sender_id, payload, receive_ts):
+        packet = ReceivedPacket(payload, len(payload), PacketInfo(receiver_id=1, sender_id=sender_id),
+                                receive_ts=receive_ts)
+        self.store.append(packet)
+        return packet
+
+    def test_append__should_overwrite_oldest_packets_when_full(self):
+        for i in range(6):
+            self.add_packet(10 + i % 2, 'p%s' % i, i)
+
+        self.assertEqual(4, len(self.store))
+        self.assertEqual(['p2', 'p3', 'p4', 'p5'], [packet.payload for packet in self.store])
+        self.assertEqual('p5', self.store[-1].payload)
+
+    def test_iter_received__should_filter_by_sender_and_ts(self):
+        for i in range(6):
+            self.add_packet(10 + i % 2, 'p%s' % i, i)
+
+        self.assertEqual(['p3', 'p5'], [packet.payload for packet in self.store.iter_received(sender=11)])
+        self.assertEqual(['p4', 'p5'], [packet.payload for packet in self.store.iter_received(since_ts=3)])
+        self.assertEqual(['p4'], [packet.payload for packet in self.store.iter_received(since_ts=3, sender=10)])
+        self.assertEqual([], list(self.store.iter_received(sender=12)))
+        self.assertEqual(4, len(self.store))
+
+    def test_latest__should_return_newest_packet_for_sender(self):
+        self.assertEqual(None, self.store.latest())
+        self.add_packet(10, 'a', 1)
+        self.add_packet(11, 'b', 2)
+        for i in range(4):
+            self.add_packet(12, 'c%s' % i, 3 + i)
+
+        self.assertEqual('c3', self.store.latest().payload)
+        self.assertEqual('c3', self.store.latest(sender=12).payload)
+        self.assertEqual(None, self.store.latest(sender=10))
+
+    def test_set_capacity__should_keep_newest_packets(self):
+        for i in range(4):
+            self.add_packet(10, 'p%s' % i, i)
+        self.store.set_capacity(2)
+
+        self.assertEqual(['p2', 'p3'], [packet.payload for packet in self.store])
+        self.assertEqual(['p2', 'p3'], [packet.payload for packet in self.store.iter_received(sender=10)])
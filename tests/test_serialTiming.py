@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from pjon_python.strategies.pjon_serial_timing import SerialTiming
+
+
+class TestSerialTiming(TestCase):
+    def test_inter_byte_timeout_should_scale_with_baud_rate(self):
+        slow = SerialTiming(baud_rate=9600, host_latency=0)
+        fast = SerialTiming(baud_rate=1000000, host_latency=0)
+
+        self.assertAlmostEqual(3 * 10.0 / 9600, slow.inter_byte_timeout())
+        self.assertAlmostEqual(3 * 10.0 / 1000000, fast.inter_byte_timeout())
+
+    def test_response_timeout_should_include_frame_turnaround_and_latency(self):
+        timing = SerialTiming(baud_rate=500000, turnaround=0.002, host_latency=0.001)
+
+        self.assertAlmostEqual(20 * 0.00002 + 0.002 + 0.00002 + 0.001, timing.response_timeout(20))
+
+    def test_response_timeout_at_high_baud_should_be_far_below_legacy_fixed_value(self):
+        self.assertLess(SerialTiming(baud_rate=500000).response_timeout(), 0.5 / 20)
+
+    def test_channel_clearance_should_not_drop_below_minimum(self):
+        self.assertAlmostEqual(10.0 / 9600, SerialTiming(baud_rate=9600).channel_clearance())
+        self.assertEqual(0.0001, SerialTiming(baud_rate=1000000).channel_clearance())
+
+    def test_should_be_overridable_in_subclass(self):
+        class SlowDeviceTiming(SerialTiming):
+            def response_timeout(self, frame_length=50):
+                return 1.0
+
+        self.assertEqual(1.0, SlowDeviceTiming().response_timeout(10))
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import mock
+
+from pjon_python.protocol import pjon_protocol
+from pjon_python.strategies import pjon_hwserial_strategy
+from pjon_python.utils import tracing
+
+
+class TestTracer(TestCase):
+    def test_record__should_keep_bounded_ring_of_events(self):
+        tracer = tracing.Tracer(capacity=2, enabled=True)
+        tracer.record(tracing.FRAME_TX, 1, 9, 2)
+        tracer.record(tracing.FRAME_TX, 2, 9, 2)
+        tracer.record(tracing.FRAME_RX, 1, 45, 9)
+
+        events = tracer.dump()
+        self.assertEqual([tracing.FRAME_TX, tracing.FRAME_RX], [event for ts, event, fields in events])
+        self.assertEqual((1, 45, 9), events[-1][2])
+        self.assertEqual(2, len(tracer.format_events(clear=True)))
+        self.assertEqual([], tracer.dump())
+
+    def test_protocol__should_not_record_events_when_tracing_disabled(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            ser.inWaiting.return_value = 0
+            strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+            proto.set_acknowledge(False)
+
+            proto.send_string(2, 'test', sender_id=1)
+            self.assertEqual([], proto.tracer.dump())
+
+    def test_protocol__should_record_frames_when_tracing_enabled(self):
+        with mock.patch('serial.Serial', create=True) as ser:
+            ser.inWaiting.return_value = 9
+            ser.read.return_value = bytearray([1, 9, 2, 45, 65, 65, 65, 65, 71])
+            strategy = pjon_hwserial_strategy.PJONserialStrategy(ser)
+            proto = pjon_protocol.PjonProtocol(1, strategy=strategy)
+            proto.set_acknowledge(False)
+            proto.tracer.enable()
+            strategy.can_start = mock.Mock(return_value=True)
+
+            proto.send_string(2, 'test', sender_id=1)
+            proto.receive()
+
+            events = [event for ts, event, fields in proto.tracer.dump()]
+            self.assertEqual([tracing.FRAME_TX, tracing.BYTES_RX, tracing.FRAME_RX], events)